@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Control de admisión delante de las rutas que usan la BD.
+#
+#   - LimitadorTasa: un cubo de fichas por (ruta, usuario o IP). Al vaciarse
+#     se responde 429 con Retry-After = segundos hasta la próxima ficha.
+#   - ControlAdmision: máximo de peticiones en curso ligado a las conexiones
+#     del pool, con una cola corta y acotada. Si la cola está llena o la
+#     espera vence se responde 503 al instante, en vez de acumular hilos que
+#     terminan con "Error CRÍTICO" al agotarse POOL_TIMEOUT.
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from configuracion_db import POOL_MAX_SIZE, DB_REPLICAS
+
+# --- Configuración de la Admisión ---
+# Regla de Flask -> (fichas por segundo, ráfaga) por usuario (o IP si no hay sesión)
+LIMITES_POR_RUTA = {
+    "/api/login": (0.5, 10),
+    "/api/register": (0.2, 5),
+    "/api/reservation": (2.0, 10),
+    "/api/process_payment": (2.0, 10),
+    "/api/reservations/import": (0.1, 3),
+    "/api/services/import": (0.1, 3),
+}
+ADMISION_MAX_EN_CURSO = POOL_MAX_SIZE * (1 + len(DB_REPLICAS))   # Una conexión por petición en curso
+ADMISION_COLA = POOL_MAX_SIZE       # Peticiones que pueden esperar turno
+ADMISION_ESPERA = 0.5               # Segundos máximos en la cola antes de responder 503
+ADMISION_REINTENTO = 1              # Retry-After (s) de las respuestas 503
+# Sin control de concurrencia: no usan la BD o son conexiones largas (SSE)
+RUTAS_SIN_ADMISION = {"/", "/metrics", "/api/history/stream"}
+LIMITADOR_MAX_CLAVES = 100000       # Cubos en memoria (LRU)
+
+
+class LimitadorTasa:
+    """
+    Cubos de fichas en un LRU. Cada cubo guarda (fichas, última recarga) y
+    se recarga de forma perezosa al consultarlo: O(1) por petición y sin
+    hilos de fondo.
+    """
+
+    def __init__(self, limites=None, max_claves=LIMITADOR_MAX_CLAVES, reloj=time.monotonic):
+        self.limites = LIMITES_POR_RUTA if limites is None else limites
+        self.max_claves = max_claves
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._cubos = OrderedDict()    # (ruta, clave) -> [fichas, instante]
+
+    def consumir(self, ruta, clave):
+        """Retorna 0 si la petición pasa o los segundos a esperar antes de reintentar."""
+        limite = self.limites.get(ruta)
+        if limite is None:
+            return 0
+        tasa, rafaga = limite
+        ahora = self.reloj()
+        with self._lock:
+            cubo = self._cubos.get((ruta, clave))
+            if cubo is None:
+                cubo = self._cubos[(ruta, clave)] = [float(rafaga), ahora]
+                if len(self._cubos) > self.max_claves:
+                    self._cubos.popitem(last=False)
+            else:
+                self._cubos.move_to_end((ruta, clave))
+                cubo[0] = min(float(rafaga), cubo[0] + (ahora - cubo[1]) * tasa)
+                cubo[1] = ahora
+            if cubo[0] >= 1.0:
+                cubo[0] -= 1.0
+                return 0
+            return (1.0 - cubo[0]) / tasa
+
+    def estadisticas(self):
+        with self._lock:
+            return {"claves": len(self._cubos)}
+
+
+class ControlAdmision:
+    """Semáforo con cola acotada y espera máxima; entrar() retorna False si se rechaza."""
+
+    def __init__(self, max_en_curso=ADMISION_MAX_EN_CURSO, cola=ADMISION_COLA, espera=ADMISION_ESPERA):
+        self.max_en_curso = max_en_curso
+        self.cola = cola
+        self.espera = espera
+        self._condicion = threading.Condition()
+        self._en_curso = 0
+        self._esperando = 0
+
+    def entrar(self):
+        with self._condicion:
+            if self._en_curso < self.max_en_curso:
+                self._en_curso += 1
+                return True
+            if self._esperando >= self.cola:
+                return False
+            self._esperando += 1
+            try:
+                admitida = self._condicion.wait_for(lambda: self._en_curso < self.max_en_curso, self.espera)
+                if admitida:
+                    self._en_curso += 1
+                return admitida
+            finally:
+                self._esperando -= 1
+
+    def intentar(self):
+        """Como entrar(), pero sin esperar turno: False si no hay cupo libre ahora."""
+        with self._condicion:
+            if self._en_curso < self.max_en_curso:
+                self._en_curso += 1
+                return True
+            return False
+
+    def salir(self):
+        with self._condicion:
+            self._en_curso -= 1
+            self._condicion.notify()
+
+    def estadisticas(self):
+        with self._condicion:
+            return {"en_curso": self._en_curso, "esperando": self._esperando, "max_en_curso": self.max_en_curso}
+
+
+def reintentar_en(segundos):
+    """Valor de Retry-After (entero, al menos 1 s)."""
+    return str(max(1, math.ceil(segundos)))
+
+
+# Instancias globales del proceso
+limitador_tasa = LimitadorTasa()
+control_admision = ControlAdmision()
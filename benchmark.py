@@ -0,0 +1,783 @@
+# -*- coding: utf-8 -*-
+# Suite de benchmarks de la API y de la lógica de negocio.
+#
+#   python benchmark.py --modo memoria            (db_executor falso en memoria)
+#   python benchmark.py --modo postgres           (BD desechable sembrada)
+#   python benchmark.py --modo memoria --actualizar-umbrales
+#   python benchmark.py --carga http://localhost:5000 http://localhost:5001 --concurrencia 500
+#                                                 (carga HTTP contra servidores ya levantados)
+#
+# Además mide el arranque en frío (import de server.py + create_app en un
+# intérprete nuevo) y, como lanzador.py, hace fork de --workers procesos que
+# calientan y atienden peticiones para reportar su memoria RSS y privada.
+#
+# Reporta p50/p95/p99 y peticiones/s por escenario y termina con código 1
+# si algún p95 supera el umbral guardado en benchmark_umbrales.json (en modo
+# postgres, también si una consulta caliente cae en Seq Scan).
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import datos_sinteticos
+from disponibilidad import ocupa_cupo
+from sentencias import sql_de
+
+UMBRALES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_umbrales.json")
+TOLERANCIA = 0.20          # Margen sobre el umbral antes de considerar regresión
+MARGEN_ACTUALIZAR = 2.0    # Al regenerar umbrales: p95 medido x este factor
+
+# =======================================================
+# DB_EXECUTOR FALSO EN MEMORIA
+# =======================================================
+
+class EjecutorEnMemoria:
+    """
+    Imita a execute_query sobre datos en memoria, reconociendo las consultas
+    de logica.py por su texto. Permite medir el coste de la aplicación sin BD.
+    """
+
+    def __init__(self, datos):
+        self.usuarios = {u[0]: u for u in datos["usuarios"]}
+        self.por_email = {u[1]: u for u in datos["usuarios"]}
+        self.servicios = {s[0]: s for s in datos["servicios"]}
+        self.reservas = {r[0]: r for r in datos["reservas"]}
+        self.pagos = {p[0]: p for p in datos["pagos"]}
+        self.pago_de_reserva = {p[1]: p[0] for p in datos["pagos"]}
+        self.claves = {}      # (ambito, clave) -> fila de claves_idempotencia
+        self.fallida = False
+        self.exitosa = False
+
+    @staticmethod
+    def _normalizar(query):
+        return " ".join(query.split()).lower()
+
+    def _fila_historial(self, r):
+        s = self.servicios[r[2]]
+        u = self.usuarios[r[1]]
+        p = self._pago(r[0])
+        return (r[0], s[3], r[3], r[4],
+                p[2] if p else None, p[3] if p else None, p[4] if p else None,
+                u[3], u[0])
+
+    def _pago(self, reserva_id):
+        return self.pagos.get(self.pago_de_reserva.get(reserva_id))
+
+    def _historial(self, q, params):
+        params = list(params or ())
+        filas = self.reservas.values()
+        if "r.usuario_id = %s" in q:
+            usuario = params.pop(0)
+            filas = [r for r in filas if r[1] == usuario]
+        if "(r.slot_time, r.id) <" in q:
+            corte = (params.pop(0), params.pop(0))
+            filas = [r for r in filas if (r[3], r[0]) < corte]
+        filas = sorted(filas, key=lambda r: (r[3], r[0]), reverse=True)
+        if "limit %s" in q:
+            filas = filas[:params.pop(0)]
+        return [self._fila_historial(r) for r in filas]
+
+    def _reporte(self, q, params):
+        desde, hasta = params[0], params[1]
+        ids = set(params[2]) if "any(%s)" in q else None
+        agregados = {}
+        for r in self.reservas.values():
+            dia = r[3].date()
+            if not desde <= dia <= hasta or (ids is not None and r[2] not in ids):
+                continue
+            fila = agregados.setdefault((dia, r[2]), [0, 0, 0.0, 0.0])
+            fila[0] += 1
+            fila[1] += 0 if ocupa_cupo(r[4]) else 1
+            p = self._pago(r[0])
+            if p is not None and p[4] != "RECHAZADO":
+                fila[2 if p[4] == "APROBADO" else 3] += p[2]
+        return [(sid, dia, *fila) for (dia, sid), fila in sorted(agregados.items())]
+
+    def __call__(self, query, params=None, fetch_data=False, fetch_all=False, query_name=None):
+        q = self._normalizar(sql_de(query))
+
+        if q.startswith("select id, name, password, role"):
+            u = self.por_email.get(params[0])
+            return (u[0], u[3], u[2], u[4], u[1], u[5], u[6], u[7]) if u else None
+        if q.startswith("select id from usuarios where email"):
+            u = self.por_email.get(params[0])
+            return (u[0],) if u else None
+        if "from servicios order by name" in q:
+            return [s for s in sorted(self.servicios.values(), key=lambda s: s[3])]
+        if "txid_snapshot_xmin" in q:
+            return [(0,) + (None,) * 10]   # El fake no registra cambio_tx: solo el cursor actual
+        if "from reservas r join servicios" in q:
+            return self._historial(q, params)
+        if q.startswith("select service_id, slot_time, status from reservas"):
+            return [(r[2], r[3], r[4]) for r in self.reservas.values() if r[3] >= params[0]]
+        if "from reporte_diario where dia between" in q:
+            return self._reporte(q, params)
+        if q.startswith(("delete from reporte_diario", "insert into reporte_diario")):
+            return 0      # Los reportes del fake se calculan al consultar
+        if "from claves_idempotencia where" in q:
+            return self.claves.get(tuple(params))
+        if q.startswith("insert into claves_idempotencia"):
+            self.claves[(params[0], params[1])] = (params[2], params[3], params[4], time.time() + params[5])
+            return 1
+        if q.startswith("delete from claves_idempotencia"):
+            return 0
+        if "pg_try_advisory_xact_lock" in q:
+            return (True,)
+        if "pg_advisory_xact_lock" in q:
+            return 1
+        if q.startswith("select id from usuarios where id = any"):
+            return [(i,) for i in params[0] if i in self.usuarios]
+        if q.startswith("select id from servicios where id = any"):
+            return [(i,) for i in params[0] if i in self.servicios]
+
+        if q.startswith("insert into usuarios"):
+            user_id, email, password, name, first, last, ident = params
+            fila = (user_id, email, password, name, "Cliente", first, last, ident, "Activo")
+            self.usuarios[user_id] = fila
+            self.por_email[email] = fila
+            return 1
+        if q.startswith("insert into servicios"):
+            self.servicios[params[0]] = tuple(params)
+            return 1
+        if "insert into reservas" in q:
+            reserva_id, usuario_id, slot_time, status, service_id = params[:5]
+            if service_id not in self.servicios:
+                return 0
+            self.reservas[reserva_id] = (reserva_id, usuario_id, service_id, slot_time, status)
+            return 1
+        if "insert into pagos" in q:
+            self.pagos[params[0]] = tuple(params)
+            self.pago_de_reserva[params[1]] = params[0]
+            return 1
+        if q.startswith("with liquidados as"):
+            estados = dict(zip(params[0], params[1]))
+            liquidados = 0
+            for pago_id, p in list(self.pagos.items()):
+                if pago_id in estados and p[4] == "PENDIENTE":
+                    self.pagos[pago_id] = p[:4] + (estados[pago_id],)
+                    liquidados += 1
+            return liquidados
+        if q.startswith("select p.id, p.reservation_id, p.amount, p.payment_method, p.status, r.usuario_id"):
+            p = self.pagos.get(params[0])
+            return p + (self.reservas[p[1]][1],) if p else None
+
+        return [] if fetch_all else None
+
+    # --- Interfaz de UnidadDeTrabajo ---
+
+    def execute_atomic(self, pasos):
+        result = None
+        for query, params in pasos:
+            result = self(query, params)
+        return result
+
+    def execute_values(self, query, filas, page_size=1000):
+        q = self._normalizar(query)
+        for fila in filas:
+            if q.startswith("insert into servicios"):
+                self.servicios[fila[0]] = tuple(fila)
+            elif q.startswith("insert into reservas"):
+                self.reservas[fila[0]] = tuple(fila)
+        return len(filas)
+
+    def abortar(self):
+        self.fallida = True
+
+    @contextmanager
+    def transaccion(self):
+        """Sin rollback real: basta para medir el camino feliz."""
+        self.fallida = False
+        self.exitosa = False
+        yield self
+        self.exitosa = not self.fallida
+
+# =======================================================
+# MEDICIÓN
+# =======================================================
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    k = (len(ordenados) - 1) * p / 100.0
+    inferior = int(k)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (k - inferior)
+
+
+def medir(funcion, iteraciones, calentamiento=5):
+    for _ in range(calentamiento):
+        funcion()
+    tiempos = []
+    inicio_total = time.perf_counter()
+    for _ in range(iteraciones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000.0)
+    total = time.perf_counter() - inicio_total
+    return {
+        "p50_ms": round(percentil(tiempos, 50), 4),
+        "p95_ms": round(percentil(tiempos, 95), 4),
+        "p99_ms": round(percentil(tiempos, 99), 4),
+        "media_ms": round(statistics.fmean(tiempos), 4),
+        "req_s": round(iteraciones / total, 1) if total > 0 else 0.0,
+    }
+
+# =======================================================
+# ESCENARIOS
+# =======================================================
+
+class Contador:
+    def __init__(self):
+        self.n = 0
+
+    def siguiente(self):
+        self.n += 1
+        return self.n
+
+
+def escenarios_logica(db, transaccion, datos):
+    """Una entrada por método público de las clases de logica.py."""
+    from logica import Login, Usuario, Servicio, HistorialReservas, Reserva, Pago, ReservaConPago
+    from reportes import Reportes
+    from admision import LimitadorTasa
+
+    cliente = next(u for u in datos["usuarios"] if u[4] == "Cliente")
+    limitador = LimitadorTasa({"/api/reservation": (1e6, 1e6)})
+    servicio = datos["servicios"][0]
+    n = Contador()
+    hoy = datetime.now().date()
+    hace_30 = hoy - timedelta(days=30)
+
+    def catalogo():
+        return Servicio(None, db).obtener_todos()["data"]
+
+    def reserva_data():
+        return {
+            "usuarioId": cliente[0], "serviceId": servicio[0],
+            "slotTime": f"2030-01-01 {8 + n.siguiente() % 10}:00:00", "status": "Confirmada",
+            "userEmail": cliente[1], "serviceName": servicio[3],
+        }
+
+    return [
+        ("logica.Login.autenticar", lambda: Login(cliente[1], cliente[2], db).autenticar()),
+        ("logica.Usuario.existe_en_bd", lambda: Usuario({"email": cliente[1]}, db).existe_en_bd()),
+        ("logica.Usuario.registrar", lambda: Usuario({
+            "email": f"nuevo{n.siguiente()}-{uuid.uuid4().hex[:6]}@bench.local", "password": "secreto123",
+            "firstName": "Ana", "lastName": "Bench"}, db).registrar()),
+        ("logica.Servicio.obtener_todos", lambda: Servicio(None, db).obtener_todos()),
+        ("logica.Servicio.buscar", lambda: Servicio(None, db).buscar(
+            {"q": servicio[3].split()[0], "max_price": "200", "sort": "price"})),
+        ("logica.Servicio.crear", lambda: Servicio({
+            "providerId": servicio[1], "expertName": "Bench", "name": f"Bench {n.siguiente()}",
+            "price": 10, "duration": 30, "capacity": 5, "modality": "Virtual", "desc": "bench"}, db).crear()),
+        ("logica.HistorialReservas.cliente", lambda: HistorialReservas(
+            {"usuario_id": cliente[0], "is_manager": False}, db).obtener_historial()),
+        ("logica.HistorialReservas.manager_pagina", lambda: HistorialReservas(
+            {"usuario_id": cliente[0], "is_manager": True}, db).obtener_pagina(50)),
+        ("logica.Reserva.crear_reserva", lambda: Reserva(reserva_data(), db).crear_reserva()),
+        ("logica.Pago.procesar_pago", lambda: Pago(
+            {"metodo": "online", "monto": 50, "reserva_id": datos["reservas"][0][0]}, db).procesar_pago()),
+        ("logica.ReservaConPago.procesar", lambda: ReservaConPago(
+            dict(reserva_data(), pago={"metodo": "online", "monto": 50}), transaccion).procesar()),
+        ("reportes.Reportes.consultar (30 días)", lambda: Reportes(
+            {"from": f"{hace_30:%Y-%m-%d}", "to": f"{hoy:%Y-%m-%d}"}, db, catalogo()).consultar()),
+        ("admision.LimitadorTasa.consumir", lambda: limitador.consumir(
+            "/api/reservation", f"u{n.siguiente() % 10000}")),
+    ]
+
+
+def _sin_error(nombre, peticion):
+    """Un escenario HTTP que responde con error mediría el camino de error: se detiene el benchmark."""
+    def envoltura():
+        respuesta = peticion()
+        if respuesta.status_code >= 400:
+            raise RuntimeError(f"{nombre}: HTTP {respuesta.status_code} ({respuesta.get_data(as_text=True)[:200]})")
+        return respuesta
+    return envoltura
+
+
+def escenarios_api(client, datos):
+    """Una entrada por endpoint de server.py; cada una debe responder sin error."""
+    admin = datos["usuarios"][0]
+    cliente = next(u for u in datos["usuarios"] if u[4] == "Cliente")
+    servicio = datos["servicios"][0]
+    n = Contador()
+    etag = client.get("/api/services").headers.get("ETag", "")
+
+    def cabecera_sesion(usuario):
+        token = client.post("/api/login", json={"email": usuario[1], "password": usuario[2]}).get_json()["token"]
+        return {"Authorization": f"Bearer {token}"}
+
+    sesion_cliente = cabecera_sesion(cliente)
+    sesion_admin = cabecera_sesion(admin)
+
+    def reserva_json(con_pago=False):
+        data = {
+            "usuarioId": cliente[0], "serviceId": servicio[0],
+            "slotTime": f"2030-02-01 {8 + n.siguiente() % 10}:00:00", "status": "Confirmada",
+            "userEmail": cliente[1], "serviceName": servicio[3],
+        }
+        if con_pago:
+            data["pago"] = {"metodo": "online", "monto": 50}
+        return data
+
+    # Un reintento: la primera petición inserta y las siguientes repiten la respuesta guardada
+    reserva_repetida = reserva_json()
+    clave_repetida = uuid.uuid4().hex
+
+    def import_json():
+        return [{"usuarioId": cliente[0], "serviceId": servicio[0], "slotTime": "2029-05-05 10:00:00",
+                 "status": "Confirmada"} for _ in range(100)]
+
+    escenarios = [
+        ("api.POST /api/login", lambda: client.post("/api/login", json={"email": cliente[1], "password": cliente[2]})),
+        ("api.POST /api/register", lambda: client.post("/api/register", json={
+            "email": f"api{n.siguiente()}-{uuid.uuid4().hex[:6]}@bench.local", "password": "secreto123",
+            "firstName": "Ana", "lastName": "Bench"})),
+        ("api.GET /api/services", lambda: client.get("/api/services")),
+        ("api.GET /api/services (304)", lambda: client.get("/api/services", headers={"If-None-Match": etag})),
+        ("api.GET /api/services/search", lambda: client.get(
+            f"/api/services/search?q={servicio[3].split()[0]}&sort=-price&limit=20")),
+        ("api.POST /api/service", lambda: client.post("/api/service", json={
+            "providerId": servicio[1], "expertName": "Bench", "name": f"Api {n.siguiente()}",
+            "price": 10, "duration": 30, "capacity": 5, "modality": "Virtual", "desc": "bench"})),
+        ("api.GET /api/availability", lambda: client.get(
+            f"/api/availability?service_ids={servicio[0]}&from={datetime.now():%Y-%m-%d}")),
+        ("api.POST /api/reservation", lambda: client.post("/api/reservation", json=reserva_json())),
+        ("api.POST /api/reservation (con pago)", lambda: client.post("/api/reservation", json=reserva_json(True))),
+        ("api.POST /api/reservation (Idempotency-Key repetida)", lambda: client.post(
+            "/api/reservation", json=reserva_repetida, headers={"Idempotency-Key": clave_repetida})),
+        ("api.POST /api/process_payment", lambda: client.post("/api/process_payment", json={
+            "metodo": "online", "monto": 50, "reserva_id": datos["reservas"][0][0]})),
+        ("api.GET /api/payment", lambda: client.get(f"/api/payment/{datos['pagos'][0][0]}", headers=sesion_admin)),
+        ("api.GET /api/history cliente", lambda: client.get(
+            f"/api/history/{cliente[0]}/Cliente", headers=sesion_cliente)),
+        ("api.GET /api/history manager paginado", lambda: client.get(
+            f"/api/history/{admin[0]}/Administrador?limit=50", headers=sesion_admin)),
+        ("api.GET /api/history/changes", lambda: client.get(
+            "/api/history/changes", headers=sesion_cliente)),
+        ("api.GET /api/reports (30 días)", lambda: client.get(
+            f"/api/reports?from={datetime.now() - timedelta(days=30):%Y-%m-%d}&to={datetime.now():%Y-%m-%d}",
+            headers=sesion_admin)),
+        ("api.POST /api/reservations/import", lambda: client.post("/api/reservations/import", json=import_json())),
+    ]
+    return [(nombre, _sin_error(nombre, peticion)) for nombre, peticion in escenarios]
+
+def escenarios_sentencias(datos):
+    """
+    Solo en modo postgres: la misma consulta del historial (join de cuatro
+    tablas, página de 50) como texto SQL y como sentencia preparada.
+    """
+    import configuracion_db
+    from logica import HistorialReservas
+
+    admin = datos["usuarios"][0]
+    cliente = next(u for u in datos["usuarios"] if u[4] == "Cliente")
+
+    def con_preparadas(valor, funcion):
+        def envoltura():
+            configuracion_db.USAR_SENTENCIAS_PREPARADAS = valor
+            try:
+                funcion()
+            finally:
+                configuracion_db.USAR_SENTENCIAS_PREPARADAS = True
+        return envoltura
+
+    pagina = lambda: HistorialReservas(
+        {"usuario_id": admin[0], "is_manager": True}, configuracion_db.execute_query).obtener_pagina(50)
+    cliente_hist = lambda: HistorialReservas(
+        {"usuario_id": cliente[0], "is_manager": False}, configuracion_db.execute_query).obtener_historial()
+
+    return [
+        ("db.history_join manager (texto)", con_preparadas(False, pagina)),
+        ("db.history_join manager (preparada)", con_preparadas(True, pagina)),
+        ("db.history_join cliente (texto)", con_preparadas(False, cliente_hist)),
+        ("db.history_join cliente (preparada)", con_preparadas(True, cliente_hist)),
+    ]
+
+
+def reportar_ahorro_preparadas(resultados):
+    for variante in ("manager", "cliente"):
+        texto = resultados.get(f"db.history_join {variante} (texto)")
+        preparada = resultados.get(f"db.history_join {variante} (preparada)")
+        if texto and preparada:
+            ahorro = texto["p50_ms"] - preparada["p50_ms"]
+            print(f"Ahorro por sentencia preparada (history_join {variante}): "
+                  f"{ahorro:.3f} ms en p50 ({ahorro / texto['p50_ms'] * 100 if texto['p50_ms'] else 0:.1f}%)")
+
+
+# =======================================================
+# PREPARACIÓN DE LOS MODOS
+# =======================================================
+
+def silenciar_correos():
+    from notificaciones import cola_notificaciones, BackendArchivo
+    cola_notificaciones.backend = BackendArchivo(os.devnull)
+
+
+def preparar_memoria(datos):
+    """Inyecta el ejecutor en memoria en el servidor y en los módulos que lo usan."""
+    import server
+
+    fake = EjecutorEnMemoria(datos)
+    server.execute_query = fake
+    server.execute_atomic = fake.execute_atomic
+    server.stream_query = lambda query, params=None: iter(fake(query, params, fetch_all=True))
+    server.transaccion = fake.transaccion
+    server.actualizador_reportes.transaccion = fake.transaccion
+    server.liquidador_pagos.transaccion = fake.transaccion
+    return fake, fake.transaccion, lambda: None
+
+
+def preparar_postgres(datos):
+    """Crea una BD desechable, la siembra y apunta configuracion_db hacia ella."""
+    import psycopg2
+    import configuracion_db
+
+    nombre = f"bench_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(host=configuracion_db.DB_HOST, database="postgres", user=configuracion_db.DB_USER,
+                             password=configuracion_db.DB_PASSWORD, port=configuracion_db.DB_PORT)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE DATABASE {nombre}")
+
+    configuracion_db.DB_NAME = nombre
+    configuracion_db.DB_PRIMARY_DSN = None
+    configuracion_db.DB_REPLICAS = []     # Las réplicas no tienen la BD desechable
+    configuracion_db._pool = None
+
+    with configuracion_db.transaccion() as uow:
+        datos_sinteticos.sembrar(uow, datos)
+    if not uow.exitosa:
+        raise RuntimeError("No se pudo sembrar la base de datos del benchmark.")
+
+    def limpiar():
+        configuracion_db.obtener_pool().cerrar_todo()
+        with admin.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {nombre}")
+        admin.close()
+
+    return configuracion_db.execute_query, configuracion_db.transaccion, limpiar
+
+# =======================================================
+# UMBRALES
+# =======================================================
+
+def comparar(resultados, umbrales):
+    """
+    Lista de regresiones: escenarios cuyo p95 supera su umbral + tolerancia,
+    y escenarios sin umbral (un escenario nuevo no puede quedar sin control).
+    """
+    regresiones = []
+    for nombre, stats in resultados.items():
+        limite = umbrales.get(nombre, {}).get("p95_ms")
+        if limite is None:
+            regresiones.append(f"{nombre}: sin umbral guardado (regenere con --actualizar-umbrales)")
+        elif stats["p95_ms"] > limite * (1 + TOLERANCIA):
+            regresiones.append(f"{nombre}: p95 {stats['p95_ms']:.3f} ms > umbral {limite:.3f} ms")
+    return regresiones
+
+
+def cargar_umbrales(ruta):
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def guardar_umbrales(ruta, modo, resultados, umbrales):
+    """Actualiza los umbrales de los escenarios medidos; con --filtro el resto se conserva."""
+    umbrales.setdefault(modo, {}).update({
+        nombre: {"p95_ms": round(max(stats["p95_ms"] * MARGEN_ACTUALIZAR, 0.05), 3)}
+        for nombre, stats in resultados.items()
+    })
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(umbrales, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write("\n")
+
+# =======================================================
+# CARGA CONCURRENTE (SERVIDOR SÍNCRONO VS ASGI)
+# =======================================================
+
+async def _peticion_http(host, puerto, ruta, cabeceras):
+    """GET HTTP/1.1 mínimo sobre asyncio; devuelve (status, ms)."""
+    inicio = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, puerto)
+    try:
+        extra = "".join(f"{k}: {v}\r\n" for k, v in cabeceras.items())
+        writer.write(f"GET {ruta} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n{extra}\r\n".encode("latin-1"))
+        await writer.drain()
+        linea = await reader.readline()
+        await reader.read()
+    finally:
+        writer.close()
+    status = int(linea.split()[1]) if linea else 0
+    return status, (time.perf_counter() - inicio) * 1000.0
+
+
+async def _carga(url, ruta, concurrencia, peticiones, cabeceras):
+    partes = urlsplit(url)
+    host, puerto = partes.hostname, partes.port or 80
+    semaforo = asyncio.Semaphore(concurrencia)
+    tiempos, errores = [], 0
+
+    async def una():
+        nonlocal errores
+        async with semaforo:
+            try:
+                status, ms = await _peticion_http(host, puerto, ruta, cabeceras)
+            except OSError:
+                errores += 1
+                return
+            if status >= 400 or status == 0:
+                errores += 1
+            tiempos.append(ms)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(peticiones)))
+    total = time.perf_counter() - inicio
+    return {
+        "p50_ms": round(percentil(tiempos, 50), 4),
+        "p95_ms": round(percentil(tiempos, 95), 4),
+        "p99_ms": round(percentil(tiempos, 99), 4),
+        "errores": errores,
+        "req_s": round(peticiones / total, 1) if total > 0 else 0.0,
+    }
+
+
+def medir_carga(urls, ruta, concurrencia, peticiones, token=None):
+    """
+    Lanza `peticiones` GET a `ruta` con `concurrencia` conexiones simultáneas
+    contra cada servidor (p. ej. server.py y server_async.py con hypercorn).
+    """
+    cabeceras = {"Authorization": f"Bearer {token}"} if token else {}
+    resultados = {}
+    for url in urls:
+        stats = asyncio.run(_carga(url, ruta, concurrencia, peticiones, cabeceras))
+        resultados[f"carga {url}{ruta}"] = stats
+        print(f"{url + ruta:<45} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+              f"p99 {stats['p99_ms']:>9.3f} ms  {stats['req_s']:>10.1f} req/s  {stats['errores']} errores")
+    return resultados
+
+# =======================================================
+# ARRANQUE EN FRÍO Y MEMORIA POR WORKER
+# =======================================================
+
+# Se ejecuta en un intérprete nuevo: sin BD, porque create_app() no conecta
+_CODIGO_ARRANQUE = """
+import json, time
+inicio = time.perf_counter()
+import server
+importado = time.perf_counter()
+server.create_app()
+print(json.dumps({"import_ms": (importado - inicio) * 1000.0, "create_app_ms": (time.perf_counter() - importado) * 1000.0}))
+"""
+
+
+def resumir(tiempos):
+    return {
+        "p50_ms": round(percentil(tiempos, 50), 4),
+        "p95_ms": round(percentil(tiempos, 95), 4),
+        "p99_ms": round(percentil(tiempos, 99), 4),
+        "media_ms": round(statistics.fmean(tiempos), 4),
+    }
+
+
+def memoria_kb(campos):
+    """Suma de `campos` de /proc/self/smaps_rollup en kB; None fuera de Linux."""
+    try:
+        with open("/proc/self/smaps_rollup", encoding="ascii") as f:
+            return sum(int(linea.split()[1]) for linea in f if linea.split(":")[0] in campos)
+    except OSError:
+        return None
+
+
+def medir_arranque(repeticiones):
+    """Import de server.py + create_app() en `repeticiones` intérpretes nuevos."""
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    tiempos = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, "-c", _CODIGO_ARRANQUE], cwd=directorio,
+                                capture_output=True, text=True, check=True)
+        medida = json.loads(salida.stdout.strip().splitlines()[-1])
+        tiempos.append(medida["import_ms"] + medida["create_app_ms"])
+    return resumir(tiempos)
+
+
+def medir_workers(workers, conexiones, peticiones=50):
+    """
+    Hace fork de `workers` procesos desde este, que ya importó server.py
+    (como lanzador.py con precarga). Cada uno ejecuta calentar(), atiende
+    `peticiones` GET /api/services y reporta el tiempo de calentamiento y
+    su memoria: RSS y privada (lo que no comparte con el proceso padre).
+    """
+    import server
+
+    hijos = []
+    for _ in range(workers):
+        lectura, escritura = os.pipe()
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(lectura)
+                calentamiento = server.calentar(conexiones)
+                client = server.app.test_client()
+                for _ in range(peticiones):
+                    client.get("/api/services")
+                medida = {
+                    "calentar_ms": round(calentamiento * 1000.0, 3),
+                    "rss_kb": memoria_kb({"Rss"}),
+                    "privada_kb": memoria_kb({"Private_Clean", "Private_Dirty"}),
+                }
+                os.write(escritura, json.dumps(medida).encode("ascii"))
+            except Exception as e:
+                print(f"ERROR en el worker de medición: {e}")
+            finally:
+                sys.stdout.flush()
+                os._exit(0)
+        os.close(escritura)
+        hijos.append((pid, lectura))
+
+    medidas = []
+    for pid, lectura in hijos:
+        with os.fdopen(lectura, "rb") as f:
+            crudo = f.read()
+        os.waitpid(pid, 0)
+        if crudo:
+            medidas.append(json.loads(crudo))
+    return medidas
+
+
+def reportar_arranque(args, resultados):
+    """
+    Agrega a `resultados` el arranque en frío y el calentamiento por worker
+    (con umbral como cualquier escenario) y retorna las medidas de memoria.
+    Se mide antes que los escenarios: el padre aún no tiene hilos en segundo plano.
+    """
+    if args.arranques > 0:
+        stats = resultados["arranque.import+create_app"] = medir_arranque(args.arranques)
+        print(f"{'arranque.import+create_app':<45} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+              f"p99 {stats['p99_ms']:>9.3f} ms")
+    if args.workers <= 0 or not hasattr(os, "fork"):
+        return []
+
+    medidas = medir_workers(args.workers, args.modo == "postgres")
+    if medidas:
+        stats = resultados["arranque.calentar"] = resumir([m["calentar_ms"] for m in medidas])
+        print(f"{'arranque.calentar':<45} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+              f"p99 {stats['p99_ms']:>9.3f} ms")
+    for i, m in enumerate(medidas):
+        if m["rss_kb"] is not None:
+            print(f"  worker {i}: RSS {m['rss_kb'] / 1024:.1f} MB, privada {m['privada_kb'] / 1024:.1f} MB")
+    return medidas
+
+# =======================================================
+# MAIN
+# =======================================================
+
+def ejecutar(args):
+    datos = datos_sinteticos.generar(args.usuarios, args.servicios, args.reservas, args.semilla)
+    silenciar_correos()
+
+    if args.modo == "memoria":
+        db, transaccion, limpiar = preparar_memoria(datos)
+    else:
+        db, transaccion, limpiar = preparar_postgres(datos)
+
+    resultados = {}
+    problemas_planes = []
+    memoria = []
+    try:
+        if args.modo == "postgres":
+            import configuracion_db
+            import esquema
+            problemas_planes = esquema.verificar_planes(configuracion_db.conectar_db)
+
+        filtro = re.compile(args.filtro) if args.filtro else None
+        if not filtro or filtro.search("arranque"):
+            memoria = reportar_arranque(args, resultados)
+
+        from server import app, limitador_tasa
+        # Se mide el coste de cada endpoint, no el límite por usuario (el cliente de prueba es uno solo)
+        limitador_tasa.limites = {}
+        client = app.test_client()
+        escenarios = escenarios_logica(db, transaccion, datos) + escenarios_api(client, datos)
+        if args.modo == "postgres":
+            escenarios += escenarios_sentencias(datos)
+        for nombre, funcion in escenarios:
+            if filtro and not filtro.search(nombre):
+                continue
+            resultados[nombre] = medir(funcion, args.iteraciones)
+            stats = resultados[nombre]
+            print(f"{nombre:<45} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+                  f"p99 {stats['p99_ms']:>9.3f} ms  {stats['req_s']:>10.1f} req/s")
+    finally:
+        limpiar()
+    reportar_ahorro_preparadas(resultados)
+    return resultados, problemas_planes, memoria
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks de la API de reservas.")
+    ap.add_argument("--modo", choices=["memoria", "postgres"], default="memoria")
+    ap.add_argument("--iteraciones", type=int, default=200)
+    ap.add_argument("--usuarios", type=int, default=1000)
+    ap.add_argument("--servicios", type=int, default=100)
+    ap.add_argument("--reservas", type=int, default=10000)
+    ap.add_argument("--semilla", type=int, default=42)
+    ap.add_argument("--filtro", help="Expresión regular para elegir escenarios")
+    ap.add_argument("--umbrales", default=UMBRALES_PATH)
+    ap.add_argument("--actualizar-umbrales", action="store_true")
+    ap.add_argument("--json", help="Ruta donde guardar los resultados")
+    ap.add_argument("--carga", nargs="+", metavar="URL", help="Servidores en marcha contra los que medir carga HTTP")
+    ap.add_argument("--ruta", default="/api/services", help="Ruta a pedir en modo --carga")
+    ap.add_argument("--concurrencia", type=int, default=200)
+    ap.add_argument("--peticiones", type=int, default=5000)
+    ap.add_argument("--token", help="Token Bearer para rutas con sesión en modo --carga")
+    ap.add_argument("--arranques", type=int, default=5, help="Intérpretes nuevos para medir el arranque en frío (0 = no)")
+    ap.add_argument("--workers", type=int, default=2, help="Workers a los que medir calentamiento y memoria (0 = no)")
+    args = ap.parse_args(argv)
+
+    if args.carga:
+        resultados = medir_carga(args.carga, args.ruta, args.concurrencia, args.peticiones, args.token)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"modo": "carga", "resultados": resultados}, f, indent=2, ensure_ascii=False)
+        return 0
+
+    resultados, problemas_planes, memoria = ejecutar(args)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"modo": args.modo, "resultados": resultados, "memoria_workers": memoria},
+                      f, indent=2, ensure_ascii=False)
+
+    umbrales = cargar_umbrales(args.umbrales)
+    if args.actualizar_umbrales:
+        guardar_umbrales(args.umbrales, args.modo, resultados, umbrales)
+        print(f"Umbrales de '{args.modo}' actualizados en {args.umbrales}")
+        return 0
+
+    regresiones = comparar(resultados, umbrales.get(args.modo, {})) + problemas_planes
+    if regresiones:
+        print("\nREGRESIONES DE RENDIMIENTO:")
+        for r in regresiones:
+            print(f"  - {r}")
+        return 1
+    print("\nSin regresiones respecto a los umbrales.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
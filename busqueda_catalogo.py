@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import bisect
+import itertools
+import re
+import threading
+import time
+import unicodedata
+
+from cache_catalogo import CATALOGO_TTL
+
+# --- Configuración de la Búsqueda ---
+BUSQUEDA_LIMITE_DEFAULT = 20
+BUSQUEDA_LIMITE_MAX = 100
+CAMPOS_TEXTO = ("name", "desc", "expertName")
+ORDENES = ("name", "price", "duration")
+
+_PATRON_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, para que 'Masajé' y 'masaje' coincidan."""
+    descompuesto = unicodedata.normalize("NFKD", str(texto or ""))
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+
+def tokenizar(texto):
+    return _PATRON_TOKEN.findall(normalizar(texto))
+
+
+def _numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class IndiceCatalogo:
+    """
+    Índice en memoria del catálogo de servicios para /api/services/search:
+      - índice invertido de tokens de name/desc/expertName (con prefijos),
+      - listas ordenadas de precio y duración para rangos (búsqueda binaria),
+      - cubetas por categoría y modalidad.
+    Los servicios se identifican por su posición en self._servicios. Se
+    reconstruye desde el catálogo cada CATALOGO_TTL s y entre tanto se
+    actualiza de forma incremental con cada Servicio.crear.
+
+    self._version es la mayor versión de cache_catalogo que ya refleja el
+    índice: un catálogo leído antes de un agregar() no lo reemplaza.
+    """
+
+    def __init__(self, ttl=CATALOGO_TTL, reloj=time.monotonic):
+        self.ttl = ttl
+        self.reloj = reloj
+        self._lock = threading.RLock()
+        self._cargado_en = None
+        self._version = 0
+        self._vaciar()
+
+    def _vaciar(self):
+        self._servicios = []        # posición -> dict del catálogo
+        self._invertido = {}        # token -> {posiciones}
+        self._vocabulario = []      # tokens ordenados (para prefijos)
+        self._categorias = {}       # categoría normalizada -> {posiciones}
+        self._modalidades = {}      # modalidad normalizada -> {posiciones}
+        self._ordenados = {campo: ([], []) for campo in ORDENES}   # campo -> (claves, posiciones)
+        self._claves = {campo: [] for campo in ORDENES}            # campo -> clave por posición
+
+    def vigente(self):
+        return self._cargado_en is not None and (self.reloj() - self._cargado_en) < self.ttl
+
+    def invalidar(self):
+        with self._lock:
+            self._cargado_en = None
+
+    def reemplazar(self, servicios, version):
+        """
+        Reconstruye el índice con la lista de servicios del catálogo.
+        `version` es cache_catalogo.version leída ANTES de obtener la lista;
+        si el índice ya vio una posterior (un agregar concurrente) no se
+        reconstruye y sigue sin estar vigente, para recargar en la próxima.
+        """
+        if servicios is None:
+            return False
+        with self._lock:
+            if version < self._version:
+                return False
+            self._version = version
+            self._vaciar()
+            for servicio in servicios:
+                self._indexar(servicio)
+            self._cargado_en = self.reloj()
+        return True
+
+    def agregar(self, servicio, version):
+        """Agrega un servicio recién creado sin reconstruir el índice; `version` es la de su invalidar()."""
+        with self._lock:
+            self._version = max(self._version, version)
+            self._indexar(servicio)
+
+    def _indexar(self, servicio):
+        pos = len(self._servicios)
+        self._servicios.append(servicio)
+
+        tokens = set()
+        for campo in CAMPOS_TEXTO:
+            tokens.update(tokenizar(servicio.get(campo)))
+        for token in tokens:
+            posiciones = self._invertido.get(token)
+            if posiciones is None:
+                posiciones = self._invertido[token] = set()
+                bisect.insort(self._vocabulario, token)
+            posiciones.add(pos)
+
+        self._categorias.setdefault(normalizar(servicio.get("category")), set()).add(pos)
+        self._modalidades.setdefault(normalizar(servicio.get("modality")), set()).add(pos)
+
+        for campo in ORDENES:
+            claves, posiciones = self._ordenados[campo]
+            clave = self._clave(campo, servicio)
+            self._claves[campo].append(clave)
+            i = bisect.bisect_right(claves, clave)
+            claves.insert(i, clave)
+            posiciones.insert(i, pos)
+
+    @staticmethod
+    def _clave(campo, servicio):
+        if campo == "name":
+            return normalizar(servicio.get("name"))
+        return _numero(servicio.get(campo))
+
+    def _por_token(self, token):
+        """Posiciones cuyo texto contiene una palabra que empieza por `token`."""
+        i = bisect.bisect_left(self._vocabulario, token)
+        encontrados = set()
+        while i < len(self._vocabulario) and self._vocabulario[i].startswith(token):
+            encontrados |= self._invertido[self._vocabulario[i]]
+            i += 1
+        return encontrados
+
+    def _por_rango(self, campo, minimo, maximo):
+        claves, posiciones = self._ordenados[campo]
+        inicio = bisect.bisect_left(claves, minimo) if minimo is not None else 0
+        fin = bisect.bisect_right(claves, maximo) if maximo is not None else len(claves)
+        return set(posiciones[inicio:fin])
+
+    def buscar(self, texto=None, categoria=None, modalidad=None, precio_min=None, precio_max=None,
+               duracion_min=None, duracion_max=None, orden="name", descendente=False,
+               pagina=1, limite=BUSQUEDA_LIMITE_DEFAULT):
+        """Retorna (total, servicios de la página) que cumplen todos los filtros."""
+        with self._lock:
+            conjuntos = []
+            for token in tokenizar(texto):
+                conjuntos.append(self._por_token(token))
+            if categoria:
+                conjuntos.append(self._categorias.get(normalizar(categoria), set()))
+            if modalidad:
+                conjuntos.append(self._modalidades.get(normalizar(modalidad), set()))
+            if precio_min is not None or precio_max is not None:
+                conjuntos.append(self._por_rango("price", precio_min, precio_max))
+            if duracion_min is not None or duracion_max is not None:
+                conjuntos.append(self._por_rango("duration", duracion_min, duracion_max))
+
+            claves, posiciones = self._ordenados[orden]
+            desplazamiento = (pagina - 1) * limite
+
+            if not conjuntos:
+                # Sin filtros: la página sale directamente de la lista ordenada
+                total = len(posiciones)
+                if descendente:
+                    fin = total - desplazamiento
+                    pagina_pos = posiciones[max(fin - limite, 0):max(fin, 0)][::-1]
+                else:
+                    pagina_pos = posiciones[desplazamiento:desplazamiento + limite]
+                return total, [self._servicios[p] for p in pagina_pos]
+
+            # Intersección empezando por el conjunto más pequeño
+            conjuntos.sort(key=len)
+            candidatos = set(conjuntos[0])
+            for conjunto in conjuntos[1:]:
+                candidatos &= conjunto
+                if not candidatos:
+                    break
+
+            if len(candidatos) * 4 >= len(posiciones):
+                # Resultado denso: se recorre la lista ordenada hasta llenar la página
+                recorrido = reversed(posiciones) if descendente else posiciones
+                seleccion = itertools.islice((p for p in recorrido if p in candidatos),
+                                             desplazamiento, desplazamiento + limite)
+                return len(candidatos), [self._servicios[p] for p in seleccion]
+
+            clave_de = self._claves[orden]
+            ordenados = sorted(candidatos, key=lambda p: (clave_de[p], p), reverse=descendente)
+            return len(candidatos), [self._servicios[p] for p in ordenados[desplazamiento:desplazamiento + limite]]
+
+    def estadisticas(self):
+        return {"servicios": len(self._servicios), "tokens": len(self._vocabulario)}
+
+
+# Instancia global del proceso
+indice_catalogo = IndiceCatalogo()
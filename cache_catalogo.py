@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import threading
+import time
+
+# --- Configuración del Cache del Catálogo ---
+# El TTL es el respaldo cuando varios workers comparten la BD: un worker no se
+# entera de los servicios creados por otro, así que recarga cada CATALOGO_TTL s.
+CATALOGO_TTL = 30.0
+
+
+class CacheCatalogo:
+    """
+    Cache de lectura (read-through) del catálogo de servicios.
+    Guarda la lista ya serializada en JSON y un ETag derivado de su contenido,
+    de modo que una petición condicional se responde con 304 sin tocar PostgreSQL.
+    """
+
+    def __init__(self, ttl=CATALOGO_TTL, reloj=time.monotonic):
+        self.ttl = ttl
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._entrada = None      # (datos, cuerpo_json, etag, cargado_en)
+        self.version = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _vigente(self):
+        return self._entrada is not None and (self.reloj() - self._entrada[3]) < self.ttl
+
+    def obtener(self, cargador):
+        """
+        Retorna (datos, cuerpo_json, etag). `cargador` es una función sin
+        argumentos que devuelve la lista de servicios desde la BD (o None si falla).
+        """
+        entrada = self._entrada
+        if entrada is not None and self._vigente():
+            self.aciertos += 1
+            return entrada[0], entrada[1], entrada[2]
+
+        with self._lock:
+            # Otro hilo pudo recargar mientras esperábamos el candado
+            if self._vigente():
+                self.aciertos += 1
+                entrada = self._entrada
+                return entrada[0], entrada[1], entrada[2]
+
+            self.fallos += 1
+            # invalidar() espera este candado: la carga no puede pisar una invalidación
+            datos, cuerpo, etag = self._serializar(cargador())
+            if etag is not None:
+                self._entrada = (datos, cuerpo, etag, self.reloj())
+            return datos, cuerpo, etag
+
+    def leer(self):
+        """Retorna (datos, cuerpo_json, etag) si hay un catálogo vigente, o None (sin cargar)."""
+        entrada = self._entrada
+        if entrada is not None and self._vigente():
+            self.aciertos += 1
+            return entrada[0], entrada[1], entrada[2]
+        self.fallos += 1
+        return None
+
+    @staticmethod
+    def _serializar(datos):
+        if datos is None:
+            # Error de BD: se responde vacío pero no se guarda en el cache
+            return [], "[]", None
+        cuerpo = json.dumps(datos, ensure_ascii=False, separators=(",", ":"))
+        etag = '"%s"' % hashlib.sha1(cuerpo.encode("utf-8")).hexdigest()
+        return datos, cuerpo, etag
+
+    def almacenar(self, datos, version):
+        """
+        Serializa y guarda un catálogo recién leído; usado por los cargadores
+        asíncronos, que consultan sin el candado. `version` es self.version
+        leída ANTES de la consulta: si hubo un invalidar() entretanto, lo
+        leído puede ser viejo y solo se responde, sin guardarlo.
+        """
+        datos, cuerpo, etag = self._serializar(datos)
+        if etag is not None:
+            with self._lock:
+                if version == self.version:
+                    self._entrada = (datos, cuerpo, etag, self.reloj())
+        return datos, cuerpo, etag
+
+    def invalidar(self):
+        """Descarta el catálogo en memoria (p. ej. tras Servicio.crear); retorna la nueva versión."""
+        with self._lock:
+            self._entrada = None
+            self.version += 1
+            return self.version
+
+    def estadisticas(self):
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "version": self.version}
+
+
+def etag_coincide(if_none_match, etag):
+    """Evalúa la cabecera If-None-Match contra el ETag actual."""
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidatos = [c.strip() for c in if_none_match.split(",")]
+    return etag in candidatos or f"W/{etag}" in candidatos
+
+
+# Instancia global del proceso
+cache_catalogo = CacheCatalogo()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+# Seguimiento de cambios de reservas y pagos para sincronización incremental.
+#
+# Cada fila de reservas/pagos guarda en cambio_tx el id de la transacción que
+# la insertó o modificó por última vez. Un lector toma además el xmin de su
+# snapshot: toda transacción con id menor ya terminó. El cursor es
+# (seguro, ultimo_tx, ultimo_id): (ultimo_tx, ultimo_id) es la posición de la
+# página y `seguro` el menor xmin visto desde que empezó la pasada; al
+# terminarla se reanuda desde (seguro, seguro, ''), nunca por encima de un
+# xmin, así que no se salta un cambio que aún no estaba confirmado aunque
+# una transacción larga retenga el xmin durante varias páginas.
+#
+# Los triggers además hacen NOTIFY reservas_cambios (una vez por sentencia);
+# DifusorCambios escucha con una sola conexión por proceso y reparte los
+# cambios a los clientes conectados por SSE.
+import base64
+import json
+import queue
+import select
+import threading
+
+# --- Configuración de la Sincronización ---
+CANAL_CAMBIOS = "reservas_cambios"
+CAMBIOS_LIMITE_DEFAULT = 200
+CAMBIOS_LIMITE_MAX = 1000
+CAMBIOS_SONDEO = 5.0           # Segundos entre consultas de respaldo si no llega NOTIFY
+SSE_LATIDO = 15.0              # Comentario ": ping" para mantener viva la conexión
+SSE_COLA_MAX = 1000            # Eventos pendientes por cliente antes de desconectarlo
+
+ESQUEMA_CAMBIOS = f"""
+    ALTER TABLE reservas ADD COLUMN IF NOT EXISTS cambio_tx BIGINT NOT NULL DEFAULT txid_current();
+    ALTER TABLE pagos ADD COLUMN IF NOT EXISTS cambio_tx BIGINT NOT NULL DEFAULT txid_current();
+    CREATE INDEX IF NOT EXISTS reservas_cambio_tx ON reservas (cambio_tx);
+    CREATE INDEX IF NOT EXISTS pagos_cambio_tx ON pagos (cambio_tx);
+
+    CREATE OR REPLACE FUNCTION marcar_cambio() RETURNS trigger AS $$
+    BEGIN
+        NEW.cambio_tx := txid_current();
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION notificar_cambio() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{CANAL_CAMBIOS}', '');
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS reservas_marcar_cambio ON reservas;
+    CREATE TRIGGER reservas_marcar_cambio BEFORE INSERT OR UPDATE ON reservas
+        FOR EACH ROW EXECUTE FUNCTION marcar_cambio();
+    DROP TRIGGER IF EXISTS pagos_marcar_cambio ON pagos;
+    CREATE TRIGGER pagos_marcar_cambio BEFORE INSERT OR UPDATE ON pagos
+        FOR EACH ROW EXECUTE FUNCTION marcar_cambio();
+
+    DROP TRIGGER IF EXISTS reservas_notificar_cambio ON reservas;
+    CREATE TRIGGER reservas_notificar_cambio AFTER INSERT OR UPDATE ON reservas
+        FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();
+    DROP TRIGGER IF EXISTS pagos_notificar_cambio ON pagos;
+    CREATE TRIGGER pagos_notificar_cambio AFTER INSERT OR UPDATE ON pagos
+        FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio();
+"""
+
+
+def codificar_cursor(seguro, ultimo_tx=None, ultimo_id=""):
+    """Sin posición de página, (seguro, seguro, ''): el inicio de una pasada."""
+    if ultimo_tx is None:
+        ultimo_tx = seguro
+    crudo = f"{seguro}|{ultimo_tx}|{ultimo_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(crudo).decode("ascii")
+
+
+def decodificar_cursor(cursor):
+    """Retorna (seguro, ultimo_tx, ultimo_id) o lanza ValueError si el cursor no es válido."""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        seguro, ultimo_tx, ultimo_id = crudo.split("|", 2)
+        return int(seguro), int(ultimo_tx), ultimo_id
+    except Exception as e:
+        raise ValueError(f"Cursor inválido: {e}")
+
+# =======================================================
+# DIFUSIÓN EN VIVO (SSE)
+# =======================================================
+
+def formatear_evento(cursor, reservas):
+    """Evento SSE; el id es el cursor para reanudar con Last-Event-ID."""
+    return f"id: {cursor}\nevent: reservas\ndata: {json.dumps(reservas, ensure_ascii=False)}\n\n"
+
+
+class Suscripcion:
+    """Cola de eventos de un cliente SSE; `usuario_id` None = ve todas las reservas."""
+
+    def __init__(self, usuario_id=None):
+        self.usuario_id = usuario_id
+        self.cola = queue.Queue(maxsize=SSE_COLA_MAX)
+        self.desbordada = False
+
+    def entregar(self, cursor, reservas):
+        if self.usuario_id is not None:
+            reservas = [r for r in reservas if r["user_id"] == self.usuario_id]
+        if not reservas:
+            return
+        try:
+            self.cola.put_nowait((cursor, reservas))
+        except queue.Full:
+            # Cliente demasiado lento: se corta y se resincroniza con /api/history/changes
+            self.desbordada = True
+
+    def cerrar(self):
+        """Termina el stream en cuanto el cliente despierte (el cliente reconecta con Last-Event-ID)."""
+        self.desbordada = True
+        try:
+            self.cola.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def esperar(self, timeout=SSE_LATIDO):
+        """Retorna (cursor, reservas) o None si no hubo cambios en `timeout` segundos."""
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class DifusorCambios:
+    """
+    Un hilo por proceso: espera NOTIFY en una conexión dedicada (o sondea
+    cada CAMBIOS_SONDEO s si no hay) y, por cada ráfaga de cambios, hace UNA
+    consulta incremental que reparte a todas las suscripciones. El coste en
+    BD no depende del número de clientes conectados.
+    """
+
+    def __init__(self, consultar_cambios, conector=None, sondeo=CAMBIOS_SONDEO):
+        # consultar_cambios(cursor) -> {"success", "data", "cursor"} (HistorialReservas de manager)
+        self.consultar_cambios = consultar_cambios
+        self.conector = conector
+        self.sondeo = sondeo
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+        self._cursor = None
+        self.contadores = {"consultas": 0, "eventos": 0, "notificaciones": 0}
+
+    def suscribir(self, usuario_id=None):
+        suscripcion = Suscripcion(usuario_id)
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+        self.iniciar()
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def iniciar(self):
+        """Arranca el hilo de escucha (idempotente)."""
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="cambios-difusor", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(self.sondeo)
+            self._hilo = None
+
+    def cerrar_suscripciones(self):
+        """Al apagar el worker: corta los streams abiertos para que no retengan el drenaje."""
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+        for suscripcion in suscripciones:
+            suscripcion.cerrar()
+
+    def _escuchar(self):
+        """Conexión en autocommit con LISTEN; None si no se puede abrir."""
+        if self.conector is None:
+            return None
+        conn = self.conector()
+        if conn is None:
+            return None
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {CANAL_CAMBIOS}")
+            cursor.close()
+            return conn
+        except Exception as e:
+            print(f"ERROR al escuchar {CANAL_CAMBIOS}: {e}")
+            conn.close()
+            return None
+
+    def _esperar_aviso(self, conn):
+        """Bloquea hasta un NOTIFY o hasta `sondeo` s. Retorna la conexión (None si se perdió)."""
+        if conn is None:
+            self._detener.wait(self.sondeo)
+            return self._escuchar()
+        try:
+            if select.select([conn], [], [], self.sondeo) != ([], [], []):
+                conn.poll()
+                if conn.notifies:
+                    self.contadores["notificaciones"] += len(conn.notifies)
+                    conn.notifies.clear()
+            return conn
+        except Exception as e:
+            print(f"ERROR en la escucha de {CANAL_CAMBIOS}: {e}")
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return None
+
+    def _bucle(self):
+        conn = self._escuchar()
+        while not self._detener.is_set():
+            with self._lock:
+                hay_clientes = bool(self._suscripciones)
+            if hay_clientes:
+                self._difundir()
+            else:
+                # Sin clientes no se consulta; al volver alguno se parte del estado actual
+                self._cursor = None
+            conn = self._esperar_aviso(conn)
+        if conn is not None:
+            conn.close()
+
+    def _difundir(self):
+        while True:
+            result = self.consultar_cambios(self._cursor)
+            self.contadores["consultas"] += 1
+            if not result.get("success", False):
+                return
+            inicial = self._cursor is None
+            self._cursor = result["cursor"]
+            if inicial or not result["data"]:
+                return
+            with self._lock:
+                suscripciones = list(self._suscripciones)
+            for suscripcion in suscripciones:
+                suscripcion.entregar(self._cursor, result["data"])
+            self.contadores["eventos"] += len(result["data"])
+            if not result.get("hay_mas"):
+                return
+
+    def estadisticas(self):
+        with self._lock:
+            stats = dict(self.contadores)
+            stats["suscripciones"] = len(self._suscripciones)
+        return stats
@@ -1,4 +1,19 @@
+import contextvars
+import itertools
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import partial
+
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+
+from metricas import nombre_consulta, observar_consulta, observar_espera_pool, registro
+from sentencias import buscar_sentencia, sql_de
 
 # --- Credenciales de Conexión Local ---
 # Asegúrate de que estos valores coincidan con los de tu instalación de PostgreSQL
@@ -8,45 +23,853 @@ DB_USER = "postgres"
 DB_PASSWORD = "12345" # <-- ¡Usa tu contraseña real de PostgreSQL!
 DB_PORT = "5432" 
 
+# --- Configuración del Pool de Conexiones ---
+POOL_MIN_SIZE = 2        # Conexiones que se mantienen abiertas en reposo
+POOL_MAX_SIZE = 10       # Límite duro de conexiones simultáneas hacia PostgreSQL
+POOL_TIMEOUT = 5.0       # Segundos máximos de espera cuando el pool está agotado
+POOL_VERIFICAR_TRAS = 30.0   # Solo se verifica (SELECT 1) una conexión libre desde hace más de esto
+POOL_INACTIVA_MAX = 300.0    # Por encima de POOL_MIN_SIZE se cierran las libres desde hace más de esto
+STREAM_ITERSIZE = 500    # Filas por viaje al servidor en los cursores con nombre
+USAR_SENTENCIAS_PREPARADAS = True  # PREPARE/EXECUTE para las sentencias declaradas en sentencias.py
+
+# --- Primaria y Réplicas de Lectura ---
+# DSN de la primaria; None = se usan DB_HOST, DB_NAME, etc.
+DB_PRIMARY_DSN = None
+# DSN de las réplicas, p. ej. "host=localhost port=5433 dbname=sistema_reservas user=postgres password=12345".
+# Lista vacía = todas las consultas van a la primaria.
+DB_REPLICAS = []
+REPLICA_ESTRATEGIA = "round_robin"   # "round_robin" o "menos_conexiones"
+REPLICA_VERIFICACION = 5.0           # Segundos entre verificaciones de salud de las réplicas
+REPLICA_CONNECT_TIMEOUT = 2          # Segundos máximos para conectar con una réplica
+# Tras escribir, el cliente recibe la posición del WAL de la primaria (cabecera y cookie) y sus
+# lecturas solo van a réplicas que ya la aplicaron; vale en cualquier worker o máquina.
+LECTURA_PROPIA_CABECERA = "X-Escritura-LSN"
+LECTURA_PROPIA_COOKIE = "escritura_lsn"
+LECTURA_PROPIA_COOKIE_TTL = 300      # Segundos que el navegador conserva la cookie
+# Lecturas que llenan caches compartidos del proceso: si leyeran de una réplica
+# atrasada, el dato viejo quedaría cacheado para todos durante el TTL.
+LECTURAS_EN_PRIMARIA = {"catalog_scan"}
+
+class ConexionReservas(psycopg2.extensions.connection):
+    """Conexión que recuerda qué sentencias con nombre ya se prepararon en ella."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+
+
 def conectar_db():
-    """Establece y retorna una conexión a la base de datos."""
+    """Establece y retorna una conexión a la base de datos (primaria)."""
     try:
+        if DB_PRIMARY_DSN:
+            return psycopg2.connect(DB_PRIMARY_DSN, connection_factory=ConexionReservas)
         conn = psycopg2.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
             password=DB_PASSWORD,
-            port=DB_PORT
+            port=DB_PORT,
+            connection_factory=ConexionReservas
         )
         return conn
     except psycopg2.Error as e:
         print(f"ERROR DE CONEXIÓN A POSTGRESQL: {e}")
         return None
 
-def execute_query(query, params=None, fetch_data=False, fetch_all=False):
-    """Función genérica para ejecutar consultas y manejar transacciones."""
-    conn = conectar_db()
+
+def conectar_replica(dsn):
+    """Conexión a una réplica; retorna None si no responde (sin imprimir, lo reporta el enrutador)."""
+    try:
+        return psycopg2.connect(dsn, connect_timeout=REPLICA_CONNECT_TIMEOUT, connection_factory=ConexionReservas)
+    except psycopg2.Error:
+        return None
+
+# =======================================================
+# POOL DE CONEXIONES
+# =======================================================
+
+class PoolAgotadoError(Exception):
+    """Se lanza cuando no se obtiene una conexión dentro del tiempo de espera."""
+
+
+class PoolConexiones:
+    """
+    Pool de conexiones thread-safe con tamaño mínimo/máximo, espera acotada
+    cuando se agota y verificación de vida de la conexión al entregarla.
+    """
+
+    def __init__(self, connector=conectar_db, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 verificar_tras=POOL_VERIFICAR_TRAS, inactiva_max=POOL_INACTIVA_MAX):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Tamaños de pool inválidos.")
+        self.connector = connector
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.verificar_tras = verificar_tras
+        self.inactiva_max = inactiva_max
+        self._libres = []        # [(conexión, instante en que quedó libre)], la última es la más reciente
+        self._en_uso = 0
+        self._abiertas = 0
+        self._cond = threading.Condition()
+        self.contadores = {
+            "checkouts": 0,
+            "creadas": 0,
+            "descartadas": 0,
+            "esperas": 0,
+            "timeouts": 0,
+        }
+
+    def _crear(self):
+        conn = self.connector()
+        if conn is not None:
+            with self._cond:
+                self.contadores["creadas"] += 1
+        return conn
+
+    def _esta_viva(self, conn):
+        """Comprueba que la conexión siga utilizable antes de entregarla."""
+        if getattr(conn, "closed", 0):
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _cerrar(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def llenar(self):
+        """Abre conexiones hasta alcanzar el tamaño mínimo configurado."""
+        while True:
+            with self._cond:
+                if self._abiertas >= self.min_size:
+                    return
+                self._abiertas += 1
+            conn = self._crear()
+            with self._cond:
+                if conn is None:
+                    self._abiertas -= 1
+                    return
+                self._libres.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _descartar(self, conn):
+        """Cierra una conexión ya contada como en uso y libera su hueco."""
+        self._cerrar(conn)
+        with self._cond:
+            self._en_uso -= 1
+            self._abiertas -= 1
+            self.contadores["descartadas"] += 1
+            self._cond.notify()
+
+    def obtener(self, timeout=None):
+        """
+        Entrega una conexión viva; espera como máximo `timeout` segundos. El
+        candado solo protege la contabilidad: la verificación (SELECT 1, solo
+        si estuvo libre más de `verificar_tras` s) y la conexión nueva se
+        hacen fuera de él, sin serializar a los demás hilos.
+        """
+        limite = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            libre = None
+            with self._cond:
+                while True:
+                    if self._libres:
+                        libre = self._libres.pop()
+                        self._en_uso += 1
+                        break
+                    if self._abiertas < self.max_size:
+                        # Se reserva el hueco antes de conectar para no rebasar el máximo
+                        self._abiertas += 1
+                        break
+
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self.contadores["timeouts"] += 1
+                        raise PoolAgotadoError("No hay conexiones disponibles en el pool.")
+                    self.contadores["esperas"] += 1
+                    self._cond.wait(restante)
+
+            if libre is None:
+                break
+            conn, libre_desde = libre
+            reciente = time.monotonic() - libre_desde < self.verificar_tras
+            if not getattr(conn, "closed", 0) and (reciente or self._esta_viva(conn)):
+                with self._cond:
+                    self.contadores["checkouts"] += 1
+                return conn
+            self._descartar(conn)
+
+        conn = self._crear()
+        with self._cond:
+            if conn is None:
+                self._abiertas -= 1
+                self._cond.notify()
+                return None
+            self._en_uso += 1
+            self.contadores["checkouts"] += 1
+        return conn
+
+    def devolver(self, conn, descartar=False):
+        """
+        Regresa la conexión al pool (o la cierra si está rota). Por encima de
+        min_size se cierran las libres desde hace más de `inactiva_max` s.
+        """
+        if descartar or getattr(conn, "closed", 0):
+            self._descartar(conn)
+            return
+        ahora = time.monotonic()
+        sobrantes = []
+        with self._cond:
+            self._en_uso -= 1
+            self._libres.append((conn, ahora))
+            # La pila se usa por el final: las del principio son las más antiguas
+            while (self._abiertas - len(sobrantes) > self.min_size and self._libres
+                   and ahora - self._libres[0][1] > self.inactiva_max):
+                sobrantes.append(self._libres.pop(0)[0])
+            self._abiertas -= len(sobrantes)
+            self.contadores["descartadas"] += len(sobrantes)
+            self._cond.notify()
+        for sobrante in sobrantes:
+            self._cerrar(sobrante)
+
+    def cerrar_todo(self):
+        """Cierra las conexiones libres (útil al apagar el proceso)."""
+        with self._cond:
+            libres = [conn for conn, _ in self._libres]
+            self._abiertas -= len(libres)
+            self._libres = []
+            self._cond.notify_all()
+        for conn in libres:
+            self._cerrar(conn)
+
+    @property
+    def en_uso(self):
+        return self._en_uso
+
+    def estadisticas(self):
+        """Retorna contadores de uso del pool."""
+        with self._cond:
+            stats = dict(self.contadores)
+            stats.update({
+                "abiertas": self._abiertas,
+                "en_uso": self._en_uso,
+                "libres": len(self._libres),
+                "max_size": self.max_size,
+                "utilizacion": self._en_uso / self.max_size,
+            })
+            return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def obtener_pool():
+    """Retorna el pool global del proceso, creándolo en el primer uso."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolConexiones()
+    return _pool
+
+def estadisticas_pool():
+    """Contadores de utilización del pool global."""
+    return obtener_pool().estadisticas()
+
+
+def _metricas_pool():
+    if _pool is None:
+        return []
+    stats = _pool.estadisticas()
+    return [(f"db_pool_{clave}", (), valor) for clave, valor in sorted(stats.items())]
+
+registro.registrar_colector(_metricas_pool)
+
+# =======================================================
+# RÉPLICAS DE LECTURA
+# =======================================================
+
+class Replica:
+    """Una réplica de lectura con su propio pool y su estado de salud."""
+
+    def __init__(self, dsn, min_size=0, max_size=POOL_MAX_SIZE):
+        self.dsn = dsn
+        partes = psycopg2.extensions.parse_dsn(dsn)
+        self.nombre = f"{partes.get('host', 'localhost')}:{partes.get('port', '5432')}"
+        self.pool = PoolConexiones(connector=partial(conectar_replica, dsn), min_size=min_size, max_size=max_size)
+        self.sana = True
+        self.expulsiones = 0
+        self.lsn_aplicado = 0      # Posición del WAL ya aplicada en la última verificación
+
+    def responde(self):
+        """Verificación de salud: conectar y leer hasta dónde aplicó el WAL de la primaria."""
+        conn = conectar_replica(self.dsn)
+        if conn is None:
+            return False
+        try:
+            cursor = conn.cursor()
+            # Fuera de recuperación (no es una réplica real) vale su propia posición
+            cursor.execute("SELECT COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn())::text")
+            self.lsn_aplicado = lsn_a_entero(cursor.fetchone()[0]) or 0
+            cursor.close()
+            return True
+        except psycopg2.Error:
+            return False
+        finally:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+
+class EnrutadorLecturas:
+    """
+    Reparte las lecturas entre las réplicas sanas (round robin o menos
+    conexiones en uso). Una réplica que falla se expulsa de inmediato y un
+    hilo de verificación la readmite cuando vuelve a responder.
+    """
+
+    def __init__(self, dsns, estrategia=REPLICA_ESTRATEGIA, intervalo=REPLICA_VERIFICACION):
+        if estrategia not in ("round_robin", "menos_conexiones"):
+            raise ValueError(f"Estrategia de réplicas desconocida: {estrategia}")
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self.estrategia = estrategia
+        self.intervalo = intervalo
+        self._turno = itertools.count()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def elegir(self, lsn_minimo=None):
+        """
+        Réplica sana para la siguiente lectura, o None si no hay ninguna. Con
+        `lsn_minimo` solo cuentan las que ya aplicaron esa posición del WAL.
+        """
+        sanas = [r for r in self.replicas if r.sana and (lsn_minimo is None or r.lsn_aplicado >= lsn_minimo)]
+        if not sanas:
+            return None
+        if self.estrategia == "menos_conexiones":
+            return min(sanas, key=lambda r: r.pool.en_uso)
+        return sanas[next(self._turno) % len(sanas)]
+
+    def expulsar(self, replica, motivo):
+        with self._lock:
+            if not replica.sana:
+                return
+            replica.sana = False
+            replica.expulsiones += 1
+        replica.pool.cerrar_todo()
+        print(f"RÉPLICA {replica.nombre} FUERA DE SERVICIO: {motivo}")
+
+    def verificar(self):
+        """Una ronda de verificación: expulsa las caídas y readmite las recuperadas."""
+        for replica in self.replicas:
+            if replica.responde():
+                if not replica.sana:
+                    replica.sana = True
+                    print(f"RÉPLICA {replica.nombre} DE VUELTA EN SERVICIO.")
+            else:
+                self.expulsar(replica, "no responde a la verificación de salud")
+
+    def iniciar(self):
+        """Arranca el hilo de verificación (idempotente)."""
+        with self._lock:
+            if self._hilo is not None or not self.replicas:
+                return
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="replicas-salud", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(self.intervalo)
+            self._hilo = None
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            self.verificar()
+
+    def cerrar_todo(self):
+        for replica in self.replicas:
+            replica.pool.cerrar_todo()
+
+
+_enrutador = None
+_enrutador_lock = threading.Lock()
+
+def obtener_enrutador():
+    """Enrutador de lecturas del proceso; None si no hay réplicas configuradas."""
+    global _enrutador
+    if _enrutador is None and DB_REPLICAS:
+        with _enrutador_lock:
+            if _enrutador is None:
+                _enrutador = EnrutadorLecturas(DB_REPLICAS)
+                _enrutador.iniciar()
+    return _enrutador
+
+
+def _metricas_replicas():
+    if _enrutador is None:
+        return []
+    muestras = []
+    for replica in _enrutador.replicas:
+        etiquetas = (("replica", replica.nombre),)
+        muestras.append(("db_replica_sana", etiquetas, int(replica.sana)))
+        muestras.append(("db_replica_en_uso", etiquetas, replica.pool.en_uso))
+        muestras.append(("db_replica_expulsiones", etiquetas, replica.expulsiones))
+    return muestras
+
+registro.registrar_colector(_metricas_replicas)
+
+# =======================================================
+# CICLO DE VIDA DEL PROCESO (FORK Y APAGADO)
+# =======================================================
+
+def cerrar_conexiones():
+    """Al apagar el proceso: detiene la verificación de réplicas y cierra las conexiones libres."""
+    if _enrutador is not None:
+        _enrutador.detener()
+        _enrutador.cerrar_todo()
+    if _pool is not None:
+        _pool.cerrar_todo()
+
+
+# Pool y enrutador heredados del padre en cada fork. Siguen referenciados
+# para que el recolector no los libere: al liberar una conexión psycopg2
+# llama a PQfinish, que envía Terminate por el socket compartido y corta
+# también la sesión del padre.
+_heredados = []
+
+
+def _reiniciar_tras_fork():
+    """
+    En el hijo de un fork, el pool y el enrutador son del padre: se apartan
+    en _heredados sin cerrarlos y el hijo abre los suyos en el primer uso.
+    """
+    global _pool, _pool_lock, _enrutador, _enrutador_lock
+    _heredados.extend(obj for obj in (_pool, _enrutador) if obj is not None)
+    _pool = None
+    _pool_lock = threading.Lock()
+    _enrutador = None
+    _enrutador_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+# --- Leer lo propio (read-your-writes) ---
+# Tras una escritura, el resto de la petición lee de la primaria y la
+# respuesta lleva la posición del WAL de la primaria (marca_de_escritura).
+# El cliente la devuelve (cookie o cabecera) y sus lecturas solo van a una
+# réplica que ya la haya aplicado; si ninguna, a la primaria. La marca viaja
+# con el cliente, así que vale en cualquier worker y también sin sesión.
+_contexto_lecturas = contextvars.ContextVar("contexto_lecturas", default=None)
+QUERY_WAL_LSN = "SELECT pg_current_wal_lsn()::text"
+
+
+def lsn_a_entero(lsn):
+    """'16/B374D848' -> entero comparable; None si no es una posición del WAL válida."""
+    try:
+        alto, bajo = str(lsn).split("/")
+        return (int(alto, 16) << 32) | int(bajo, 16)
+    except (TypeError, ValueError):
+        return None
+
+
+def iniciar_contexto_lecturas(*marcas):
+    """Se llama al inicio de cada petición con las marcas de escritura que trae el cliente."""
+    posiciones = [p for p in map(lsn_a_entero, marcas) if p is not None]
+    _contexto_lecturas.set({"lsn": max(posiciones, default=None), "escribio": False})
+
+
+def registrar_escritura():
+    contexto = _contexto_lecturas.get()
+    if contexto is not None:
+        contexto["escribio"] = True
+
+
+def requiere_marca_de_escritura():
+    """True si la petición escribió y hay réplicas: su respuesta debe llevar la marca."""
+    contexto = _contexto_lecturas.get()
+    return contexto is not None and contexto["escribio"] and bool(DB_REPLICAS)
+
+
+def marca_de_escritura():
+    """
+    Al terminar la petición: si escribió y hay réplicas, la posición actual
+    del WAL de la primaria (texto) para devolverla al cliente; si no, None.
+    """
+    if not requiere_marca_de_escritura():
+        return None
+    # "escribio" manda esta lectura a la primaria
+    fila = execute_query(QUERY_WAL_LSN, fetch_data=True, query_name="wal_lsn")
+    return fila[0] if fila else None
+
+
+def _lectura_en_primaria(nombre):
+    if nombre in LECTURAS_EN_PRIMARIA:
+        return True
+    contexto = _contexto_lecturas.get()
+    return contexto is not None and contexto["escribio"]
+
+
+def _es_select(query):
+    return sql_de(query).lstrip()[:6].upper() == "SELECT"
+
+
+def _replica_para_lectura(nombre):
+    """Réplica a la que enviar esta lectura, o None para usar la primaria."""
+    enrutador = obtener_enrutador()
+    if enrutador is None or _lectura_en_primaria(nombre):
+        return None
+    contexto = _contexto_lecturas.get()
+    return enrutador.elegir(contexto["lsn"] if contexto is not None else None)
+
+# =======================================================
+# EJECUCIÓN DE CONSULTAS
+# =======================================================
+
+def _ejecutar(conn, cursor, query, params):
+    """
+    Ejecuta `query` (texto SQL o nombre de sentencia). Si es una sentencia
+    declarada, la prepara la primera vez en esta conexión y luego usa EXECUTE.
+    """
+    sentencia = buscar_sentencia(query) if USAR_SENTENCIAS_PREPARADAS else None
+    preparadas = getattr(conn, "preparadas", None)
+    if sentencia is None or preparadas is None:
+        cursor.execute(sql_de(query), params)
+        return
+    if sentencia.nombre not in preparadas:
+        cursor.execute(sentencia.sql_prepare)
+        preparadas.add(sentencia.nombre)
+    cursor.execute(sentencia.sql_execute, params)
+
+
+def _nombre_metrica(query, query_name):
+    if query_name:
+        return query_name
+    sentencia = buscar_sentencia(query)
+    return sentencia.nombre if sentencia is not None else nombre_consulta(query)
+
+
+class ReplicaNoDisponible(Exception):
+    """
+    La réplica elegida no sirvió la lectura. `caida` distingue una réplica
+    que no responde (se expulsa) de un pool de réplica agotado (solo se
+    desvía esa lectura a la primaria).
+    """
+
+    def __init__(self, motivo, caida=True):
+        super().__init__(motivo)
+        self.caida = caida
+
+
+def execute_query(query, params=None, fetch_data=False, fetch_all=False, query_name=None):
+    """
+    Función genérica para ejecutar consultas y manejar transacciones.
+    `query` puede ser texto SQL o el nombre de una sentencia declarada en
+    sentencias.py (que se ejecuta preparada). Mide la espera del pool y el
+    tiempo de la consulta, etiquetado con `query_name` o el nombre de la sentencia.
+    Los SELECT con fetch_data/fetch_all van a una réplica si hay alguna sana;
+    las escrituras siempre a la primaria.
+    """
+    nombre = _nombre_metrica(query, query_name)
+
+    if (fetch_data or fetch_all) and _es_select(query):
+        replica = _replica_para_lectura(nombre)
+        if replica is not None:
+            try:
+                result = _ejecutar_en_pool(replica.pool, query, params, fetch_data, fetch_all, nombre, replica=True)
+                registro.incrementar("db_reads_total", (("target", "replica"),))
+                return result
+            except ReplicaNoDisponible as e:
+                if e.caida:
+                    obtener_enrutador().expulsar(replica, e)
+        registro.incrementar("db_reads_total", (("target", "primary"),))
+    else:
+        registrar_escritura()
+
+    return _ejecutar_en_pool(obtener_pool(), query, params, fetch_data, fetch_all, nombre)
+
+
+def _ejecutar_en_pool(pool, query, params, fetch_data, fetch_all, nombre, replica=False):
+    """
+    Ejecuta la consulta en una conexión de `pool` y la confirma. Con
+    replica=True, los fallos de conexión lanzan ReplicaNoDisponible para que
+    la lectura se repita en la primaria.
+    """
+    inicio = time.perf_counter()
+    try:
+        conn = pool.obtener()
+    except PoolAgotadoError as e:
+        if replica:
+            raise ReplicaNoDisponible(str(e), caida=False)
+        print(f"ERROR DE CONEXIÓN A POSTGRESQL: {e}")
+        return None
+    finally:
+        observar_espera_pool(time.perf_counter() - inicio)
     if conn is None:
+        if replica:
+            raise ReplicaNoDisponible("no se pudo conectar")
         return None
 
+    descartar = False
+    inicio = time.perf_counter()
     try:
-        cursor = conn.cursor()
-        cursor.execute(query, params)
+        for intento in (1, 2):
+            try:
+                cursor = conn.cursor()
+                _ejecutar(conn, cursor, query, params)
+                break
+            except psycopg2.errors.InvalidSqlStatementName:
+                # La sesión perdió la sentencia preparada (p. ej. DISCARD ALL): se vuelve a preparar
+                conn.rollback()
+                conn.preparadas.clear()
+                if intento == 2:
+                    raise
         
         if fetch_data:
             result = cursor.fetchone()
         elif fetch_all:
             result = cursor.fetchall()
         else:
-            result = None
-            conn.commit() # Confirmar cambios para INSERT/UPDATE/DELETE
+            # Filas afectadas: distinto de None para que la lógica detecte el éxito
+            result = cursor.rowcount
+        conn.commit() # Confirmar cambios para INSERT/UPDATE/DELETE (y cerrar la transacción de lectura)
         
         cursor.close()
+        observar_consulta(nombre, time.perf_counter() - inicio)
         return result
     except psycopg2.Error as e:
+        observar_consulta(nombre, time.perf_counter() - inicio, error=True)
+        try:
+            conn.rollback() # Revertir si hay error
+        except psycopg2.Error:
+            descartar = True
+        if replica and (descartar or conn.closed):
+            # Se perdió la conexión con la réplica: la lectura se repite en la primaria
+            raise ReplicaNoDisponible(str(e).strip())
         print(f"Error de BD al ejecutar consulta: {e}")
-        conn.rollback() # Revertir si hay error
         return None
     finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        pool.devolver(conn, descartar=descartar)
+
+# =======================================================
+# UNIDAD DE TRABAJO (TRANSACCIONES)
+# =======================================================
+
+class UnidadDeTrabajo:
+    """
+    Agrupa varias sentencias en una sola conexión y un solo COMMIT.
+    La instancia es invocable con la misma firma que execute_query, así que
+    puede inyectarse como db_executor en las clases de logica.py.
+    Un error de BD marca la unidad como fallida y todo se revierte al salir.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.fallida = False
+        self.exitosa = False
+
+    def __call__(self, query, params=None, fetch_data=False, fetch_all=False, query_name=None):
+        if self.fallida:
+            return None
+        nombre = _nombre_metrica(query, query_name)
+        inicio = time.perf_counter()
+        try:
+            cursor = self.conn.cursor()
+            _ejecutar(self.conn, cursor, query, params)
+            if fetch_data:
+                result = cursor.fetchone()
+            elif fetch_all:
+                result = cursor.fetchall()
+            else:
+                result = cursor.rowcount
+            cursor.close()
+            observar_consulta(nombre, time.perf_counter() - inicio)
+            return result
+        except psycopg2.Error as e:
+            print(f"Error de BD al ejecutar consulta: {e}")
+            observar_consulta(nombre, time.perf_counter() - inicio, error=True)
+            self.fallida = True
+            return None
+
+    def execute_atomic(self, pasos):
+        """
+        Como la función de módulo `configuracion_db.execute_atomic`, pero en la
+        transacción en curso: retorna las filas afectadas por el último paso,
+        o None si alguno falla (y la unidad queda fallida).
+        """
+        result = None
+        for query, params in pasos:
+            result = self(query, params)
+            if result is None:
+                return None
+        return result
+
+    def execute_values(self, query, filas, page_size=1000):
+        """
+        Inserción masiva con psycopg2.extras.execute_values: un INSERT de
+        varias filas por cada `page_size`. Retorna el número de filas enviadas.
+        """
+        if self.fallida:
+            return None
+        try:
+            cursor = self.conn.cursor()
+            execute_values(cursor, query, filas, page_size=page_size)
+            cursor.close()
+            return len(filas)
+        except psycopg2.Error as e:
+            print(f"Error de BD al ejecutar carga masiva: {e}")
+            self.fallida = True
+            return None
+
+    def abortar(self):
+        """Marca la unidad para revertirse (p. ej. por una validación de negocio)."""
+        self.fallida = True
+
+
+@contextmanager
+def transaccion():
+    """
+    Contexto de transacción sobre una conexión del pool:
+
+        with transaccion() as uow:
+            Reserva(data, uow).crear_reserva()
+            Pago(data_pago, uow).procesar_pago()
+
+    Confirma al salir si nada falló; si no, revierte. Tras el bloque,
+    `uow.exitosa` indica si el COMMIT se realizó. Siempre usa la primaria.
+    """
+    registrar_escritura()
+    pool = obtener_pool()
+    try:
+        conn = pool.obtener()
+    except PoolAgotadoError as e:
+        print(f"ERROR DE CONEXIÓN A POSTGRESQL: {e}")
+        conn = None
+
+    if conn is None:
+        # Unidad ya fallida: las sentencias retornan None como execute_query
+        uow = UnidadDeTrabajo(None)
+        uow.fallida = True
+        yield uow
+        return
+
+    uow = UnidadDeTrabajo(conn)
+    descartar = False
+    try:
+        yield uow
+        if uow.fallida:
+            conn.rollback()
+        else:
+            conn.commit()
+            uow.exitosa = True
+    except psycopg2.Error as e:
+        print(f"Error de BD al confirmar la transacción: {e}")
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            descartar = True
+    except BaseException:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            descartar = True
+        raise
+    finally:
+        pool.devolver(conn, descartar=descartar)
+
+
+def execute_atomic(pasos):
+    """
+    Ejecuta una lista de (query, params) en una sola transacción y conexión.
+    Retorna las filas afectadas por la última sentencia, o None si algo falla
+    (en cuyo caso no se confirma ninguna).
+    """
+    with transaccion() as uow:
+        result = uow.execute_atomic(pasos)
+    return result if uow.exitosa else None
+
+class StreamFallido(Exception):
+    """Una lectura de stream_query no pudo empezar (sin conexión, error en el DECLARE) o se cortó a mitad."""
+
+
+def stream_query(query, params=None, itersize=STREAM_ITERSIZE):
+    """
+    Recorre el resultado con un cursor del lado del servidor (cursor con
+    nombre), trayendo `itersize` filas por viaje. La conexión y el DECLARE se
+    obtienen ANTES de retornar el generador de filas, para que el llamador
+    pueda responder con error antes de enviar nada: lanza PoolAgotadoError o
+    StreamFallido. Un error de BD a mitad del recorrido se lanza como
+    StreamFallido al iterar. La conexión queda ocupada hasta que el
+    generador se agota o se cierra. Lee de una réplica si hay alguna sana
+    (con las mismas reglas que execute_query).
+    """
+    conn = None
+    replica = _replica_para_lectura(_nombre_metrica(query, None))
+    if replica is not None:
+        try:
+            conn = replica.pool.obtener()
+            if conn is None:
+                obtener_enrutador().expulsar(replica, "no se pudo conectar")
+            else:
+                pool = replica.pool
+        except PoolAgotadoError:
+            conn = None
+
+    if conn is None:
+        pool = obtener_pool()
+        try:
+            conn = pool.obtener()
+        except PoolAgotadoError as e:
+            print(f"ERROR DE CONEXIÓN A POSTGRESQL: {e}")
+            raise
+        if conn is None:
+            raise StreamFallido("No se pudo conectar a la base de datos.")
+
+    try:
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cursor.itersize = itersize
+        # DECLARE ... CURSOR no admite EXECUTE: se usa siempre el texto SQL
+        cursor.execute(sql_de(query), params)
+    except psycopg2.Error as e:
+        print(f"Error de BD al ejecutar consulta: {e}")
+        pool.devolver(conn, descartar=True)
+        raise StreamFallido(str(e)) from e
+
+    filas = _recorrer_stream(pool, conn, cursor)
+    # Se arranca el generador: desde aquí close() (o el recolector) devuelve la conexión
+    next(filas)
+    return filas
+
+
+def _recorrer_stream(pool, conn, cursor):
+    descartar = False
+    try:
+        yield None
+        for fila in cursor:
+            yield fila
+        cursor.close()
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error de BD al ejecutar consulta: {e}")
+        descartar = True
+        raise StreamFallido(str(e)) from e
+    finally:
+        if not descartar:
+            try:
+                # Si el cliente cortó la descarga, la transacción sigue abierta
+                conn.rollback()
+            except psycopg2.Error:
+                descartar = True
+        pool.devolver(conn, descartar=descartar)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+import configuracion_db
+from metricas import nombre_consulta, observar_consulta, observar_espera_pool, registro
+from sentencias import buscar_sentencia, sql_de, sql_posicional
+
+# --- Configuración del Pool Asíncrono (asyncpg) ---
+# Las credenciales se toman de configuracion_db para no duplicarlas.
+ASYNC_POOL_MIN_SIZE = 5
+ASYNC_POOL_MAX_SIZE = 50
+ASYNC_POOL_TIMEOUT = 5.0          # Espera máxima por una conexión
+ASYNC_STATEMENT_CACHE = 256       # asyncpg prepara y cachea sentencias por conexión
+
+_pool = None
+_pool_lock = None
+
+
+async def obtener_pool_async():
+    """Pool asyncpg del proceso, creado en el primer uso dentro del event loop."""
+    global _pool, _pool_lock
+    if _pool is not None:
+        return _pool
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                host=configuracion_db.DB_HOST,
+                database=configuracion_db.DB_NAME,
+                user=configuracion_db.DB_USER,
+                password=configuracion_db.DB_PASSWORD,
+                port=int(configuracion_db.DB_PORT),
+                min_size=ASYNC_POOL_MIN_SIZE,
+                max_size=ASYNC_POOL_MAX_SIZE,
+                statement_cache_size=ASYNC_STATEMENT_CACHE,
+            )
+    return _pool
+
+
+async def cerrar_pool_async():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def _metricas_pool_async():
+    if _pool is None:
+        return []
+    return [
+        ("db_async_pool_size", (), _pool.get_size()),
+        ("db_async_pool_idle", (), _pool.get_idle_size()),
+        ("db_async_pool_max_size", (), _pool.get_max_size()),
+    ]
+
+registro.registrar_colector(_metricas_pool_async)
+
+
+def _nombre_metrica(query, query_name):
+    if query_name:
+        return query_name
+    sentencia = buscar_sentencia(query)
+    return sentencia.nombre if sentencia is not None else nombre_consulta(query)
+
+
+def _filas_afectadas(estado):
+    """asyncpg retorna la etiqueta del comando ('INSERT 0 1', 'UPDATE 3'...)."""
+    try:
+        return int(estado.rsplit(" ", 1)[-1])
+    except (AttributeError, ValueError):
+        return 0
+
+
+async def _ejecutar(conn, query, params, fetch_data, fetch_all):
+    sql = sql_posicional(query)
+    args = params or ()
+    if fetch_data:
+        fila = await conn.fetchrow(sql, *args)
+        return tuple(fila) if fila is not None else None
+    if fetch_all:
+        return [tuple(fila) for fila in await conn.fetch(sql, *args)]
+    return _filas_afectadas(await conn.execute(sql, *args))
+
+
+def _es_lectura(query, fetch_data, fetch_all):
+    return (fetch_data or fetch_all) and sql_de(query).lstrip()[:6].upper() == "SELECT"
+
+
+async def _adquirir(pool):
+    inicio = time.perf_counter()
+    try:
+        return await pool.acquire(timeout=ASYNC_POOL_TIMEOUT)
+    except (asyncio.TimeoutError, OSError, asyncpg.PostgresError) as e:
+        print(f"ERROR DE CONEXIÓN A POSTGRESQL: {e}")
+        return None
+    finally:
+        observar_espera_pool(time.perf_counter() - inicio)
+
+# =======================================================
+# EJECUCIÓN DE CONSULTAS
+# =======================================================
+
+async def execute_query_async(query, params=None, fetch_data=False, fetch_all=False, query_name=None):
+    """
+    Equivalente asíncrono de configuracion_db.execute_query (misma firma y
+    mismos valores de retorno: fila, lista de filas, filas afectadas o None).
+    Todo va a la primaria; las escrituras se anotan para marca_de_escritura_async.
+    """
+    if not _es_lectura(query, fetch_data, fetch_all):
+        configuracion_db.registrar_escritura()
+    pool = await obtener_pool_async()
+    conn = await _adquirir(pool)
+    if conn is None:
+        return None
+
+    nombre = _nombre_metrica(query, query_name)
+    inicio = time.perf_counter()
+    try:
+        result = await _ejecutar(conn, query, params, fetch_data, fetch_all)
+        observar_consulta(nombre, time.perf_counter() - inicio)
+        return result
+    except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        print(f"Error de BD al ejecutar consulta: {e}")
+        observar_consulta(nombre, time.perf_counter() - inicio, error=True)
+        return None
+    finally:
+        await pool.release(conn)
+
+
+async def marca_de_escritura_async():
+    """
+    Igual que configuracion_db.marca_de_escritura: la posición del WAL tras
+    una escritura, para que las lecturas del cliente en los workers síncronos
+    (que sí usan réplicas) esperen a que la réplica la haya aplicado.
+    """
+    if not configuracion_db.requiere_marca_de_escritura():
+        return None
+    fila = await execute_query_async(configuracion_db.QUERY_WAL_LSN, fetch_data=True, query_name="wal_lsn")
+    return fila[0] if fila else None
+
+# =======================================================
+# UNIDAD DE TRABAJO (TRANSACCIONES)
+# =======================================================
+
+class UnidadDeTrabajoAsync:
+    """Versión asíncrona de configuracion_db.UnidadDeTrabajo."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.fallida = False
+        self.exitosa = False
+
+    async def __call__(self, query, params=None, fetch_data=False, fetch_all=False, query_name=None):
+        if self.fallida:
+            return None
+        nombre = _nombre_metrica(query, query_name)
+        inicio = time.perf_counter()
+        try:
+            result = await _ejecutar(self.conn, query, params, fetch_data, fetch_all)
+            observar_consulta(nombre, time.perf_counter() - inicio)
+            return result
+        except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            print(f"Error de BD al ejecutar consulta: {e}")
+            observar_consulta(nombre, time.perf_counter() - inicio, error=True)
+            self.fallida = True
+            return None
+
+    async def execute_atomic(self, pasos):
+        result = None
+        for query, params in pasos:
+            result = await self(query, params)
+            if result is None:
+                return None
+        return result
+
+    def abortar(self):
+        self.fallida = True
+
+
+@asynccontextmanager
+async def transaccion_async():
+    """
+    Contexto de transacción asíncrono:
+
+        async with transaccion_async() as uow:
+            await uow(query, params)
+
+    Confirma al salir si nada falló; si no, revierte.
+    """
+    configuracion_db.registrar_escritura()
+    pool = await obtener_pool_async()
+    conn = await _adquirir(pool)
+    if conn is None:
+        uow = UnidadDeTrabajoAsync(None)
+        uow.fallida = True
+        yield uow
+        return
+
+    uow = UnidadDeTrabajoAsync(conn)
+    transaccion = conn.transaction()
+    try:
+        await transaccion.start()
+        yield uow
+        if uow.fallida:
+            await transaccion.rollback()
+        else:
+            await transaccion.commit()
+            uow.exitosa = True
+    except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        print(f"Error de BD al confirmar la transacción: {e}")
+        if not transaccion.is_completed():
+            await transaccion.rollback()
+    except BaseException:
+        if not transaccion.is_completed():
+            await transaccion.rollback()
+        raise
+    finally:
+        await pool.release(conn)
+
+
+async def execute_atomic_async(pasos):
+    async with transaccion_async() as uow:
+        result = await uow.execute_atomic(pasos)
+    return result if uow.exitosa else None
+
+
+async def stream_query_async(query, params=None, itersize=configuracion_db.STREAM_ITERSIZE):
+    """
+    Equivalente asíncrono de configuracion_db.stream_query: la conexión, la
+    transacción y el DECLARE se abren antes de retornar el generador
+    asíncrono de filas (lanza PoolAgotadoError o StreamFallido); un error a
+    mitad del recorrido se lanza como StreamFallido al iterar.
+    """
+    pool = await obtener_pool_async()
+    conn = await _adquirir(pool)
+    if conn is None:
+        raise configuracion_db.PoolAgotadoError("No se obtuvo una conexión del pool asíncrono.")
+
+    nombre = f"{_nombre_metrica(query, None)}_stream"
+    inicio = time.perf_counter()
+    transaccion = conn.transaction()
+    try:
+        await transaccion.start()
+        cursor = await conn.cursor(sql_posicional(query), *(params or ()))
+    except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        print(f"Error de BD al ejecutar consulta: {e}")
+        observar_consulta(nombre, time.perf_counter() - inicio, error=True)
+        await _cerrar_stream(pool, conn, transaccion)
+        raise configuracion_db.StreamFallido(str(e)) from e
+
+    filas = _recorrer_stream(pool, conn, transaccion, cursor, itersize, nombre, inicio)
+    # Se arranca el generador: desde aquí aclose() devuelve la conexión
+    await filas.__anext__()
+    return filas
+
+
+async def _recorrer_stream(pool, conn, transaccion, cursor, itersize, nombre, inicio):
+    try:
+        yield None
+        while True:
+            filas = await cursor.fetch(itersize)
+            if not filas:
+                break
+            for fila in filas:
+                yield tuple(fila)
+        await transaccion.commit()
+        observar_consulta(nombre, time.perf_counter() - inicio)
+    except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        print(f"Error de BD al ejecutar consulta: {e}")
+        observar_consulta(nombre, time.perf_counter() - inicio, error=True)
+        raise configuracion_db.StreamFallido(str(e)) from e
+    finally:
+        await _cerrar_stream(pool, conn, transaccion)
+
+
+async def _cerrar_stream(pool, conn, transaccion):
+    try:
+        # Si el cliente cortó la descarga, la transacción sigue abierta
+        if not transaccion.is_completed():
+            await transaccion.rollback()
+    except (asyncpg.PostgresError, asyncpg.InterfaceError):
+        pass
+    finally:
+        await pool.release(conn)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Generador de datos sintéticos (usuarios, servicios, reservas y pagos) para
+# benchmarks y pruebas de rendimiento contra una base de datos desechable.
+import random
+from datetime import datetime, timedelta
+
+import esquema
+import reportes
+
+CATEGORIAS = ["Salud", "Belleza", "Deporte", "Educación", "Consultoría", "Mascotas"]
+MODALIDADES = ["Presencial", "Virtual"]
+PALABRAS = ["terapia", "masaje", "clase", "asesoría", "corte", "yoga", "nutrición",
+            "fisioterapia", "coaching", "entrenamiento", "idiomas", "grooming"]
+ESTADOS_RESERVA = ["Confirmada", "Confirmada", "Confirmada", "Pendiente", "Cancelada"]
+METODOS_PAGO = ["online", "pagar en sitio", "tarjeta guardada"]
+
+def generar(usuarios=1000, servicios=100, reservas=10000, semilla=42):
+    """
+    Retorna un dict con listas de tuplas listas para insertar:
+    usuarios, servicios, reservas y pagos (columnas en el orden del esquema).
+    """
+    rnd = random.Random(semilla)
+    datos = {"usuarios": [], "servicios": [], "reservas": [], "pagos": []}
+
+    for i in range(usuarios):
+        rol = "Administrador" if i == 0 else ("Proveedor" if i % 50 == 1 else "Cliente")
+        nombre, apellido = f"Nombre{i}", f"Apellido{i}"
+        datos["usuarios"].append((
+            f"u{i}", f"usuario{i}@bench.local", "secreto123", f"{nombre} {apellido}",
+            rol, nombre, apellido, f"{10000000 + i}", "Activo",
+        ))
+
+    proveedores = [u[0] for u in datos["usuarios"] if u[4] == "Proveedor"] or ["u0"]
+    for i in range(servicios):
+        palabra = rnd.choice(PALABRAS)
+        datos["servicios"].append((
+            f"s{i}", rnd.choice(proveedores), f"Experto {i}", f"{palabra.capitalize()} {i}",
+            round(rnd.uniform(10, 200), 2), rnd.choice([30, 45, 60, 90]), rnd.randint(1, 10),
+            rnd.choice(MODALIDADES), f"Servicio de {palabra} número {i}",
+            "https://placehold.co/100x100/9400D3/ffffff?text=Service", rnd.choice(CATEGORIAS),
+        ))
+
+    inicio = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=365)
+    for i in range(reservas):
+        slot = inicio + timedelta(hours=rnd.randint(0, 24 * 395))
+        reserva_id = f"r{i}"
+        datos["reservas"].append((
+            reserva_id, f"u{rnd.randrange(usuarios)}", f"s{rnd.randrange(servicios)}",
+            slot, rnd.choice(ESTADOS_RESERVA),
+        ))
+        if rnd.random() < 0.7:
+            metodo = rnd.choice(METODOS_PAGO)
+            estado = "PENDIENTE" if metodo == "pagar en sitio" else "APROBADO"
+            datos["pagos"].append((f"p{i}", reserva_id, round(rnd.uniform(10, 200), 2), metodo, estado))
+
+    return datos
+
+
+def sembrar(uow, datos, page_size=1000):
+    """Aplica las migraciones e inserta los datos generados (execute_values) en `uow`."""
+    esquema.migrar(uow)
+    consultas = {
+        "usuarios": "INSERT INTO usuarios (id, email, password, name, role, firstName, lastName, identificationId, status) VALUES %s",
+        "servicios": "INSERT INTO servicios (id, provider_id, expert_name, name, price, duration, capacity, modality, description, image_url, category) VALUES %s",
+        "reservas": "INSERT INTO reservas (id, usuario_id, service_id, slot_time, status) VALUES %s",
+        "pagos": "INSERT INTO pagos (id, reservation_id, amount, payment_method, status) VALUES %s",
+    }
+    for tabla in ("usuarios", "servicios", "reservas", "pagos"):
+        if datos[tabla]:
+            uow.execute_values(consultas[tabla], datos[tabla], page_size=page_size)
+    if datos["reservas"]:
+        dias = [r[3].date() for r in datos["reservas"]]
+        reportes.recalcular(uow, min(dias), max(dias), {s[0] for s in datos["servicios"]})
+    uow("ANALYZE")
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+
+# --- Configuración de la Agenda ---
+HORA_APERTURA = 8            # Primera hora en la que inicia un turno
+HORA_CIERRE = 20             # Los turnos deben terminar antes de esta hora
+DISPONIBILIDAD_TTL = 60.0    # Recarga completa (otros workers también reservan)
+DISPONIBILIDAD_MAX_DIAS = 31 # Rango máximo por consulta
+
+# Reservas que no ocupan cupo
+ESTADOS_LIBERADOS = ("cancelada", "cancelado", "rechazada")
+
+
+def ocupa_cupo(estado):
+    return (estado or "").strip().lower() not in ESTADOS_LIBERADOS
+
+
+class IndiceOcupacion:
+    """
+    Índice de intervalos en memoria: por servicio guarda los inicios de sus
+    reservas ordenados. Como todas las reservas de un servicio duran lo mismo,
+    contar solapes con un turno es una búsqueda binaria sobre los inicios.
+    Se actualiza de forma incremental con cada reserva nueva.
+    """
+
+    def __init__(self, ttl=DISPONIBILIDAD_TTL, reloj=time.monotonic):
+        self.ttl = ttl
+        self.reloj = reloj
+        self._inicios = {}       # service_id -> [datetime ordenados]
+        self._cargado_en = None
+        self._lock = threading.RLock()
+
+    def vigente(self):
+        return self._cargado_en is not None and (self.reloj() - self._cargado_en) < self.ttl
+
+    QUERY_CARGA = """
+            SELECT service_id, slot_time, status
+            FROM reservas
+            WHERE slot_time >= %s
+        """
+
+    @staticmethod
+    def parametros_carga():
+        return (datetime.now() - timedelta(days=1),)
+
+    def cargar(self, db_executor):
+        """Reconstruye el índice con las reservas activas desde ayer en adelante."""
+        return self.reemplazar(db_executor(self.QUERY_CARGA, self.parametros_carga(), fetch_all=True))
+
+    def reemplazar(self, filas):
+        """Sustituye el índice por las filas (service_id, slot_time, status) dadas."""
+        if filas is None:
+            return False
+
+        inicios = {}
+        for service_id, slot_time, estado in filas:
+            if ocupa_cupo(estado):
+                inicios.setdefault(service_id, []).append(_sin_zona(slot_time))
+        for lista in inicios.values():
+            lista.sort()
+
+        with self._lock:
+            self._inicios = inicios
+            self._cargado_en = self.reloj()
+        return True
+
+    def registrar(self, service_id, slot_time):
+        """Agrega una reserva nueva al índice (O(log n) + inserción)."""
+        with self._lock:
+            bisect.insort(self._inicios.setdefault(service_id, []), _sin_zona(slot_time))
+
+    def invalidar(self):
+        with self._lock:
+            self._cargado_en = None
+
+    def ocupados(self, service_id, inicio, duracion):
+        """Número de reservas del servicio que se solapan con [inicio, inicio + duracion)."""
+        with self._lock:
+            inicios = self._inicios.get(service_id, [])
+            izquierda = bisect.bisect_right(inicios, inicio - duracion)
+            derecha = bisect.bisect_left(inicios, inicio + duracion)
+            return derecha - izquierda
+
+    def turnos_libres(self, servicio, desde, hasta):
+        """
+        Lista los turnos del servicio entre `desde` y `hasta` (fechas) con sus
+        cupos libres. `servicio` es un dict del catálogo (duration, capacity).
+        """
+        duracion = timedelta(minutes=int(servicio.get("duration") or 0))
+        capacidad = int(servicio.get("capacity") or 0)
+        if duracion <= timedelta(0) or capacidad <= 0:
+            return []
+
+        ahora = datetime.now()
+        turnos = []
+        dia = desde
+        while dia <= hasta:
+            inicio = datetime(dia.year, dia.month, dia.day, HORA_APERTURA)
+            cierre = datetime(dia.year, dia.month, dia.day, HORA_CIERRE)
+            while inicio + duracion <= cierre:
+                if inicio >= ahora:
+                    libres = capacidad - self.ocupados(servicio["id"], inicio, duracion)
+                    if libres > 0:
+                        turnos.append({
+                            "slot_time": inicio.strftime("%Y-%m-%d %H:%M:%S"),
+                            "libres": libres,
+                        })
+                inicio += duracion
+            dia += timedelta(days=1)
+        return turnos
+
+
+def _sin_zona(valor):
+    """Normaliza a datetime naive para poder comparar con los turnos generados."""
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.astimezone().replace(tzinfo=None)
+    return valor
+
+
+class Disponibilidad:
+    """Consulta de turnos libres para uno o varios servicios en un rango de fechas."""
+
+    def __init__(self, data, db_executor, catalogo, indice=None):
+        self.data = data or {}
+        self.execute_query = db_executor
+        self.catalogo = catalogo          # lista de servicios (dicts del catálogo)
+        self.indice = indice or indice_ocupacion
+
+    def consultar(self):
+        error, desde, hasta = self._rango()
+        if error is not None:
+            return error
+
+        if not self.indice.vigente() and not self.indice.cargar(self.execute_query):
+            return {"success": False, "message": "Error CRÍTICO al consultar la disponibilidad."}
+
+        return self._resultado(desde, hasta)
+
+    def _rango(self):
+        """Retorna (error, desde, hasta) a partir de los parámetros from/to."""
+        try:
+            desde = datetime.strptime(self.data.get("from") or datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d").date()
+            hasta = datetime.strptime(self.data.get("to") or desde.strftime("%Y-%m-%d"), "%Y-%m-%d").date()
+        except ValueError:
+            return {"success": False, "message": "Formato de fecha inválido (use AAAA-MM-DD)."}, None, None
+
+        if hasta < desde:
+            return {"success": False, "message": "El rango de fechas es inválido."}, None, None
+        if (hasta - desde).days >= DISPONIBILIDAD_MAX_DIAS:
+            return {"success": False, "message": f"El rango no puede superar {DISPONIBILIDAD_MAX_DIAS} días."}, None, None
+        return None, desde, hasta
+
+    def _resultado(self, desde, hasta):
+        ids = self.data.get("service_ids")
+        servicios = self.catalogo if not ids else [s for s in self.catalogo if s["id"] in set(ids)]
+
+        resultado = {s["id"]: self.indice.turnos_libres(s, desde, hasta) for s in servicios}
+        return {"success": True, "data": resultado}
+
+
+# Instancia global del proceso
+indice_ocupacion = IndiceOcupacion()
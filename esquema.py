@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+# Esquema versionado de la BD y verificación de planes.
+#
+#   python esquema.py              -> aplica las migraciones pendientes
+#   python esquema.py --estado     -> versiones aplicadas y pendientes
+#   python esquema.py --planes     -> EXPLAIN de las consultas de logica.py
+#
+# Cada migración corre en la misma transacción que su registro en
+# esquema_migraciones, bajo un candado para que dos workers que arrancan a la
+# vez no la apliquen dos veces. Todo usa IF NOT EXISTS: sobre una BD creada a
+# mano solo se agrega lo que falte.
+import argparse
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import cambios
+import idempotencia
+import liquidacion
+import reportes
+from sentencias import sql_de, sentencias_registradas
+
+ESQUEMA_BASE = """
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id VARCHAR(50) PRIMARY KEY,
+        email VARCHAR(255) NOT NULL UNIQUE,
+        password VARCHAR(255) NOT NULL,
+        name VARCHAR(255),
+        role VARCHAR(50) NOT NULL DEFAULT 'Cliente',
+        firstName VARCHAR(100),
+        lastName VARCHAR(100),
+        identificationId VARCHAR(50),
+        status VARCHAR(20) DEFAULT 'Activo'
+    );
+    CREATE TABLE IF NOT EXISTS servicios (
+        id VARCHAR(50) PRIMARY KEY,
+        provider_id VARCHAR(50),
+        expert_name VARCHAR(255),
+        name VARCHAR(255) NOT NULL,
+        price NUMERIC(10, 2) NOT NULL,
+        duration INTEGER NOT NULL,
+        capacity INTEGER NOT NULL,
+        modality VARCHAR(50),
+        description TEXT,
+        image_url TEXT,
+        category VARCHAR(100)
+    );
+    CREATE TABLE IF NOT EXISTS reservas (
+        id VARCHAR(50) PRIMARY KEY,
+        usuario_id VARCHAR(50) NOT NULL REFERENCES usuarios(id),
+        service_id VARCHAR(50) NOT NULL REFERENCES servicios(id),
+        slot_time TIMESTAMP NOT NULL,
+        status VARCHAR(30) NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS pagos (
+        id VARCHAR(50) PRIMARY KEY,
+        reservation_id VARCHAR(50) NOT NULL REFERENCES reservas(id),
+        amount NUMERIC(10, 2) NOT NULL,
+        payment_method VARCHAR(50) NOT NULL,
+        status VARCHAR(20) NOT NULL
+    );
+"""
+
+# Índices de las consultas calientes. En una tabla grande en producción
+# conviene crearlos antes con CREATE INDEX CONCURRENTLY (mismo nombre): la
+# migración los encuentra y no bloquea escrituras.
+ESQUEMA_INDICES = """
+    -- Login.autenticar y Usuario.existe_en_bd (WHERE email = %s). Mismo nombre
+    -- que el índice de la restricción UNIQUE, para no duplicarlo.
+    CREATE UNIQUE INDEX IF NOT EXISTS usuarios_email_key ON usuarios (email);
+
+    -- Historial del cliente: WHERE usuario_id = %s ORDER BY slot_time DESC, id DESC (keyset)
+    CREATE INDEX IF NOT EXISTS reservas_usuario_slot ON reservas (usuario_id, slot_time DESC, id DESC);
+
+    -- Historial del manager paginado y carga de disponibilidad (slot_time >= ayer)
+    CREATE INDEX IF NOT EXISTS reservas_slot ON reservas (slot_time DESC, id DESC);
+
+    -- Cupo de Reserva: service_id y rango de slot_time; status incluido para index-only scan
+    CREATE INDEX IF NOT EXISTS reservas_servicio_slot ON reservas (service_id, slot_time) INCLUDE (status);
+
+    -- LEFT JOIN pagos del historial, con las columnas que lee
+    CREATE INDEX IF NOT EXISTS pagos_reserva ON pagos (reservation_id) INCLUDE (amount, payment_method, status);
+"""
+
+# (versión, nombre, SQL): solo se agregan al final, nunca se editan las aplicadas
+MIGRACIONES = [
+    (1, "tablas_base", ESQUEMA_BASE),
+    (2, "indices_consultas", ESQUEMA_INDICES),
+    (3, "reporte_diario", reportes.ESQUEMA_REPORTES),
+    (4, "cambios_historial", cambios.ESQUEMA_CAMBIOS),
+    (5, "claves_idempotencia", idempotencia.ESQUEMA_IDEMPOTENCIA),
+    (6, "liquidacion_pagos", liquidacion.ESQUEMA_LIQUIDACION),
+    (7, "liquidacion_reclamos", liquidacion.ESQUEMA_RECLAMOS),
+]
+
+ESQUEMA_MIGRACIONES = """
+    CREATE TABLE IF NOT EXISTS esquema_migraciones (
+        version INTEGER PRIMARY KEY,
+        nombre VARCHAR(100) NOT NULL,
+        aplicada TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+LOCK_MIGRACIONES = "SELECT pg_advisory_xact_lock(hashtext('esquema_migraciones'))"
+
+# --- Configuración de la Verificación de Planes ---
+PLANES_FILAS_MIN = 1000      # Un Seq Scan sobre una tabla más chica no se considera problema
+# Consultas que leen la tabla completa a propósito (catálogo, exportación del historial)
+PLANES_LECTURA_COMPLETA = {"catalog_scan", "history_manager", "history_manager_cursor"}
+
+# =======================================================
+# MIGRACIONES
+# =======================================================
+
+def versiones_aplicadas(uow):
+    uow(ESQUEMA_MIGRACIONES)
+    filas = uow("SELECT version FROM esquema_migraciones", fetch_all=True)
+    return None if filas is None else {fila[0] for fila in filas}
+
+
+def migrar(uow, hasta=None):
+    """
+    Aplica dentro de `uow` las migraciones pendientes (hasta la versión
+    `hasta`, o todas). Retorna las versiones aplicadas, o None si algo falló
+    (la unidad queda marcada como fallida y se revierte completa).
+    """
+    uow(LOCK_MIGRACIONES)
+    aplicadas = versiones_aplicadas(uow)
+    if aplicadas is None:
+        return None
+
+    nuevas = []
+    for version, nombre, sql in MIGRACIONES:
+        if version in aplicadas or (hasta is not None and version > hasta):
+            continue
+        if uow(sql) is None:
+            print(f"ERROR al aplicar la migración {version} ({nombre}).")
+            return None
+        uow("INSERT INTO esquema_migraciones (version, nombre) VALUES (%s, %s)", (version, nombre))
+        nuevas.append(version)
+    return nuevas
+
+# =======================================================
+# VERIFICACIÓN DE PLANES (EXPLAIN)
+# =======================================================
+
+QUERY_MUESTRA = """
+    SELECT u.email, u.id, r.id, r.slot_time, r.service_id,
+           (SELECT COALESCE(MAX(cambio_tx), 0) + 1 FROM reservas)
+    FROM reservas r
+    JOIN usuarios u ON u.id = r.usuario_id
+    ORDER BY r.slot_time DESC, r.id DESC
+    LIMIT 1
+"""
+
+
+def consultas_criticas(muestra):
+    """
+    [(nombre, query, params)] de cada consulta de logica.py, de los reportes,
+    de la idempotencia y de la liquidación, armadas con los mismos métodos que usa la
+    aplicación y con valores reales de la BD en `muestra`.
+    """
+    from logica import Login, Usuario, Servicio, HistorialReservas, Reserva, Pago
+    from reportes import Reportes
+
+    email, usuario_id, reserva_id, slot_time, service_id, cambio_tx = muestra
+    consultas = [
+        ("login_lookup", Login.QUERY_LOGIN, (email,)),
+        ("usuario_existe", Usuario.QUERY_EXISTE, (email,)),
+        ("usuario_insert", Usuario.INSERT_USUARIO,
+         (str(uuid.uuid4()), f"plan-{uuid.uuid4().hex}@verificacion.local", "x", "x", "x", "x", "x")),
+        ("catalog_scan", Servicio.QUERY_CATALOGO, None),
+        ("servicio_insert", Servicio.INSERT_SERVICIO,
+         (str(uuid.uuid4()), usuario_id, "x", "x", 1, 30, 1, "Virtual", "x", "x", "x")),
+    ]
+
+    for is_manager in (False, True):
+        historial = HistorialReservas({'usuario_id': usuario_id, 'is_manager': is_manager}, None)
+        for cursor in (None, (slot_time, reserva_id)):
+            for limite in (None, HistorialReservas.PAGE_SIZE_DEFAULT):
+                query, params = historial._consulta(cursor, limite)
+                consultas.append((query, query, params))
+        query, params = historial._consulta_cambios((cambio_tx, cambio_tx, ""), 200)
+        consultas.append((query, query, params))
+
+    reserva = Reserva({
+        'usuarioId': usuario_id, 'serviceId': service_id, 'slotTime': f"{slot_time:%Y-%m-%d %H:%M:%S}",
+        'status': 'Confirmada', 'userEmail': email, 'serviceName': 'x',
+    }, None)
+    _, pasos = reserva._preparar()
+    consultas += [(query, query, params) for query, params in pasos]
+
+    _, params_pago, _ = Pago({'metodo': 'online', 'monto': 1, 'reserva_id': reserva_id}, None)._preparar()
+    consultas.append(("pago_insert", Pago.INSERT_PAGO, params_pago))
+    consultas += [
+        ("pago_estado", Pago.QUERY_ESTADO, (str(uuid.uuid4()),)),
+        ("payment_settle", liquidacion.LIQUIDAR, ([str(uuid.uuid4())], ["APROBADO"])),
+        ("payment_stale", liquidacion.PENDIENTES_VENCIDOS,
+         (liquidacion.LIQUIDACION_VENCIDO, liquidacion.LIQUIDACION_VENCIDO,
+          liquidacion.LIQUIDACION_RECONCILIACION_MAX, liquidacion.LIQUIDACION_VENCIDO)),
+    ]
+
+    hoy = datetime.now().date()
+    rango = {"from": f"{hoy - timedelta(days=30):%Y-%m-%d}", "to": f"{hoy:%Y-%m-%d}"}
+    for data, catalogo in ((rango, []), (dict(rango, service_ids=[service_id]), [{"id": service_id}])):
+        _, (query, params) = Reportes(data, None, catalogo)._preparar()
+        consultas.append((query, query, params))
+
+    clave = ("/api/reservation|", uuid.uuid4().hex)
+    consultas += [
+        ("idempotency_lock", idempotencia.LOCK_CLAVE, clave),
+        ("idempotency_select", idempotencia.SELECT_CLAVE, clave),
+        ("idempotency_insert", idempotencia.INSERT_CLAVE, clave + ("0" * 64, 201, "{}", idempotencia.IDEMPOTENCIA_TTL)),
+    ]
+
+    # Las sentencias declaradas se identifican por su nombre registrado
+    registradas = {s.sql: nombre for nombre, s in sentencias_registradas().items()}
+    return [(registradas.get(sql_de(query), nombre), query, params) for nombre, query, params in consultas]
+
+
+def _nodos(plan):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def verificar_planes(conector):
+    """
+    EXPLAIN de cada consulta crítica contra la BD de `conector()` (ya
+    sembrada y con ANALYZE). Retorna la lista de problemas: Seq Scan sobre
+    tablas de PLANES_FILAS_MIN filas o más, y sentencias declaradas que no
+    están en consultas_criticas().
+    """
+    conn = conector()
+    if conn is None:
+        return ["No se pudo conectar a la BD para verificar los planes."]
+    try:
+        # Autocommit: un EXPLAIN que falla no invalida los siguientes
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(QUERY_MUESTRA)
+        muestra = cursor.fetchone()
+        if muestra is None:
+            return ["La BD no tiene reservas: siembre datos antes de verificar los planes."]
+
+        consultas = consultas_criticas(muestra)
+        cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+        filas_por_tabla = dict(cursor.fetchall())
+
+        problemas = []
+        for nombre, query, params in consultas:
+            try:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql_de(query), params)
+                plan = cursor.fetchone()[0]
+            except Exception as e:
+                problemas.append(f"{nombre}: error en EXPLAIN: {e}")
+                continue
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            if nombre in PLANES_LECTURA_COMPLETA:
+                continue
+            for nodo in _nodos(plan[0]["Plan"]):
+                tabla = nodo.get("Relation Name")
+                filas = filas_por_tabla.get(tabla, 0)
+                if nodo["Node Type"] == "Seq Scan" and filas >= PLANES_FILAS_MIN:
+                    problemas.append(f"{nombre}: Seq Scan sobre {tabla} (~{int(filas)} filas)")
+
+        verificadas = {nombre for nombre, _, _ in consultas}
+        for nombre in sorted(sentencias_registradas()):
+            if nombre not in verificadas:
+                problemas.append(f"{nombre}: sentencia sin verificar (agréguela a consultas_criticas)")
+        return problemas
+    finally:
+        conn.close()
+
+# =======================================================
+# CLI
+# =======================================================
+
+def main(argv=None):
+    from configuracion_db import transaccion, conectar_db
+
+    ap = argparse.ArgumentParser(description="Migraciones del esquema y verificación de planes.")
+    ap.add_argument("--hasta", type=int, help="Aplica solo hasta esta versión")
+    ap.add_argument("--estado", action="store_true", help="Muestra las versiones aplicadas y pendientes")
+    ap.add_argument("--planes", action="store_true", help="Verifica con EXPLAIN que no haya Seq Scan en consultas calientes")
+    args = ap.parse_args(argv)
+
+    if args.planes:
+        problemas = verificar_planes(conectar_db)
+        for problema in problemas:
+            print(f"  - {problema}")
+        print("Planes sin Seq Scan en consultas calientes." if not problemas else "\nPLANES CON PROBLEMAS.")
+        return 1 if problemas else 0
+
+    if args.estado:
+        with transaccion() as uow:
+            aplicadas = versiones_aplicadas(uow)
+        if aplicadas is None:
+            print("ERROR: no se pudo leer esquema_migraciones.")
+            return 1
+        for version, nombre, _ in MIGRACIONES:
+            print(f"{version:>4}  {nombre:<25} {'aplicada' if version in aplicadas else 'PENDIENTE'}")
+        return 0
+
+    with transaccion() as uow:
+        nuevas = migrar(uow, args.hasta)
+    if nuevas is None or not uow.exitosa:
+        print("ERROR: las migraciones se revirtieron.")
+        return 1
+    print(f"Migraciones aplicadas: {nuevas}" if nuevas else "El esquema ya está al día.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
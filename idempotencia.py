@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# Claves de idempotencia (cabecera Idempotency-Key) para POST /api/reservation
+# y /api/process_payment.
+#
+# La respuesta de una operación exitosa se guarda en claves_idempotencia en la
+# MISMA transacción que la reserva o el pago: o quedan ambas o ninguna. Un
+# candado transaccional por clave hace que un duplicado concurrente (de otro
+# worker) espere el COMMIT del primero y luego lea su respuesta. Dentro del
+# proceso los duplicados esperan un turno por clave y las respuestas recientes
+# se sirven desde un LRU sin tocar la BD.
+#
+# Solo se guardan los éxitos: un fallo (sin cupo, validación, error de BD) no
+# escribió nada, así que repetirlo es seguro.
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sentencias import declarar_sentencia
+
+# --- Configuración de la Idempotencia ---
+IDEMPOTENCIA_TTL = 24 * 3600          # Vigencia de una clave (segundos)
+IDEMPOTENCIA_CACHE_MAX = 10000        # Respuestas recientes en memoria (LRU)
+IDEMPOTENCIA_ESPERA = 10.0            # Segundos que un duplicado espera al primero antes de 409
+IDEMPOTENCIA_CLAVE_MAX = 255
+IDEMPOTENCIA_PURGA_CADA = 1000        # Cada cuántas claves guardadas se borran las vencidas
+
+ESQUEMA_IDEMPOTENCIA = """
+    CREATE TABLE IF NOT EXISTS claves_idempotencia (
+        ambito VARCHAR(300) NOT NULL,
+        clave VARCHAR(255) NOT NULL,
+        huella CHAR(64) NOT NULL,
+        codigo SMALLINT NOT NULL,
+        respuesta TEXT NOT NULL,
+        expira TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (ambito, clave)
+    );
+    CREATE INDEX IF NOT EXISTS claves_idempotencia_expira ON claves_idempotencia (expira);
+"""
+
+# Par de int4: no se cruza con los candados de un solo bigint de reservas y reportes
+LOCK_CLAVE = declarar_sentencia(
+    "idempotency_lock", "SELECT pg_advisory_xact_lock(hashtext(%s), hashtext(%s))", ["text", "text"])
+SELECT_CLAVE = declarar_sentencia("idempotency_select", """
+    SELECT huella, codigo, respuesta, EXTRACT(EPOCH FROM expira)::float8
+    FROM claves_idempotencia
+    WHERE ambito = %s AND clave = %s AND expira > now()
+""", ["text", "text"])
+# Una fila vencida que aún no se purgó se reemplaza
+INSERT_CLAVE = declarar_sentencia("idempotency_insert", """
+    INSERT INTO claves_idempotencia (ambito, clave, huella, codigo, respuesta, expira)
+    VALUES (%s, %s, %s, %s, %s, now() + %s * INTERVAL '1 second')
+    ON CONFLICT (ambito, clave) DO UPDATE
+        SET huella = EXCLUDED.huella, codigo = EXCLUDED.codigo,
+            respuesta = EXCLUDED.respuesta, expira = EXCLUDED.expira
+""", ["text", "text", "text", "smallint", "text", "integer"])
+PURGAR_VENCIDAS = "DELETE FROM claves_idempotencia WHERE expira < now()"
+
+
+def validar_clave(clave):
+    """Retorna un mensaje de error o None si la clave es utilizable."""
+    if not clave or not clave.strip():
+        return "La cabecera Idempotency-Key está vacía."
+    if len(clave) > IDEMPOTENCIA_CLAVE_MAX:
+        return f"La cabecera Idempotency-Key supera {IDEMPOTENCIA_CLAVE_MAX} caracteres."
+    return None
+
+
+def huella_solicitud(data):
+    """SHA-256 del cuerpo: la misma clave con otro cuerpo es un error del cliente."""
+    canonico = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+class RegistroIdempotencia:
+    """
+    Ejecuta una operación a lo sumo una vez por (ambito, clave).
+    `operacion(uow)` retorna (codigo, cuerpo, efectos): los efectos (correo,
+    índices en memoria) se llaman solo tras el COMMIT de la primera ejecución.
+    ejecutar() / ejecutar_async() retornan (codigo, cuerpo, repetida).
+    """
+
+    def __init__(self, ttl=IDEMPOTENCIA_TTL, max_entradas=IDEMPOTENCIA_CACHE_MAX,
+                 espera=IDEMPOTENCIA_ESPERA, reloj=time.time):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.espera = espera
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._respuestas = OrderedDict()   # (ambito, clave) -> (huella, codigo, cuerpo, expira)
+        self._turnos = {}                  # (ambito, clave) -> [candado, esperando]
+        self._turnos_async = {}            # Igual, con asyncio.Lock (un solo event loop)
+        self._guardadas = 0
+        self.contadores = {"ejecutadas": 0, "repetidas": 0, "en_curso": 0, "conflictos": 0}
+
+    # --- Respuestas recientes (LRU) ---
+
+    def _recordada(self, k):
+        with self._lock:
+            guardada = self._respuestas.get(k)
+            if guardada is None:
+                return None
+            if guardada[3] <= self.reloj():
+                del self._respuestas[k]
+                return None
+            self._respuestas.move_to_end(k)
+            return guardada
+
+    def _recordar(self, k, guardada):
+        with self._lock:
+            self._respuestas[k] = guardada
+            self._respuestas.move_to_end(k)
+            while len(self._respuestas) > self.max_entradas:
+                self._respuestas.popitem(last=False)
+
+    def _repetir(self, guardada, huella):
+        if guardada[0] != huella:
+            self.contadores["conflictos"] += 1
+            return 422, {"message": "La clave de idempotencia ya se usó con otra solicitud."}, False
+        self.contadores["repetidas"] += 1
+        return guardada[1], guardada[2], True
+
+    def _en_curso(self):
+        self.contadores["en_curso"] += 1
+        return 409, {"message": "Una solicitud con la misma clave de idempotencia sigue en curso."}, False
+
+    # --- Turnos por clave dentro del proceso ---
+
+    def _tomar_turno(self, turnos, k, fabrica):
+        with self._lock:
+            turno = turnos.get(k)
+            if turno is None:
+                turno = turnos[k] = [fabrica(), 0]
+            turno[1] += 1
+            return turno[0]
+
+    def _soltar_turno(self, turnos, k):
+        with self._lock:
+            turno = turnos[k]
+            turno[1] -= 1
+            if turno[1] == 0:
+                del turnos[k]
+
+    # --- Ejecución ---
+
+    def _leida(self, fila):
+        return fila[0], fila[1], json.loads(fila[2]), float(fila[3])
+
+    def _guardar(self, k, huella, codigo, cuerpo):
+        self.contadores["ejecutadas"] += 1
+        self._recordar(k, (huella, codigo, cuerpo, self.reloj() + self.ttl))
+        with self._lock:
+            self._guardadas += 1
+            return self._guardadas % IDEMPOTENCIA_PURGA_CADA == 0
+
+    def _params_insert(self, k, huella, codigo, cuerpo):
+        return (k[0], k[1], huella, codigo, json.dumps(cuerpo, ensure_ascii=False, default=str), self.ttl)
+
+    def ejecutar(self, transaccion, ambito, clave, huella, operacion):
+        k = (ambito, clave)
+        guardada = self._recordada(k)
+        if guardada is not None:
+            return self._repetir(guardada, huella)
+
+        turno = self._tomar_turno(self._turnos, k, threading.Lock)
+        try:
+            if not turno.acquire(timeout=self.espera):
+                return self._en_curso()
+            try:
+                guardada = self._recordada(k)
+                if guardada is not None:
+                    return self._repetir(guardada, huella)
+                return self._ejecutar_una_vez(transaccion, k, huella, operacion)
+            finally:
+                turno.release()
+        finally:
+            self._soltar_turno(self._turnos, k)
+
+    def _ejecutar_una_vez(self, transaccion, k, huella, operacion):
+        guardada = None
+        efectos = None
+        with transaccion() as uow:
+            # Un duplicado de otro proceso espera aquí hasta el COMMIT del primero
+            uow(LOCK_CLAVE, k)
+            fila = uow(SELECT_CLAVE, k, fetch_data=True)
+            if fila is not None:
+                guardada = self._leida(fila)
+            elif not uow.fallida:
+                codigo, cuerpo, efectos = operacion(uow)
+                if codigo >= 300:
+                    uow.abortar()
+                    return codigo, cuerpo, False
+                uow(INSERT_CLAVE, self._params_insert(k, huella, codigo, cuerpo))
+
+        if guardada is not None:
+            self._recordar(k, guardada)
+            return self._repetir(guardada, huella)
+        if not uow.exitosa:
+            return 400, {"message": "Error CRÍTICO al registrar la solicitud en la base de datos."}, False
+
+        if efectos is not None:
+            efectos()
+        if self._guardar(k, huella, codigo, cuerpo):
+            with transaccion() as uow:
+                uow(PURGAR_VENCIDAS)
+        return codigo, cuerpo, False
+
+    async def ejecutar_async(self, transaccion_async, ambito, clave, huella, operacion):
+        """Igual que ejecutar(), con transaccion_async y `operacion` asíncrona."""
+        k = (ambito, clave)
+        guardada = self._recordada(k)
+        if guardada is not None:
+            return self._repetir(guardada, huella)
+
+        turno = self._tomar_turno(self._turnos_async, k, asyncio.Lock)
+        try:
+            try:
+                await asyncio.wait_for(turno.acquire(), self.espera)
+            except asyncio.TimeoutError:
+                return self._en_curso()
+            try:
+                guardada = self._recordada(k)
+                if guardada is not None:
+                    return self._repetir(guardada, huella)
+                return await self._ejecutar_una_vez_async(transaccion_async, k, huella, operacion)
+            finally:
+                turno.release()
+        finally:
+            self._soltar_turno(self._turnos_async, k)
+
+    async def _ejecutar_una_vez_async(self, transaccion_async, k, huella, operacion):
+        guardada = None
+        efectos = None
+        async with transaccion_async() as uow:
+            await uow(LOCK_CLAVE, k)
+            fila = await uow(SELECT_CLAVE, k, fetch_data=True)
+            if fila is not None:
+                guardada = self._leida(fila)
+            elif not uow.fallida:
+                codigo, cuerpo, efectos = await operacion(uow)
+                if codigo >= 300:
+                    uow.abortar()
+                    return codigo, cuerpo, False
+                await uow(INSERT_CLAVE, self._params_insert(k, huella, codigo, cuerpo))
+
+        if guardada is not None:
+            self._recordar(k, guardada)
+            return self._repetir(guardada, huella)
+        if not uow.exitosa:
+            return 400, {"message": "Error CRÍTICO al registrar la solicitud en la base de datos."}, False
+
+        if efectos is not None:
+            efectos()
+        if self._guardar(k, huella, codigo, cuerpo):
+            async with transaccion_async() as uow:
+                await uow(PURGAR_VENCIDAS)
+        return codigo, cuerpo, False
+
+    def estadisticas(self):
+        with self._lock:
+            stats = dict(self.contadores)
+            stats["en_cache"] = len(self._respuestas)
+        return stats
+
+
+# Instancia global del proceso
+registro_idempotencia = RegistroIdempotencia()
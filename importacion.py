@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import uuid
+from abc import ABC, abstractmethod
+
+from dateutil import parser
+
+from busqueda_catalogo import indice_catalogo
+from cache_catalogo import cache_catalogo
+from disponibilidad import indice_ocupacion
+from logica import Servicio, Reserva
+from reportes import ActualizadorReportes
+
+# --- Configuración de la Carga Masiva ---
+IMPORT_CHUNK_SIZE = 1000    # Filas por INSERT multi-fila
+IMPORT_MAX_ERRORES = 1000   # Errores por fila que se reportan como máximo
+
+# Límites de las columnas (esquema.ESQUEMA_BASE): una fila que los supera
+# abortaría el INSERT del lote entero, así que se rechaza al validarla
+LONGITUDES_SERVICIO = {'providerId': 50, 'expertName': 255, 'name': 255, 'modality': 50, 'category': 100}
+LONGITUDES_RESERVA = {'usuarioId': 50, 'serviceId': 50, 'status': 30}
+PRECIO_MAX = 10 ** 8        # NUMERIC(10, 2)
+ENTERO_MAX = 2 ** 31 - 1    # INTEGER
+
+
+def validar_longitudes(fila, longitudes):
+    for campo, maximo in longitudes.items():
+        valor = fila.get(campo)
+        if valor is not None and len(str(valor)) > maximo:
+            raise ValueError(f"{campo} supera {maximo} caracteres.")
+
+
+class ImportadorMasivo(ABC):
+    """
+    Base de las cargas masivas: lee y valida todo el cuerpo fila a fila con
+    las reglas de la lógica de negocio (y los límites de las columnas) antes
+    de abrir la transacción, y luego inserta las filas válidas en lotes con
+    execute_values dentro de una única transacción.
+    """
+
+    QUERY = None
+
+    def __init__(self, filas, db_transaction, chunk_size=IMPORT_CHUNK_SIZE):
+        self.filas = filas
+        self.transaccion = db_transaction
+        self.chunk_size = chunk_size
+        self.errores = []
+        self.insertados = 0
+
+    @abstractmethod
+    def validar(self, fila):
+        """Retorna la tupla a insertar o lanza ValueError con el motivo."""
+
+    def filtrar_lote(self, uow, lote):
+        """Permite descartar filas del lote con consultas a la BD (claves foráneas)."""
+        return lote
+
+    def antes_de_confirmar(self, uow):
+        """Sentencias adicionales dentro de la misma transacción, tras insertar los lotes."""
+
+    def despues_de_importar(self):
+        """Efectos tras el COMMIT (invalidar caches, índices...)."""
+
+    def _error(self, numero, mensaje):
+        if len(self.errores) < IMPORT_MAX_ERRORES:
+            self.errores.append({"fila": numero, "message": mensaje})
+
+    def _volcar(self, uow, lote):
+        lote = self.filtrar_lote(uow, lote)
+        if not lote:
+            return
+        if uow.execute_values(self.QUERY, [valores for _, valores in lote], page_size=self.chunk_size) is not None:
+            self.insertados += len(lote)
+
+    def _validadas(self):
+        """
+        Consume todas las filas (el CSV llega en streaming) antes de tocar la
+        BD: un cliente lento no retiene una conexión ni una transacción abierta.
+        """
+        total = 0
+        validas = []
+        for numero, fila in enumerate(self.filas, start=1):
+            total = numero
+            if not isinstance(fila, dict):
+                self._error(numero, "La fila debe ser un objeto.")
+                continue
+            try:
+                validas.append((numero, self.validar(fila)))
+            except ValueError as e:
+                self._error(numero, str(e))
+        return total, validas
+
+    def importar(self):
+        total, validas = self._validadas()
+        with self.transaccion() as uow:
+            for inicio in range(0, len(validas), self.chunk_size):
+                self._volcar(uow, validas[inicio:inicio + self.chunk_size])
+                if uow.fallida:
+                    break
+            if self.insertados and not uow.fallida:
+                self.antes_de_confirmar(uow)
+
+        if not uow.exitosa:
+            return {"success": False, "message": "Error CRÍTICO en la carga masiva; no se guardó ninguna fila.", "errores": self.errores}
+
+        if self.insertados:
+            self.despues_de_importar()
+
+        return {
+            "success": True,
+            "message": f"Carga masiva completada: {self.insertados} de {total} filas importadas.",
+            "total": total,
+            "insertados": self.insertados,
+            "errores": self.errores,
+        }
+
+
+class ImportadorServicios(ImportadorMasivo):
+    """Carga masiva del catálogo de un proveedor."""
+
+    QUERY = """
+        INSERT INTO servicios (id, provider_id, expert_name, name, price, duration, capacity, modality, description, image_url, category)
+        VALUES %s
+    """
+
+    def validar(self, fila):
+        if not all(fila.get(field) for field in Servicio.REQUIRED_FIELDS):
+            raise ValueError("Faltan campos obligatorios para el servicio.")
+        datos = Servicio.normalizar_numeros(fila)
+        if datos['price'] <= 0 or datos['duration'] <= 0 or datos['capacity'] <= 0:
+            raise ValueError("price, duration y capacity deben ser mayores a 0.")
+        if datos['price'] >= PRECIO_MAX or datos['duration'] > ENTERO_MAX or datos['capacity'] > ENTERO_MAX:
+            raise ValueError("price, duration o capacity fuera de rango.")
+        validar_longitudes(datos, LONGITUDES_SERVICIO)
+        # En CSV las columnas opcionales llegan como cadenas vacías
+        for opcional in ('image', 'category'):
+            if not datos.get(opcional):
+                datos.pop(opcional, None)
+        return Servicio.valores_insert(datos, str(uuid.uuid4())[:50])
+
+    def despues_de_importar(self):
+        cache_catalogo.invalidar()
+        indice_catalogo.invalidar()
+
+
+class ImportadorReservas(ImportadorMasivo):
+    """
+    Migración de agendas desde otras herramientas. Las reservas importadas
+    son históricas: no envían correo ni pasan por el control de cupos.
+    """
+
+    def __init__(self, filas, db_transaction, chunk_size=IMPORT_CHUNK_SIZE):
+        super().__init__(filas, db_transaction, chunk_size)
+        self.dia_min = None
+        self.dia_max = None
+        self.servicios = set()
+
+    QUERY = """
+        INSERT INTO reservas (id, usuario_id, service_id, slot_time, status)
+        VALUES %s
+    """
+
+    def validar(self, fila):
+        if not all(fila.get(field) for field in Reserva.REQUIRED_FIELDS_BD):
+            raise ValueError("Faltan campos obligatorios para la reserva.")
+        validar_longitudes(fila, LONGITUDES_RESERVA)
+        try:
+            slot_time_dt = parser.parse(fila['slotTime'])
+        except Exception as e:
+            raise ValueError(f"Formato de fecha u hora inválido: {e}")
+        dia = slot_time_dt.date()
+        self.dia_min = dia if self.dia_min is None else min(self.dia_min, dia)
+        self.dia_max = dia if self.dia_max is None else max(self.dia_max, dia)
+        self.servicios.add(fila['serviceId'])
+        return (str(uuid.uuid4())[:50], fila['usuarioId'], fila['serviceId'], slot_time_dt, fila['status'])
+
+    def filtrar_lote(self, uow, lote):
+        """Descarta las filas cuyo usuario o servicio no existe (evita abortar la transacción)."""
+        usuarios = list({valores[1] for _, valores in lote})
+        servicios = list({valores[2] for _, valores in lote})
+        filas_u = uow("SELECT id FROM usuarios WHERE id = ANY(%s)", (usuarios,), fetch_all=True)
+        filas_s = uow("SELECT id FROM servicios WHERE id = ANY(%s)", (servicios,), fetch_all=True)
+        if filas_u is None or filas_s is None:
+            return []
+        existentes_u = {f[0] for f in filas_u}
+        existentes_s = {f[0] for f in filas_s}
+
+        validas = []
+        for numero, valores in lote:
+            if valores[1] not in existentes_u:
+                self._error(numero, f"El usuario {valores[1]} no existe.")
+            elif valores[2] not in existentes_s:
+                self._error(numero, f"El servicio {valores[2]} no existe.")
+            else:
+                validas.append((numero, valores))
+        return validas
+
+    def despues_de_importar(self):
+        indice_ocupacion.invalidar()
+        # Las filas de execute_values no suman su delta: tras el COMMIT se
+        # recalculan los días y servicios importados, uno por transacción
+        # (en la de la carga, un rango largo agotaría max_locks_per_transaction)
+        ActualizadorReportes(self.transaccion).recalcular(self.dia_min, self.dia_max, servicios=self.servicios)
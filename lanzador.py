@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Arranque de producción de server.py con N workers preforkeados.
+#
+#   python lanzador.py --workers 4 --port 5000
+#
+# El maestro abre el socket de escucha y (salvo --sin-precarga) importa
+# server.py y crea la app con create_app() antes del fork: los workers
+# comparten esas páginas (copy-on-write) y no repiten los imports. Nada de
+# eso abre conexiones; cada worker crea su pool tras el fork, lo calienta
+# junto con el catálogo (server.calentar) y solo entonces empieza a aceptar
+# conexiones y avisa al maestro.
+#
+# SIGTERM o Ctrl+C al maestro se reenvía a los workers: dejan de aceptar,
+# cortan los streams SSE, esperan las peticiones en curso (hasta
+# LANZADOR_DRENAJE s) y cierran con server.apagar(). Un worker que muere sin
+# que se le pida se reemplaza.
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+# --- Configuración del Lanzador ---
+LANZADOR_WORKERS = os.cpu_count() or 2
+LANZADOR_BACKLOG = 2048        # Conexiones en espera en el socket compartido
+LANZADOR_DRENAJE = 30.0        # Segundos máximos para terminar las peticiones en curso
+LANZADOR_APAGADO = 30.0        # Segundos extra para server.apagar() antes de SIGKILL
+LANZADOR_REINICIO_MIN = 1.0    # Espera mínima entre reemplazos del mismo worker (evita bucles de caídas)
+
+# =======================================================
+# WORKER
+# =======================================================
+
+class PeticionesEnCurso:
+    """
+    Middleware WSGI que cuenta las peticiones en curso hasta que se cierra
+    su respuesta (incluidos los streams), para drenarlas al apagar.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self._cond = threading.Condition()
+        self.en_curso = 0
+
+    def __call__(self, environ, start_response):
+        with self._cond:
+            self.en_curso += 1
+        try:
+            cuerpo = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._terminar()
+            raise
+        return _CuerpoContado(cuerpo, self._terminar)
+
+    def _terminar(self):
+        with self._cond:
+            self.en_curso -= 1
+            self._cond.notify_all()
+
+    def esperar(self, timeout):
+        """Espera a que no quede ninguna petición en curso; retorna False si vence `timeout`."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.en_curso == 0, timeout)
+
+
+class _CuerpoContado:
+    """Respuesta WSGI que avisa al cerrarse (el servidor llama a close() al terminar de enviarla)."""
+
+    def __init__(self, cuerpo, al_cerrar):
+        self._cuerpo = cuerpo
+        self._al_cerrar = al_cerrar
+
+    def __iter__(self):
+        return iter(self._cuerpo)
+
+    def close(self):
+        try:
+            if hasattr(self._cuerpo, "close"):
+                self._cuerpo.close()
+        finally:
+            self._al_cerrar()
+
+
+def _worker(indice, sock, aviso, args, app):
+    """Cuerpo de un worker tras el fork: calienta, sirve y drena al recibir SIGTERM."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)     # Ctrl+C lo gestiona el maestro
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+
+    inicio = time.perf_counter()
+    import server
+    from werkzeug.serving import make_server
+    # La latencia y los errores por ruta ya están en /metrics
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    if app is None:
+        app = server.create_app()
+    server.calentar()
+    en_curso = PeticionesEnCurso(app)
+    servidor = make_server(args.host, args.port, en_curso, threaded=True, fd=sock.fileno())
+    # Todos los workers esperan en el mismo socket: el que pierde la carrera del accept no se bloquea
+    servidor.socket.setblocking(False)
+    hilo = threading.Thread(target=servidor.serve_forever, name="http", daemon=True)
+    hilo.start()
+    os.write(aviso, f"{indice} {os.getpid()} {time.perf_counter() - inicio:.3f}\n".encode("ascii"))
+
+    while not parar.wait(1.0):
+        pass
+    servidor.shutdown()
+    server.difusor_cambios.cerrar_suscripciones()
+    if not en_curso.esperar(args.drenaje):
+        print(f"Worker {indice}: {en_curso.en_curso} peticiones sin terminar tras {args.drenaje} s")
+    server.apagar()
+
+# =======================================================
+# MAESTRO
+# =======================================================
+
+def abrir_socket(host, puerto, backlog=LANZADOR_BACKLOG):
+    """Socket de escucha que heredan todos los workers."""
+    familia = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.create_server((host, puerto), family=familia, backlog=backlog)
+    sock.setblocking(False)
+    return sock
+
+
+class Lanzador:
+    """Hace fork de los workers, informa cuándo están listos, reemplaza los caídos y los detiene."""
+
+    def __init__(self, sock, args, app=None):
+        self.sock = sock
+        self.args = args
+        self.app = app
+        self._lectura, self._aviso = os.pipe()
+        self._workers = {}       # pid -> índice
+        self._lanzados = {}      # índice -> instante del último fork
+        self._terminando = False
+
+    def _lanzar(self, indice):
+        # Sin esto, lo que quede en el buffer de stdout se imprimiría también desde el hijo
+        sys.stdout.flush()
+        self._lanzados[indice] = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            codigo = 0
+            try:
+                os.close(self._lectura)
+                _worker(indice, self.sock, self._aviso, self.args, self.app)
+            except BaseException as e:
+                print(f"ERROR en el worker {indice}: {e}")
+                codigo = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(codigo)
+        self._workers[pid] = indice
+
+    def _pedir_fin(self, *_):
+        self._terminando = True
+
+    def _leer_avisos(self):
+        legibles, _, _ = select.select([self._lectura], [], [], 1.0)
+        if not legibles:
+            return
+        for linea in os.read(self._lectura, 4096).decode("ascii").splitlines():
+            indice, pid, calentamiento = linea.split()
+            total = time.monotonic() - self._lanzados[int(indice)]
+            print(f"Worker {indice} (pid {pid}) listo en {total:.3f} s (arranque propio {float(calentamiento):.3f} s)")
+
+    def _reemplazar_caidos(self):
+        while True:
+            try:
+                pid, estado = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            indice = self._workers.pop(pid, None)
+            if indice is None or self._terminando:
+                continue
+            print(f"Worker {indice} (pid {pid}) terminó con código {os.waitstatus_to_exitcode(estado)}; se reemplaza")
+            espera = LANZADOR_REINICIO_MIN - (time.monotonic() - self._lanzados[indice])
+            if espera > 0:
+                time.sleep(espera)
+            self._lanzar(indice)
+
+    def _detener_workers(self):
+        for pid in self._workers:
+            os.kill(pid, signal.SIGTERM)
+        limite = time.monotonic() + self.args.drenaje + LANZADOR_APAGADO
+        while self._workers and time.monotonic() < limite:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+            else:
+                self._workers.pop(pid, None)
+        for pid in self._workers:
+            print(f"Worker (pid {pid}) no terminó a tiempo; se fuerza su cierre")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._workers = {}
+
+    def ejecutar(self):
+        signal.signal(signal.SIGTERM, self._pedir_fin)
+        signal.signal(signal.SIGINT, self._pedir_fin)
+        for indice in range(self.args.workers):
+            self._lanzar(indice)
+        while not self._terminando:
+            self._leer_avisos()
+            self._reemplazar_caidos()
+        print("Deteniendo workers (drenando peticiones en curso)...")
+        self._detener_workers()
+        self.sock.close()
+        return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Servidor de producción: N workers preforkeados de server.py.")
+    ap.add_argument("--workers", type=int, default=LANZADOR_WORKERS)
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=5000)
+    ap.add_argument("--drenaje", type=float, default=LANZADOR_DRENAJE,
+                    help="Segundos máximos para terminar las peticiones en curso al apagar")
+    ap.add_argument("--sin-precarga", action="store_true",
+                    help="Cada worker importa server.py tras el fork (más memoria, aísla los imports)")
+    args = ap.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        print("lanzador.py requiere fork (Linux o macOS); en Windows use python server.py")
+        return 1
+
+    sock = abrir_socket(args.host, args.port)
+    app = None
+    if not args.sin_precarga:
+        import server
+        app = server.create_app()
+    print(f"Servidor en http://{args.host}:{args.port}/ con {args.workers} workers (pid maestro {os.getpid()})")
+    return Lanzador(sock, args, app).ejecutar()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# Liquidación asíncrona de pagos con pasarela ("online" y "tarjeta guardada").
+#
+# Pago.procesar_pago solo inserta el pago como PENDIENTE y lo encola aquí: la
+# petición termina con una escritura. LiquidadorPagos agrupa los pendientes
+# en lotes, los envía a la pasarela y aplica los estados (APROBADO /
+# RECHAZADO) con un solo UPDATE por lote, que además mueve el monto de
+# pendiente a aprobado en reporte_diario. Los triggers de cambios.py avisan
+# del nuevo estado por /api/history/changes y el stream SSE; también se puede
+# consultar con GET /api/payment/<id>.
+#
+# La conciliación recorre cada LIQUIDACION_RECONCILIACION s los pendientes más
+# viejos que LIQUIDACION_VENCIDO (encolados en un proceso que murió, sin
+# respuesta de la pasarela, cola desbordada) y los vuelve a liquidar. Los
+# reclama en liquidacion_reclamos en la misma sentencia que los lee, así que
+# otro worker no los reenvía mientras este espera a la pasarela. El reclamo
+# va en su propia tabla: pagos no se toca y los triggers de cambios.py no
+# publican un cambio falso por cada barrido.
+#
+#   python liquidacion.py --reconciliar     (p. ej. desde cron)
+import argparse
+import queue
+import random
+import threading
+import time
+
+from reportes import con_delta_liquidacion
+from sentencias import declarar_sentencia
+
+# --- Configuración de la Liquidación ---
+METODOS_PASARELA = ("online", "tarjeta guardada")
+LIQUIDACION_LOTE = 100               # Pagos por llamada a la pasarela
+LIQUIDACION_VENTANA = 0.05           # Segundos que se espera para llenar un lote
+LIQUIDACION_COLA_MAX = 10000         # Pendientes en memoria; el resto lo recoge la conciliación
+LIQUIDACION_RECONCILIACION = 30.0    # Segundos entre barridos de pendientes vencidos
+LIQUIDACION_VENCIDO = 120            # Antigüedad (s) a partir de la cual un pendiente se reintenta
+LIQUIDACION_RECONCILIACION_MAX = 1000
+
+_METODOS_SQL = ", ".join(f"'{metodo}'" for metodo in METODOS_PASARELA)
+
+ESQUEMA_LIQUIDACION = f"""
+    ALTER TABLE pagos ADD COLUMN IF NOT EXISTS creado TIMESTAMPTZ NOT NULL DEFAULT now();
+    CREATE INDEX IF NOT EXISTS pagos_pendientes_pasarela ON pagos (creado)
+        WHERE status = 'PENDIENTE' AND payment_method IN ({_METODOS_SQL});
+"""
+
+ESQUEMA_RECLAMOS = """
+    CREATE TABLE IF NOT EXISTS liquidacion_reclamos (
+        pago_id VARCHAR(50) PRIMARY KEY REFERENCES pagos(id) ON DELETE CASCADE,
+        reclamado TIMESTAMPTZ NOT NULL
+    );
+"""
+
+# Solo cambia pagos aún PENDIENTE: liquidar dos veces el mismo pago no duplica el delta
+LIQUIDAR = declarar_sentencia("payment_settle", con_delta_liquidacion("""
+            UPDATE pagos p SET status = v.status
+            FROM unnest(%s::text[], %s::text[]) AS v(id, status)
+            WHERE p.id = v.id AND p.status = 'PENDIENTE'
+        """), ["text[]", "text[]"])
+# Reclama los pendientes vencidos sin reclamo vigente; el reclamo vence a los
+# LIQUIDACION_VENCIDO s (si este proceso muere antes de liquidarlos). SKIP
+# LOCKED reparte las filas entre barridos simultáneos y el WHERE del ON
+# CONFLICT, que ve el último reclamo confirmado, impide reclamar dos veces.
+PENDIENTES_VENCIDOS = declarar_sentencia("payment_stale", f"""
+            WITH candidatos AS (
+                SELECT p.id, p.reservation_id, p.amount, p.payment_method
+                FROM pagos p
+                LEFT JOIN liquidacion_reclamos c ON c.pago_id = p.id
+                WHERE p.status = 'PENDIENTE' AND p.payment_method IN ({_METODOS_SQL})
+                  AND p.creado < now() - %s * INTERVAL '1 second'
+                  AND (c.reclamado IS NULL OR c.reclamado < now() - %s * INTERVAL '1 second')
+                ORDER BY p.creado
+                LIMIT %s
+                FOR UPDATE OF p SKIP LOCKED
+            ), reclamados AS (
+                INSERT INTO liquidacion_reclamos (pago_id, reclamado)
+                SELECT id, now() FROM candidatos
+                ON CONFLICT (pago_id) DO UPDATE SET reclamado = EXCLUDED.reclamado
+                    WHERE liquidacion_reclamos.reclamado < now() - %s * INTERVAL '1 second'
+                RETURNING pago_id
+            )
+            SELECT c.id, c.reservation_id, c.amount, c.payment_method
+            FROM candidatos c
+            JOIN reclamados r ON r.pago_id = c.id
+        """, ["integer", "integer", "integer", "integer"])
+
+# =======================================================
+# PASARELAS
+# =======================================================
+
+class PasarelaSimulada:
+    """
+    Pasarela local: aprueba todo tras `latencia` segundos por lote (o rechaza
+    una fracción `tasa_rechazo`). Una pasarela real implementa el mismo
+    cobrar_lote y debe usar el id del pago como clave de idempotencia, porque
+    la conciliación puede reenviar un pago cuya respuesta se perdió.
+    """
+
+    def __init__(self, latencia=0.05, tasa_rechazo=0.0, semilla=None):
+        self.latencia = latencia
+        self.tasa_rechazo = tasa_rechazo
+        self._rnd = random.Random(semilla)
+
+    def cobrar_lote(self, pagos):
+        """Retorna un estado por pago: "APROBADO", "RECHAZADO" o None (sin respuesta, se reintenta)."""
+        time.sleep(self.latencia)
+        return ["RECHAZADO" if self._rnd.random() < self.tasa_rechazo else "APROBADO" for _ in pagos]
+
+# =======================================================
+# LIQUIDADOR
+# =======================================================
+
+class LiquidadorPagos:
+    """
+    Hilo en segundo plano que liquida los pagos encolados por lotes y
+    concilia periódicamente. Se arranca con el primer pago encolado.
+    """
+
+    def __init__(self, pasarela=None, db_transaction=None, lote=LIQUIDACION_LOTE, ventana=LIQUIDACION_VENTANA,
+                 reconciliacion=LIQUIDACION_RECONCILIACION, vencido=LIQUIDACION_VENCIDO):
+        self.pasarela = pasarela or PasarelaSimulada()
+        # None = transaccion de configuracion_db (se importa al arrancar)
+        self.transaccion = db_transaction
+        self.lote = lote
+        self.ventana = ventana
+        self.reconciliacion = reconciliacion
+        self.vencido = vencido
+        self._cola = queue.Queue(maxsize=LIQUIDACION_COLA_MAX)
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+        self.contadores = {
+            "encolados": 0, "desbordados": 0, "lotes": 0, "aprobados": 0, "rechazados": 0,
+            "sin_respuesta": 0, "errores": 0, "conciliados": 0, "ultimo_lote_ms": 0.0,
+        }
+
+    def encolar(self, pago_id, reserva_id, monto, metodo):
+        try:
+            self._cola.put_nowait({"id": pago_id, "reserva_id": reserva_id, "monto": monto, "metodo": metodo})
+            self.contadores["encolados"] += 1
+        except queue.Full:
+            self.contadores["desbordados"] += 1
+        if self._hilo is None:
+            self.iniciar()
+
+    def iniciar(self):
+        """Arranca el hilo de liquidación (idempotente)."""
+        with self._lock:
+            if self._hilo is not None:
+                return
+            if self.transaccion is None:
+                from configuracion_db import transaccion
+                self.transaccion = transaccion
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="pagos-liquidacion", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(self.reconciliacion)
+            self._hilo = None
+
+    def _tomar_lote(self):
+        """Espera el primer pago y junta los que lleguen en `ventana` s, hasta `lote`."""
+        try:
+            lote = [self._cola.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        limite = time.monotonic() + self.ventana
+        while len(lote) < self.lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        proxima_conciliacion = time.monotonic() + self.reconciliacion
+        while not self._detener.is_set():
+            lote = self._tomar_lote()
+            if lote:
+                self.liquidar(lote)
+            if time.monotonic() >= proxima_conciliacion:
+                self.conciliar()
+                proxima_conciliacion = time.monotonic() + self.reconciliacion
+        # Al detener se liquida lo que quedó en la cola; lo que falle lo recoge la conciliación
+        while not self._cola.empty():
+            lote = self._tomar_lote()
+            if lote:
+                self.liquidar(lote)
+
+    def liquidar(self, pagos):
+        """Cobra `pagos` en la pasarela y aplica los estados en un solo UPDATE. Retorna los liquidados."""
+        inicio = time.perf_counter()
+        try:
+            estados = self.pasarela.cobrar_lote(pagos)
+        except Exception as e:
+            print(f"ERROR DE LA PASARELA DE PAGOS: {e}")
+            estados = [None] * len(pagos)
+
+        ids, resueltos = [], []
+        for pago, estado in zip(pagos, estados):
+            if estado in ("APROBADO", "RECHAZADO"):
+                ids.append(pago["id"])
+                resueltos.append(estado)
+        self.contadores["sin_respuesta"] += len(pagos) - len(ids)
+        self.contadores["lotes"] += 1
+        if not ids:
+            return 0
+
+        with self.transaccion() as uow:
+            uow(LIQUIDAR, (ids, resueltos))
+        if not uow.exitosa:
+            # Quedan PENDIENTE y la conciliación los reintenta
+            self.contadores["errores"] += 1
+            return 0
+        self.contadores["aprobados"] += resueltos.count("APROBADO")
+        self.contadores["rechazados"] += resueltos.count("RECHAZADO")
+        self.contadores["ultimo_lote_ms"] = round((time.perf_counter() - inicio) * 1000.0, 1)
+        return len(ids)
+
+    def conciliar(self):
+        """Reclama los pendientes vencidos y los reenvía a la pasarela. Retorna cuántos se liquidaron."""
+        with self.transaccion() as uow:
+            filas = uow(PENDIENTES_VENCIDOS, (self.vencido, self.vencido, LIQUIDACION_RECONCILIACION_MAX, self.vencido),
+                        fetch_all=True)
+        if not uow.exitosa or not filas:
+            return 0
+
+        pagos = [{"id": f[0], "reserva_id": f[1], "monto": float(f[2]), "metodo": f[3]} for f in filas]
+        liquidados = 0
+        for i in range(0, len(pagos), self.lote):
+            liquidados += self.liquidar(pagos[i:i + self.lote])
+        self.contadores["conciliados"] += liquidados
+        return liquidados
+
+    def estadisticas(self):
+        stats = dict(self.contadores)
+        stats["profundidad"] = self._cola.qsize()
+        return stats
+
+
+# Instancia global del proceso
+liquidador_pagos = LiquidadorPagos()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Liquidación de pagos pendientes con la pasarela.")
+    ap.add_argument("--reconciliar", action="store_true", help="Liquida los pendientes vencidos y termina")
+    ap.add_argument("--vencido", type=int, default=LIQUIDACION_VENCIDO, help="Antigüedad mínima (s) del pendiente")
+    args = ap.parse_args(argv)
+
+    if not args.reconciliar:
+        ap.print_help()
+        return 0
+    from configuracion_db import transaccion
+
+    liquidador = LiquidadorPagos(db_transaction=transaccion, vencido=args.vencido)
+    total = 0
+    while True:
+        liquidados = liquidador.conciliar()
+        total += liquidados
+        if liquidados < LIQUIDACION_RECONCILIACION_MAX:
+            break
+    print(f"Pagos conciliados: {total} ({liquidador.estadisticas()})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
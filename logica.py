@@ -1,19 +1,26 @@
+import base64
+import math
 import re
 import uuid
 from datetime import datetime
 from dateutil import parser # NOTA: Asegúrate de tener 'pip install python-dateutil'
 
-# --- FUNCIÓN: SIMULACIÓN DE ENVÍO DE EMAIL ---
+from cache_catalogo import cache_catalogo
+from busqueda_catalogo import indice_catalogo, ORDENES, BUSQUEDA_LIMITE_DEFAULT, BUSQUEDA_LIMITE_MAX
+from notificaciones import cola_notificaciones
+from disponibilidad import indice_ocupacion, ocupa_cupo
+from reportes import con_delta_reserva, con_delta_pago
+import cambios
+from liquidacion import liquidador_pagos, METODOS_PASARELA
+from sentencias import declarar_sentencia
+
+# --- FUNCIÓN: ENVÍO DE EMAIL (ASÍNCRONO) ---
 def send_email_notification(to_email, subject, body):
     """
-    Simula el envío de un correo electrónico. 
+    Encola el correo en el outbox; el envío real lo hacen los workers
+    de notificaciones.py, así la petición no espera al backend de correo.
     """
-    print(f"\n--- SIMULACIÓN DE EMAIL ENVIADO ---")
-    print(f"Para: {to_email}")
-    print(f"Asunto: {subject}")
-    print(f"Cuerpo: {body}")
-    print(f"-----------------------------------\n")
-    return True
+    return cola_notificaciones.encolar(to_email, subject, body)
 
 # =======================================================
 # CLASES DE GESTIÓN 
@@ -22,6 +29,12 @@ def send_email_notification(to_email, subject, body):
 class Login:
     """Clase para manejar la autenticación de usuarios."""
 
+    QUERY_LOGIN = declarar_sentencia("login_lookup", """
+            SELECT id, name, password, role, email, firstName, lastName, identificationId 
+            FROM usuarios 
+            WHERE email = %s
+        """, ["text"])
+
     def __init__(self, correo, contrasena, db_executor):
         self.correo = correo
         self.contrasena = contrasena
@@ -35,13 +48,11 @@ class Login:
         if not self.validar_correo():
             return {"success": False, "message": "Correo inválido."}
 
-        query = """
-            SELECT id, name, password, role, email, firstName, lastName, identificationId 
-            FROM usuarios 
-            WHERE email = %s
-        """
-        user_data = self.execute_query(query, (self.correo,), fetch_data=True)
+        user_data = self.execute_query(self.QUERY_LOGIN, (self.correo,), fetch_data=True)
+        return self._resultado(user_data)
 
+    def _resultado(self, user_data):
+        """Compara la contraseña con la fila de usuarios y arma la respuesta."""
         if user_data is None:
             return {"success": False, "message": "El correo no está registrado."}
 
@@ -55,6 +66,7 @@ class Login:
                 "success": True,
                 "username": db_name,
                 "userId": db_id,
+                "role": db_role,
                 "isAdmin": is_admin,
                 "isProvider": is_provider,
                 "email": db_email,
@@ -70,6 +82,12 @@ class Login:
 class Usuario:
     """Clase para manejar el registro de nuevos usuarios."""
 
+    QUERY_EXISTE = declarar_sentencia("usuario_existe", "SELECT id FROM usuarios WHERE email = %s", ["text"])
+    INSERT_USUARIO = """
+            INSERT INTO usuarios (id, email, password, name, role, firstName, lastName, identificationId, status)
+            VALUES (%s, %s, %s, %s, 'Cliente', %s, %s, %s, 'Activo')
+        """
+
     def __init__(self, data, db_executor):
         self.data = data
         self.execute_query = db_executor
@@ -84,8 +102,7 @@ class Usuario:
         return re.match(patron, self.correo) is not None
 
     def existe_en_bd(self):
-        query = "SELECT id FROM usuarios WHERE email = %s"
-        return self.execute_query(query, (self.correo,), fetch_data=True) is not None
+        return self.execute_query(self.QUERY_EXISTE, (self.correo,), fetch_data=True) is not None
 
     def registrar(self):
         if not self.validar_correo():
@@ -94,21 +111,27 @@ class Usuario:
         if self.existe_en_bd():
             return {"success": False, "message": "Este correo ya está registrado."}
 
-        if not self.contrasena or len(self.contrasena) < 6:
+        if not self._validar_contrasena():
             return {"success": False, "message": "La contraseña es demasiado corta."}
 
+        user_id, name, params = self._datos_insert()
+
+        if self.execute_query(self.INSERT_USUARIO, params) is None:
+             return {"success": False, "message": "Error CRÍTICO al guardar el usuario en la base de datos."}
+
+        return self._confirmar_registro(user_id, name)
+
+    def _datos_insert(self):
         user_id = str(uuid.uuid4())[:50] 
         name = f"{self.firstName} {self.lastName}"
-
-        query = """
-            INSERT INTO usuarios (id, email, password, name, role, firstName, lastName, identificationId, status)
-            VALUES (%s, %s, %s, %s, 'Cliente', %s, %s, %s, 'Activo')
-        """
         params = (user_id, self.correo, self.contrasena, name, self.firstName, self.lastName, self.identificationId)
+        return user_id, name, params
 
-        if self.execute_query(query, params) is None:
-             return {"success": False, "message": "Error CRÍTICO al guardar el usuario en la base de datos."}
+    def _validar_contrasena(self):
+        return bool(self.contrasena) and len(self.contrasena) >= 6
 
+    def _confirmar_registro(self, user_id, name):
+        """Correo de bienvenida y respuesta tras guardar el usuario."""
         send_email_notification(
             to_email=self.correo,
             subject="Bienvenido a AgendaPro",
@@ -128,22 +151,42 @@ class Usuario:
 class Servicio:
     """Clase para manejar el CRUD de servicios y consultas al catálogo."""
 
+    REQUIRED_FIELDS = ['providerId', 'expertName', 'name', 'price', 'duration', 'capacity', 'modality', 'desc']
+
+    QUERY_CATALOGO = declarar_sentencia("catalog_scan", """
+             SELECT id, provider_id, expert_name, name, price, duration, capacity, modality, description, image_url, category
+             FROM servicios
+             ORDER BY name ASC
+        """)
+    # Con tipos declarados: asyncpg no deduce bien los parámetros sin ellos
+    INSERT_SERVICIO = declarar_sentencia("servicio_insert", """
+            INSERT INTO servicios (id, provider_id, expert_name, name, price, duration, capacity, modality, description, image_url, category)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, ["text", "text", "text", "text", "numeric", "integer", "integer", "text", "text", "text", "text"])
+
     def __init__(self, data, db_executor):
         self.data = data if data is not None else {}
         self.execute_query = db_executor
         self.service_id = self.data.get('id')
 
     def obtener_todos(self):
-        """Consulta todos los servicios disponibles."""
-        query = """
-             SELECT id, provider_id, expert_name, name, price, duration, capacity, modality, description, image_url, category
-             FROM servicios
-             ORDER BY name ASC
-        """
-        resultados = self.execute_query(query, fetch_all=True)
+        """Consulta todos los servicios disponibles (servido desde el cache del catálogo)."""
+        datos, _, _ = cache_catalogo.obtener(self._cargar_catalogo)
+        return {"success": True, "data": datos}
+
+    def obtener_catalogo_serializado(self):
+        """Retorna (cuerpo_json, etag) del catálogo, listo para enviarse al cliente."""
+        _, cuerpo, etag = cache_catalogo.obtener(self._cargar_catalogo)
+        return cuerpo, etag
+
+    def _cargar_catalogo(self):
+        """Lee el catálogo completo desde la BD."""
+        return self._filas_a_catalogo(self.execute_query(self.QUERY_CATALOGO, fetch_all=True))
 
+    @staticmethod
+    def _filas_a_catalogo(resultados):
         if resultados is None:
-             return {"success": True, "data": []}
+             return None
              
         servicios_list = []
         for fila in resultados:
@@ -162,154 +205,509 @@ class Servicio:
             }
             servicios_list.append(servicio)
 
-        return {"success": True, "data": servicios_list}
+        return servicios_list
 
 
-    def crear(self):
-        """Crea un nuevo servicio en la base de datos."""
-        
-        required_fields = ['providerId', 'expertName', 'name', 'price', 'duration', 'capacity', 'modality', 'desc']
-        if not all(self.data.get(field) for field in required_fields):
+    @staticmethod
+    def normalizar_numeros(data):
+        """
+        Copia de `data` con price (float), duration y capacity (int). El JSON
+        puede traerlos como cadenas: psycopg2 las deja convertir a PostgreSQL,
+        asyncpg no. Lanza ValueError si alguno no es un número.
+        """
+        datos = dict(data)
+        try:
+            datos['price'] = float(data['price'])
+            datos['duration'] = int(data['duration'])
+            datos['capacity'] = int(data['capacity'])
+        except (TypeError, ValueError):
+            raise ValueError("price, duration y capacity deben ser numéricos.")
+        if not math.isfinite(datos['price']):
+            raise ValueError("price, duration y capacity deben ser numéricos.")
+        return datos
+
+    @staticmethod
+    def valores_insert(data, service_id):
+        """Tupla de valores para INSERT INTO servicios (en el orden de sus columnas)."""
+        return (
+            service_id, 
+            data['providerId'], 
+            data['expertName'], 
+            data['name'], 
+            data['price'], 
+            data['duration'], 
+            data['capacity'], 
+            data['modality'], 
+            data['desc'], 
+            data.get('image', 'https://placehold.co/100x100/9400D3/ffffff?text=Service'), 
+            data.get('category', 'Sin Categoría')
+        )
+
+    def _validar(self):
+        """Valida los campos y normaliza los numéricos; retorna el error o None."""
+        if not all(self.data.get(field) for field in self.REQUIRED_FIELDS):
             return {"success": False, "message": "Faltan campos obligatorios para el servicio."}
+        try:
+            self.data = self.normalizar_numeros(self.data)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}
+        return None
 
+    def _datos_insert(self):
         new_service_id = str(uuid.uuid4())[:50]
+        return new_service_id, self.valores_insert(self.data, new_service_id)
+
+    def crear(self):
+        """Crea un nuevo servicio en la base de datos."""
         
-        query = """
-            INSERT INTO servicios (id, provider_id, expert_name, name, price, duration, capacity, modality, description, image_url, category)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        params = (
-            new_service_id, 
-            self.data['providerId'], 
-            self.data['expertName'], 
-            self.data['name'], 
-            self.data['price'], 
-            self.data['duration'], 
-            self.data['capacity'], 
-            self.data['modality'], 
-            self.data['desc'], 
-            self.data.get('image', 'https://placehold.co/100x100/9400D3/ffffff?text=Service'), 
-            self.data.get('category', 'Sin Categoría')
-        )
+        error = self._validar()
+        if error is not None:
+            return error
 
-        if self.execute_query(query, params) is None:
+        new_service_id, params = self._datos_insert()
+
+        if self.execute_query(self.INSERT_SERVICIO, params) is None:
              return {"success": False, "message": "Error CRÍTICO al crear el servicio en la BD."}
 
+        self.confirmar_creacion(params)
+
         return {"success": True, "message": "Servicio creado correctamente.", "id": new_service_id}
 
+    def confirmar_creacion(self, params):
+        """Invalida el cache del catálogo y agrega el servicio al índice de búsqueda."""
+        version = cache_catalogo.invalidar()
+        indice_catalogo.agregar(self._filas_a_catalogo([params])[0], version)
+
+    def buscar(self, params):
+        """
+        Búsqueda en el índice en memoria del catálogo (sin consultar PostgreSQL
+        mientras el índice esté vigente). Acepta q, category, modality,
+        min_price, max_price, min_duration, max_duration, sort (name, price,
+        duration; con '-' para descendente), page y limit.
+        """
+        error, filtros = self._filtros_busqueda(params)
+        if error is not None:
+            return error
+
+        if not indice_catalogo.vigente():
+            version = cache_catalogo.version
+            datos, _, etag = cache_catalogo.obtener(self._cargar_catalogo)
+            if etag is None:
+                return {"success": False, "message": "Error CRÍTICO al cargar el catálogo."}
+            indice_catalogo.reemplazar(datos, version)
+
+        return self._resultado_busqueda(filtros)
+
+    @staticmethod
+    def _filtros_busqueda(params):
+        """Retorna (error, filtros) a partir de los parámetros de la URL."""
+        params = params or {}
+        orden = params.get('sort') or 'name'
+        descendente = orden.startswith('-')
+        orden = orden.lstrip('-')
+        if orden not in ORDENES:
+            return {"success": False, "message": f"Orden inválido (use {', '.join(ORDENES)})."}, None
+
+        try:
+            numeros = {
+                clave: (float(params[nombre]) if params.get(nombre) not in (None, '') else None)
+                for clave, nombre in (('precio_min', 'min_price'), ('precio_max', 'max_price'),
+                                      ('duracion_min', 'min_duration'), ('duracion_max', 'max_duration'))
+            }
+            pagina = int(params.get('page') or 1)
+            limite = int(params.get('limit') or BUSQUEDA_LIMITE_DEFAULT)
+        except (TypeError, ValueError):
+            return {"success": False, "message": "Los filtros numéricos, page y limit deben ser números."}, None
+
+        if pagina < 1 or limite < 1:
+            return {"success": False, "message": "page y limit deben ser mayores que cero."}, None
+
+        filtros = dict(numeros,
+                       texto=params.get('q'),
+                       categoria=params.get('category'),
+                       modalidad=params.get('modality'),
+                       orden=orden,
+                       descendente=descendente,
+                       pagina=pagina,
+                       limite=min(limite, BUSQUEDA_LIMITE_MAX))
+        return None, filtros
+
+    @staticmethod
+    def _resultado_busqueda(filtros):
+        total, servicios = indice_catalogo.buscar(**filtros)
+        return {
+            "success": True,
+            "data": servicios,
+            "total": total,
+            "page": filtros['pagina'],
+            "limit": filtros['limite'],
+        }
+
 
 class HistorialReservas:
     """Clase para obtener historial completo de reservas (incluyendo canceladas)."""
 
-    def __init__(self, data, db_executor):
+    SELECT_BASE = """
+         SELECT 
+            r.id, s.name, r.slot_time, r.status, 
+            p.amount, p.payment_method, p.status AS payment_status, 
+            u.name AS username, u.id AS user_id
+         FROM reservas r
+         JOIN servicios s ON r.service_id = s.id
+         JOIN usuarios u ON r.usuario_id = u.id 
+         LEFT JOIN pagos p ON r.id = p.reservation_id
+    """
+    PAGE_SIZE_DEFAULT = 50
+    PAGE_SIZE_MAX = 500
+
+    def __init__(self, data, db_executor, db_streamer=None):
         self.usuario_id = data.get('usuario_id')
         self.is_manager = data.get('is_manager', False)
         self.execute_query = db_executor
+        self.stream_query = db_streamer
+
+    def _consulta(self, cursor=None, limite=None):
+        """
+        Construye la consulta según el rol, el cursor (slot_time, id) de keyset
+        y el límite. Cada variante se declara como sentencia con nombre.
+        """
+        condiciones = []
+        params = []
+        tipos = []
+        # El administrador/proveedor ve TODAS las citas; el cliente SOLO las suyas
+        if not self.is_manager:
+            condiciones.append("r.usuario_id = %s")
+            params.append(self.usuario_id)
+            tipos.append("text")
+        if cursor is not None:
+            condiciones.append("(r.slot_time, r.id) < (%s, %s)")
+            params.extend(cursor)
+            tipos.extend(["timestamp", "text"])
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        query = f"{self.SELECT_BASE} {where} ORDER BY r.slot_time DESC, r.id DESC"
+        if limite is not None:
+            query += " LIMIT %s"
+            params.append(limite)
+            tipos.append("integer")
+
+        nombre = "history_" + ("manager" if self.is_manager else "cliente")
+        nombre += ("_cursor" if cursor is not None else "") + ("_page" if limite is not None else "")
+        return declarar_sentencia(nombre, query, tipos), tuple(params) or None
+
+    @staticmethod
+    def _fila_a_dict(fila):
+        slot_time_dt = fila[2]
+        slot_time_str = slot_time_dt.strftime("%Y-%m-%d %H:%M:%S") if isinstance(slot_time_dt, datetime) else str(fila[2])
+
+        return {
+            "id_reserva": fila[0],
+            "tipo_consulta": fila[1],
+            "slot_time": slot_time_str,
+            "estado_reserva": fila[3],
+            "monto_pago": float(fila[4]) if fila[4] else None,
+            "metodo_pago": fila[5],
+            "estado_pago": fila[6],
+            "username": fila[7],
+            "user_id": fila[8],
+        }
+
+    @staticmethod
+    def codificar_cursor(slot_time, reserva_id):
+        valor = slot_time.isoformat() if isinstance(slot_time, datetime) else str(slot_time)
+        crudo = f"{valor}|{reserva_id}".encode("utf-8")
+        return base64.urlsafe_b64encode(crudo).decode("ascii")
+
+    @staticmethod
+    def decodificar_cursor(cursor):
+        """Retorna (slot_time, id) o lanza ValueError si el cursor no es válido."""
+        try:
+            crudo = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+            slot_time_str, reserva_id = crudo.split("|", 1)
+            return parser.parse(slot_time_str), reserva_id
+        except Exception as e:
+            raise ValueError(f"Cursor inválido: {e}")
 
     def obtener_historial(self):
-        # El administrador/proveedor ve TODAS las citas
-        if self.is_manager:
-            query = """
-                 SELECT 
-                    r.id, s.name, r.slot_time, r.status, 
-                    p.amount, p.payment_method, p.status AS payment_status, 
-                    u.name AS username, u.id AS user_id
-                 FROM reservas r
-                 JOIN servicios s ON r.service_id = s.id
-                 JOIN usuarios u ON r.usuario_id = u.id 
-                 LEFT JOIN pagos p ON r.id = p.reservation_id
-                 ORDER BY r.slot_time DESC
-            """
-            params = None
-        else:
-            # Cliente ve SOLO sus citas
-            query = """
-                 SELECT 
-                    r.id, s.name, r.slot_time, r.status, 
-                    p.amount, p.payment_method, p.status AS payment_status,
-                    u.name AS username, u.id AS user_id
-                 FROM reservas r
-                 JOIN servicios s ON r.service_id = s.id
-                 JOIN usuarios u ON r.usuario_id = u.id
-                 LEFT JOIN pagos p ON r.id = p.reservation_id
-                 WHERE r.usuario_id = %s
-                 ORDER BY r.slot_time DESC
-            """
-            params = (self.usuario_id,)
+        query, params = self._consulta()
 
         resultados = self.execute_query(query, params, fetch_all=True)
 
         if resultados is None:
              return {"success": True, "data": []}
              
-        historial = []
-        for fila in resultados:
-            slot_time_dt = fila[2]
-            slot_time_str = slot_time_dt.strftime("%Y-%m-%d %H:%M:%S") if isinstance(slot_time_dt, datetime) else str(fila[2])
-            
-            reserva = {
-                "id_reserva": fila[0],
-                "tipo_consulta": fila[1],
-                "slot_time": slot_time_str,
-                "estado_reserva": fila[3],
-                "monto_pago": float(fila[4]) if fila[4] else None,
-                "metodo_pago": fila[5],
-                "estado_pago": fila[6],
-                "username": fila[7],
-                "user_id": fila[8],
-            }
-            historial.append(reserva)
+        historial = [self._fila_a_dict(fila) for fila in resultados]
 
         return {"success": True, "data": historial}
 
+    def obtener_pagina(self, limite=None, cursor=None):
+        """Paginación por keyset sobre (slot_time, id): coste constante por página."""
+        error, limite, posicion = self._parametros_pagina(limite, cursor)
+        if error is not None:
+            return error
+
+        # Se pide una fila extra para saber si existe una página siguiente
+        query, params = self._consulta(posicion, limite + 1)
+
+        resultados = self.execute_query(query, params, fetch_all=True)
+        return self._armar_pagina(resultados, limite)
+
+    def _parametros_pagina(self, limite, cursor):
+        """Retorna (error, limite, posicion) validando tamaño de página y cursor."""
+        try:
+            limite = int(limite) if limite else self.PAGE_SIZE_DEFAULT
+        except (TypeError, ValueError):
+            return {"success": False, "message": "Tamaño de página inválido."}, None, None
+        limite = max(1, min(limite, self.PAGE_SIZE_MAX))
+
+        try:
+            posicion = self.decodificar_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, None, None
+        return None, limite, posicion
+
+    def _armar_pagina(self, resultados, limite):
+        if resultados is None:
+             return {"success": True, "data": [], "page_size": limite, "next_cursor": None}
+
+        filas = resultados[:limite]
+        next_cursor = None
+        if len(resultados) > limite:
+            ultima = filas[-1]
+            next_cursor = self.codificar_cursor(ultima[2], ultima[0])
+
+        return {
+            "success": True,
+            "data": [self._fila_a_dict(fila) for fila in filas],
+            "page_size": limite,
+            "next_cursor": next_cursor,
+        }
+
+    def iterar_historial(self):
+        """
+        Iterador de las reservas una a una, leídas con un cursor del lado del
+        servidor, de modo que la memoria no crece con el tamaño del historial.
+        La consulta se abre al llamar (sus errores se lanzan aquí, no al iterar).
+        """
+        if self.stream_query is None:
+            raise RuntimeError("HistorialReservas requiere db_streamer para el modo streaming.")
+
+        query, params = self._consulta()
+        filas = self.stream_query(query, params)
+        return (self._fila_a_dict(fila) for fila in filas)
+
+    # --- Sincronización incremental (ver cambios.py) ---
+
+    def _consulta_cambios(self, posicion, limite):
+        """
+        Reservas cuya fila o cuyo pago cambió después de la posición de página
+        de `posicion` (seguro, ultimo_tx, ultimo_id), más el xmin del snapshot
+        en la misma sentencia. Siempre retorna al menos una fila (con el resto
+        de columnas en NULL si no hay cambios).
+        """
+        _, ultimo_tx, ultimo_id = posicion
+        condiciones = ["(GREATEST(r.cambio_tx, COALESCE(p.cambio_tx, 0)), r.id) > (%s, %s)"]
+        params = [ultimo_tx, ultimo_tx, ultimo_tx, ultimo_id]
+        tipos = ["bigint", "bigint", "bigint", "text"]
+        if not self.is_manager:
+            condiciones.append("r.usuario_id = %s")
+            params.append(self.usuario_id)
+            tipos.append("text")
+        params.append(limite)
+        tipos.append("integer")
+
+        query = f"""
+            SELECT m.xmin, x.*
+            FROM (SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin) m
+            LEFT JOIN LATERAL (
+                SELECT
+                    r.id, s.name, r.slot_time, r.status,
+                    p.amount, p.payment_method, p.status AS payment_status,
+                    u.name AS username, u.id AS user_id,
+                    GREATEST(r.cambio_tx, COALESCE(p.cambio_tx, 0)) AS cambio_tx
+                FROM (
+                    SELECT id FROM reservas WHERE cambio_tx >= %s
+                    UNION
+                    SELECT reservation_id FROM pagos WHERE cambio_tx >= %s
+                ) c
+                JOIN reservas r ON r.id = c.id
+                JOIN servicios s ON r.service_id = s.id
+                JOIN usuarios u ON r.usuario_id = u.id
+                LEFT JOIN pagos p ON r.id = p.reservation_id
+                WHERE {' AND '.join(condiciones)}
+                ORDER BY 10, 1
+                LIMIT %s
+            ) x ON true
+        """
+        nombre = "history_changes_" + ("manager" if self.is_manager else "cliente")
+        return declarar_sentencia(nombre, query, tipos), tuple(params)
+
+    def obtener_cambios(self, cursor=None, limite=None):
+        """
+        Reservas nuevas o modificadas desde `cursor`. Sin cursor no retorna
+        filas: solo el cursor actual, para empezar a sincronizar tras la carga
+        completa del historial. Una reserva puede repetirse entre llamadas.
+        """
+        error, limite, posicion = self._parametros_cambios(limite, cursor)
+        if error is not None:
+            return error
+
+        query, params = self._consulta_cambios(posicion, limite)
+        return self._armar_cambios(self.execute_query(query, params, fetch_all=True), posicion, limite)
+
+    def _parametros_cambios(self, limite, cursor):
+        try:
+            limite = int(limite) if limite else cambios.CAMBIOS_LIMITE_DEFAULT
+        except (TypeError, ValueError):
+            return {"success": False, "message": "Límite inválido."}, None, None
+        limite = max(1, min(limite, cambios.CAMBIOS_LIMITE_MAX))
+
+        if not cursor:
+            # Posición "infinita": ninguna fila, solo el xmin actual
+            return None, limite, (2 ** 62, 2 ** 62, "")
+        try:
+            return None, limite, cambios.decodificar_cursor(cursor)
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, None, None
+
+    def _armar_cambios(self, resultados, posicion, limite):
+        if not resultados:
+            return {"success": False, "message": "Error CRÍTICO al consultar los cambios del historial."}
+
+        xmin = resultados[0][0]
+        filas = [fila[1:] for fila in resultados if fila[1] is not None]
+        hay_mas = len(filas) >= limite
+        # Las transacciones abiertas (>= xmin) aún pueden confirmar en lo ya
+        # paginado: la pasada termina en el menor xmin que vio, no en la última fila
+        seguro, _, ultimo_id = posicion
+        seguro = xmin if ultimo_id == "" else min(seguro, xmin)
+        if hay_mas:
+            siguiente = (seguro, filas[-1][9], filas[-1][0])
+        else:
+            siguiente = (seguro, seguro, "")
+
+        return {
+            "success": True,
+            "data": [self._fila_a_dict(fila) for fila in filas],
+            "cursor": cambios.codificar_cursor(*siguiente),
+            "hay_mas": hay_mas,
+        }
+
 
 class Reserva:
     """Clase para manejar la creación de nuevas reservas."""
 
-    def __init__(self, data, db_executor):
+    # Inserta solo si quedan cupos: cuenta las reservas activas que se solapan
+    # con el turno (misma duración del servicio) y las compara con su capacidad.
+    # La misma sentencia suma la reserva a reporte_diario (ver reportes.py).
+    INSERT_CON_CUPO = declarar_sentencia("reserva_insert_con_cupo", con_delta_reserva("""
+        INSERT INTO reservas (id, usuario_id, service_id, slot_time, status)
+        SELECT %s, %s, s.id, %s, %s
+        FROM servicios s
+        WHERE s.id = %s
+          AND (
+              SELECT COUNT(*) FROM reservas r
+              WHERE r.service_id = s.id
+                AND r.slot_time > %s - s.duration * INTERVAL '1 minute'
+                AND r.slot_time < %s + s.duration * INTERVAL '1 minute'
+                AND LOWER(r.status) NOT IN ('cancelada', 'cancelado', 'rechazada')
+          ) < s.capacity
+    """), ["text", "text", "timestamp", "text", "text", "timestamp", "timestamp"])
+    # Candado transaccional por servicio: serializa solo las reservas del mismo servicio
+    LOCK_SERVICIO = declarar_sentencia("service_lock", "SELECT pg_advisory_xact_lock(hashtext(%s))", ["text"])
+
+    # Campos que se guardan en BD; userEmail y serviceName solo se usan para el correo
+    REQUIRED_FIELDS_BD = ['usuarioId', 'serviceId', 'slotTime', 'status']
+    REQUIRED_FIELDS = REQUIRED_FIELDS_BD + ['userEmail', 'serviceName']
+
+    def __init__(self, data, db_executor, db_atomic=None):
         self.data = data
         self.execute_query = db_executor
+        # Sin db_atomic se usa el de la unidad de trabajo (uow.execute_atomic), si lo tiene
+        self.execute_atomic = db_atomic or getattr(db_executor, "execute_atomic", None)
 
     def crear_reserva(self):
+        result = self.insertar()
+        if result.get("success", False):
+            self.confirmar_efectos()
+        return result
+
+    def insertar(self):
+        """Valida e inserta la reserva; no envía correo ni toca índices en memoria."""
+        error, pasos = self._preparar()
+        if error is not None:
+            return error
+
+        # El candado y el INSERT con cupo deben ir en la misma transacción
+        if self.execute_atomic is None:
+            raise RuntimeError("Reserva requiere db_atomic para serializar las reservas por servicio.")
+        return self._resultado_insercion(self.execute_atomic(pasos))
+
+    def _preparar(self):
+        """Valida los datos y retorna (error, pasos SQL: candado + inserción condicionada)."""
         
-        required_fields = ['usuarioId', 'serviceId', 'slotTime', 'status', 'userEmail', 'serviceName']
-        if not all(self.data.get(field) for field in required_fields):
-            return {"success": False, "message": "Faltan campos obligatorios para la reserva."}
+        if not all(self.data.get(field) for field in self.REQUIRED_FIELDS):
+            return {"success": False, "message": "Faltan campos obligatorios para la reserva."}, None
 
         reserva_id = str(uuid.uuid4())[:50]
         
         try:
             slot_time_dt = parser.parse(self.data['slotTime']) 
         except Exception as e:
-            return {"success": False, "message": f"Formato de fecha u hora inválido: {e}"}
+            return {"success": False, "message": f"Formato de fecha u hora inválido: {e}"}, None
 
-        query = """
-            INSERT INTO reservas (id, usuario_id, service_id, slot_time, status)
-            VALUES (%s, %s, %s, %s, %s)
-        """
+        self.reserva_id = reserva_id
+        self.slot_time_dt = slot_time_dt
         params = (
             reserva_id, 
             self.data['usuarioId'], 
-            self.data['serviceId'], 
             slot_time_dt, 
-            self.data['status']
+            self.data['status'],
+            self.data['serviceId'], 
+            slot_time_dt,
+            slot_time_dt,
         )
-        
-        if self.execute_query(query, params) is None:
+
+        return None, [
+            (self.LOCK_SERVICIO, (self.data['serviceId'],)),
+            (self.INSERT_CON_CUPO, params),
+        ]
+
+    def _resultado_insercion(self, filas):
+        if filas is None:
             return {"success": False, "message": "Error CRÍTICO al guardar la reserva en la base de datos."}
+        if filas == 0:
+            return {"success": False, "message": "No hay cupos disponibles para el servicio en ese horario."}
+
+        return {"success": True, "message": "Reserva creada exitosamente.", "reservaId": self.reserva_id}
+
+    def confirmar_efectos(self):
+        """Efectos posteriores al COMMIT: índice de disponibilidad y correo de confirmación."""
+        if ocupa_cupo(self.data['status']):
+            indice_ocupacion.registrar(self.data['serviceId'], self.slot_time_dt)
         
         send_email_notification(
             to_email=self.data['userEmail'],
             subject=f"Reserva Confirmada: {self.data['serviceName']}",
             body=f"Su reserva para el servicio '{self.data['serviceName']}' ha sido creada exitosamente para la fecha y hora: {self.data['slotTime']}."
         )
-        
-        return {"success": True, "message": "Reserva creada exitosamente.", "reservaId": reserva_id}
 
 
 class Pago:
     """Clase para manejar y procesar pagos."""
 
+    # Inserta el pago y suma su monto a reporte_diario en la misma sentencia
+    INSERT_PAGO = declarar_sentencia("pago_insert", con_delta_pago("""
+             INSERT INTO pagos (id, reservation_id, amount, payment_method, status)
+             VALUES (%s, %s, %s, %s, %s)
+        """), ["text", "text", "numeric", "text", "text"])
+
+    QUERY_ESTADO = declarar_sentencia("pago_estado", """
+             SELECT p.id, p.reservation_id, p.amount, p.payment_method, p.status, r.usuario_id
+             FROM pagos p
+             JOIN reservas r ON r.id = p.reservation_id
+             WHERE p.id = %s
+        """, ["text"])
+
     def __init__(self, data, db_executor):
         self.data = data
         self.execute_query = db_executor
@@ -320,35 +718,130 @@ class Pago:
         return metodo in metodos_validos
 
     def procesar_pago(self):
+        result = self.insertar()
+        if result.get("success", False):
+            self.confirmar_efectos()
+        return result
+
+    def insertar(self):
+        """Valida e inserta el pago; no lo envía a la pasarela."""
+        error, params, resultado = self._preparar()
+        if error is not None:
+            return error
+        
+        if self.execute_query(self.INSERT_PAGO, params) is None:
+             return {"success": False, "message": "Error CRÍTICO al procesar y guardar el pago."}
+
+        return resultado
+
+    def confirmar_efectos(self):
+        """Tras el COMMIT: los pagos con pasarela se liquidan en segundo plano (liquidacion.py)."""
+        if self.metodo in METODOS_PASARELA:
+            liquidador_pagos.encolar(self.pago_id, self.data.get('reserva_id'), self.data.get('monto'), self.metodo)
+
+    def consultar(self, pago_id, usuario_id, is_manager=False):
+        """
+        Estado actual de un pago, para sondear la liquidación. Un cliente solo
+        ve los pagos de sus reservas; los de otros cuentan como no encontrados.
+        """
+        fila = self.execute_query(self.QUERY_ESTADO, (pago_id,), fetch_data=True)
+        return self._resultado_consulta(fila, usuario_id, is_manager)
+
+    @staticmethod
+    def _resultado_consulta(fila, usuario_id, is_manager):
+        if fila is None or (not is_manager and fila[5] != usuario_id):
+            return {"success": False, "message": "Pago no encontrado."}
+        pago_id, reserva_id, monto, metodo, estado, _ = fila
+        return {
+            "success": True,
+            "pagoId": pago_id,
+            "reserva_id": reserva_id,
+            "monto": float(monto),
+            "metodo": metodo,
+            "estado_pago": estado,
+        }
+
+    def _preparar(self):
+        """Valida el pago y retorna (error, params del INSERT, respuesta de éxito)."""
         metodo = self.data.get('metodo', '').lower()
         monto = self.data.get('monto', 0)
         reserva_id = self.data.get('reserva_id') 
         
         if not self.validar_metodo():
-            return {"success": False, "message": f"Método de pago inválido: {metodo}"}
+            return {"success": False, "message": f"Método de pago inválido: {metodo}"}, None, None
 
         if monto <= 0:
-            return {"success": False, "message": "El monto debe ser mayor a 0."}
+            return {"success": False, "message": "El monto debe ser mayor a 0."}, None, None
         
         if not reserva_id:
-             return {"success": False, "message": "ID de reserva requerido para el pago."}
+             return {"success": False, "message": "ID de reserva requerido para el pago."}, None, None
 
+        # Todo pago nace PENDIENTE: el contraentrega se cobra en sitio y los
+        # demás los aprueba o rechaza la pasarela en segundo plano
+        estado_pago = "PENDIENTE"
         if metodo == "pagar en sitio":
-            estado_pago = "PENDIENTE"
             mensaje = "Pago contraentrega registrado."
         else:
-            estado_pago = "APROBADO"
-            mensaje = "Pago procesado con éxito."
+            mensaje = "Pago recibido; pendiente de confirmación de la pasarela."
 
         # Guardar en tabla pagos
         pago_id = str(uuid.uuid4())[:50]
-        query = """
-             INSERT INTO pagos (id, reservation_id, amount, payment_method, status)
-             VALUES (%s, %s, %s, %s, %s)
-        """
+        self.pago_id = pago_id
+        self.metodo = metodo
         params = (pago_id, reserva_id, monto, metodo, estado_pago)
-        
-        if self.execute_query(query, params) is None:
-             return {"success": False, "message": "Error CRÍTICO al procesar y guardar el pago."}
 
-        return {"success": True, "estado_pago": estado_pago, "message": mensaje}
\ No newline at end of file
+        return None, params, {"success": True, "pagoId": pago_id, "estado_pago": estado_pago, "message": mensaje}
+
+
+class ReservaConPago:
+    """
+    Crea la reserva y su pago en una sola transacción: o se guardan ambos o
+    ninguno, de modo que un pago fallido no deja reservas huérfanas.
+    """
+
+    def __init__(self, data, db_transaction):
+        self.data = data
+        self.transaccion = db_transaction
+
+    def procesar(self):
+        with self.transaccion() as uow:
+            result = self.insertar(uow)
+            if not result.get("success", False):
+                uow.abortar()
+                return result
+
+        if not uow.exitosa:
+            return {"success": False, "message": "Error CRÍTICO al guardar la reserva y el pago."}
+
+        self.confirmar_efectos()
+        return result
+
+    def insertar(self, uow):
+        """Reserva y pago dentro de `uow`; quien llama hace el COMMIT (o abortar())."""
+        datos_pago = dict(self.data.get('pago') or {})
+
+        self.reserva_logic = Reserva(self.data, uow, uow.execute_atomic)
+        result_reserva = self.reserva_logic.insertar()
+        if not result_reserva.get("success", False):
+            return result_reserva
+
+        datos_pago['reserva_id'] = result_reserva['reservaId']
+        self.pago_logic = Pago(datos_pago, uow)
+        result_pago = self.pago_logic.insertar()
+        if not result_pago.get("success", False):
+            return result_pago
+
+        return self._resultado(result_reserva, result_pago)
+
+    def _resultado(self, result_reserva, result_pago):
+        return {
+            "success": True,
+            "message": "Reserva y pago registrados exitosamente.",
+            "reservaId": result_reserva['reservaId'],
+            "pagoId": result_pago['pagoId'],
+            "estado_pago": result_pago['estado_pago'],
+        }
+
+    def confirmar_efectos(self):
+        self.reserva_logic.confirmar_efectos()
+        self.pago_logic.confirmar_efectos()
\ No newline at end of file
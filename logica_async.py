@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from busqueda_catalogo import indice_catalogo
+from cache_catalogo import cache_catalogo
+from disponibilidad import Disponibilidad
+from logica import Login, Usuario, Servicio, HistorialReservas, Reserva, Pago, ReservaConPago
+from reportes import Reportes
+
+# =======================================================
+# VERSIONES ASÍNCRONAS DE LAS CLASES DE GESTIÓN
+# =======================================================
+# Reciben un db_executor asíncrono (p. ej. execute_query_async) y reutilizan
+# las validaciones y el armado de respuestas de logica.py; solo cambian los
+# puntos donde se espera a la base de datos.
+
+
+class LoginAsync(Login):
+
+    async def autenticar(self):
+        if not self.validar_correo():
+            return {"success": False, "message": "Correo inválido."}
+
+        user_data = await self.execute_query(self.QUERY_LOGIN, (self.correo,), fetch_data=True)
+        return self._resultado(user_data)
+
+
+class UsuarioAsync(Usuario):
+
+    async def existe_en_bd(self):
+        return await self.execute_query(self.QUERY_EXISTE, (self.correo,), fetch_data=True) is not None
+
+    async def registrar(self):
+        if not self.validar_correo():
+            return {"success": False, "message": "Correo inválido."}
+
+        if await self.existe_en_bd():
+            return {"success": False, "message": "Este correo ya está registrado."}
+
+        if not self._validar_contrasena():
+            return {"success": False, "message": "La contraseña es demasiado corta."}
+
+        user_id, name, params = self._datos_insert()
+
+        if await self.execute_query(self.INSERT_USUARIO, params) is None:
+             return {"success": False, "message": "Error CRÍTICO al guardar el usuario en la base de datos."}
+
+        return self._confirmar_registro(user_id, name)
+
+
+# Evita que varias corrutinas recarguen el catálogo a la vez tras expirar el cache
+_carga_catalogo_lock = None
+
+
+class ServicioAsync(Servicio):
+
+    async def obtener_todos(self):
+        datos, _, _ = await self._leer_catalogo()
+        return {"success": True, "data": datos}
+
+    async def obtener_catalogo_serializado(self):
+        _, cuerpo, etag = await self._leer_catalogo()
+        return cuerpo, etag
+
+    async def _leer_catalogo(self):
+        global _carga_catalogo_lock
+        entrada = cache_catalogo.leer()
+        if entrada is not None:
+            return entrada
+        if _carga_catalogo_lock is None:
+            _carga_catalogo_lock = asyncio.Lock()
+        async with _carga_catalogo_lock:
+            entrada = cache_catalogo.leer()
+            if entrada is not None:
+                return entrada
+            version = cache_catalogo.version
+            filas = await self.execute_query(self.QUERY_CATALOGO, fetch_all=True)
+            return cache_catalogo.almacenar(self._filas_a_catalogo(filas), version)
+
+    async def crear(self):
+        error = self._validar()
+        if error is not None:
+            return error
+
+        new_service_id, params = self._datos_insert()
+
+        if await self.execute_query(self.INSERT_SERVICIO, params) is None:
+             return {"success": False, "message": "Error CRÍTICO al crear el servicio en la BD."}
+
+        self.confirmar_creacion(params)
+
+        return {"success": True, "message": "Servicio creado correctamente.", "id": new_service_id}
+
+    async def buscar(self, params):
+        error, filtros = self._filtros_busqueda(params)
+        if error is not None:
+            return error
+
+        if not indice_catalogo.vigente():
+            version = cache_catalogo.version
+            datos, _, etag = await self._leer_catalogo()
+            if etag is None:
+                return {"success": False, "message": "Error CRÍTICO al cargar el catálogo."}
+            indice_catalogo.reemplazar(datos, version)
+
+        return self._resultado_busqueda(filtros)
+
+
+class HistorialReservasAsync(HistorialReservas):
+
+    async def obtener_historial(self):
+        query, params = self._consulta()
+
+        resultados = await self.execute_query(query, params, fetch_all=True)
+
+        if resultados is None:
+             return {"success": True, "data": []}
+
+        return {"success": True, "data": [self._fila_a_dict(fila) for fila in resultados]}
+
+    async def obtener_pagina(self, limite=None, cursor=None):
+        error, limite, posicion = self._parametros_pagina(limite, cursor)
+        if error is not None:
+            return error
+
+        query, params = self._consulta(posicion, limite + 1)
+
+        resultados = await self.execute_query(query, params, fetch_all=True)
+        return self._armar_pagina(resultados, limite)
+
+    async def iterar_historial(self):
+        if self.stream_query is None:
+            raise RuntimeError("HistorialReservasAsync requiere db_streamer para el modo streaming.")
+
+        query, params = self._consulta()
+        filas = await self.stream_query(query, params)
+        return (self._fila_a_dict(fila) async for fila in filas)
+
+    async def obtener_cambios(self, cursor=None, limite=None):
+        error, limite, posicion = self._parametros_cambios(limite, cursor)
+        if error is not None:
+            return error
+
+        query, params = self._consulta_cambios(posicion, limite)
+        return self._armar_cambios(await self.execute_query(query, params, fetch_all=True), posicion, limite)
+
+
+class ReservaAsync(Reserva):
+
+    async def crear_reserva(self):
+        result = await self.insertar()
+        if result.get("success", False):
+            self.confirmar_efectos()
+        return result
+
+    async def insertar(self):
+        error, pasos = self._preparar()
+        if error is not None:
+            return error
+
+        if self.execute_atomic is None:
+            raise RuntimeError("ReservaAsync requiere db_atomic para serializar las reservas por servicio.")
+        return self._resultado_insercion(await self.execute_atomic(pasos))
+
+
+class PagoAsync(Pago):
+
+    async def procesar_pago(self):
+        result = await self.insertar()
+        if result.get("success", False):
+            self.confirmar_efectos()
+        return result
+
+    async def insertar(self):
+        error, params, resultado = self._preparar()
+        if error is not None:
+            return error
+
+        if await self.execute_query(self.INSERT_PAGO, params) is None:
+             return {"success": False, "message": "Error CRÍTICO al procesar y guardar el pago."}
+
+        return resultado
+
+    async def consultar(self, pago_id, usuario_id, is_manager=False):
+        fila = await self.execute_query(self.QUERY_ESTADO, (pago_id,), fetch_data=True)
+        return self._resultado_consulta(fila, usuario_id, is_manager)
+
+
+class ReservaConPagoAsync(ReservaConPago):
+    """Reserva + pago en una transacción, sobre transaccion_async."""
+
+    async def procesar(self):
+        async with self.transaccion() as uow:
+            result = await self.insertar(uow)
+            if not result.get("success", False):
+                uow.abortar()
+                return result
+
+        if not uow.exitosa:
+            return {"success": False, "message": "Error CRÍTICO al guardar la reserva y el pago."}
+
+        self.confirmar_efectos()
+        return result
+
+    async def insertar(self, uow):
+        datos_pago = dict(self.data.get('pago') or {})
+
+        self.reserva_logic = ReservaAsync(self.data, uow, uow.execute_atomic)
+        result_reserva = await self.reserva_logic.insertar()
+        if not result_reserva.get("success", False):
+            return result_reserva
+
+        datos_pago['reserva_id'] = result_reserva['reservaId']
+        self.pago_logic = PagoAsync(datos_pago, uow)
+        result_pago = await self.pago_logic.insertar()
+        if not result_pago.get("success", False):
+            return result_pago
+
+        return self._resultado(result_reserva, result_pago)
+
+
+class DisponibilidadAsync(Disponibilidad):
+
+    async def consultar(self):
+        error, desde, hasta = self._rango()
+        if error is not None:
+            return error
+
+        if not self.indice.vigente():
+            filas = await self.execute_query(self.indice.QUERY_CARGA, self.indice.parametros_carga(), fetch_all=True)
+            if not self.indice.reemplazar(filas):
+                return {"success": False, "message": "Error CRÍTICO al consultar la disponibilidad."}
+
+        return self._resultado(desde, hasta)
+
+
+class ReportesAsync(Reportes):
+
+    async def consultar(self):
+        error, consulta = self._preparar()
+        if error is not None:
+            return error
+        return self._resultado(await self.execute_query(*consulta, fetch_all=True))
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import bisect
+import re
+import threading
+
+# --- Configuración de Métricas ---
+SLOW_QUERY_MS = 200            # Consultas más lentas se registran en consola; None desactiva
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histograma:
+    """Histograma acumulativo con buckets fijos (formato Prometheus)."""
+
+    __slots__ = ("buckets", "conteos", "suma", "total")
+
+    def __init__(self, buckets=BUCKETS_SEGUNDOS):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)   # El último es +Inf
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.conteos[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+
+class RegistroMetricas:
+    """
+    Contadores e histogramas etiquetados, en memoria del proceso.
+    Cada observación es un acceso a dict y un bisect bajo un candado, de modo
+    que el coste es despreciable frente a un viaje a la BD.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}      # (nombre, etiquetas) -> valor
+        self._histogramas = {}     # (nombre, etiquetas) -> Histograma
+        self._ayuda = {}
+        self._colectores = []      # funciones que retornan [(nombre, etiquetas, valor)]
+
+    def describir(self, nombre, ayuda):
+        self._ayuda[nombre] = ayuda
+
+    def incrementar(self, nombre, etiquetas=(), valor=1):
+        clave = (nombre, etiquetas)
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, etiquetas=()):
+        clave = (nombre, etiquetas)
+        with self._lock:
+            hist = self._histogramas.get(clave)
+            if hist is None:
+                hist = self._histogramas[clave] = Histograma()
+            hist.observar(valor)
+
+    def registrar_colector(self, funcion):
+        """Agrega una función que aporta gauges al momento de exportar."""
+        self._colectores.append(funcion)
+
+    def valor(self, nombre, etiquetas=()):
+        with self._lock:
+            return self._contadores.get((nombre, etiquetas), 0)
+
+    def reiniciar(self):
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+    def exportar(self):
+        """Texto en formato de exposición de Prometheus (v0.0.4)."""
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted(
+                (clave, (list(h.conteos), h.suma, h.total, h.buckets))
+                for clave, h in self._histogramas.items()
+            )
+
+        lineas = []
+        vistos = set()
+
+        def cabecera(nombre, tipo):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                if nombre in self._ayuda:
+                    lineas.append(f"# HELP {nombre} {self._ayuda[nombre]}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+
+        for (nombre, etiquetas), valor in contadores:
+            cabecera(nombre, "counter")
+            lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor}")
+
+        for (nombre, etiquetas), (conteos, suma, total, buckets) in histogramas:
+            cabecera(nombre, "histogram")
+            acumulado = 0
+            for limite, conteo in zip(buckets, conteos):
+                acumulado += conteo
+                lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas + (('le', repr(limite)),))} {acumulado}")
+            lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas + (('le', '+Inf'),))} {total}")
+            lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {suma}")
+            lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {total}")
+
+        for colector in self._colectores:
+            try:
+                muestras = colector()
+            except Exception as e:
+                print(f"ERROR EN COLECTOR DE MÉTRICAS: {e}")
+                continue
+            for nombre, etiquetas, valor in muestras:
+                cabecera(nombre, "gauge")
+                lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor}")
+
+        return "\n".join(lineas) + "\n"
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in etiquetas) + "}"
+
+# =======================================================
+# NOMBRES DE CONSULTAS
+# =======================================================
+
+# Reglas (patrón sobre el SQL normalizado -> nombre de la consulta)
+REGLAS_CONSULTAS = [
+    (re.compile(r"^select id, name, password, role"), "login_lookup"),
+    (re.compile(r"^select id from usuarios where email"), "usuario_existe"),
+    (re.compile(r"from servicios order by name"), "catalog_scan"),
+    (re.compile(r"from reservas r join servicios .* limit %s"), "history_join_page"),
+    (re.compile(r"from reservas r join servicios"), "history_join"),
+    (re.compile(r"^select service_id, slot_time, status from reservas"), "availability_load"),
+    (re.compile(r"pg_advisory_xact_lock"), "service_lock"),
+    (re.compile(r"^insert into reservas .* select"), "reserva_insert_con_cupo"),
+]
+_nombres_cache = {}
+
+
+def nombre_consulta(query):
+    """
+    Nombre estable de una consulta para etiquetar métricas. Como el SQL de
+    logica.py es texto constante, el resultado se memoriza por cadena.
+    """
+    nombre = _nombres_cache.get(query)
+    if nombre is not None:
+        return nombre
+
+    q = " ".join(query.split()).lower()
+    for patron, candidato in REGLAS_CONSULTAS:
+        if patron.search(q):
+            nombre = candidato
+            break
+    else:
+        m = re.match(r"^(insert into|update|delete from) (\w+)", q) or re.match(r"^select .*? from (\w+)", q)
+        if m and m.lastindex == 2:
+            nombre = f"{m.group(1).split()[0]}_{m.group(2)}"
+        elif m:
+            nombre = f"select_{m.group(1)}"
+        else:
+            nombre = q.split(" ", 1)[0] or "otra"
+
+    if len(_nombres_cache) < 10000:
+        _nombres_cache[query] = nombre
+    return nombre
+
+# =======================================================
+# INSTRUMENTACIÓN
+# =======================================================
+
+registro = RegistroMetricas()
+registro.describir("db_query_duration_seconds", "Tiempo de ejecución de consultas (execute + fetch).")
+registro.describir("db_pool_wait_seconds", "Tiempo esperando una conexión del pool.")
+registro.describir("db_query_errors_total", "Consultas que terminaron en error de BD.")
+registro.describir("db_slow_queries_total", "Consultas que superaron SLOW_QUERY_MS.")
+registro.describir("http_request_duration_seconds", "Latencia por ruta de Flask.")
+registro.describir("http_requests_total", "Peticiones atendidas por ruta, método y código.")
+registro.describir("http_request_errors_total", "Respuestas 4xx/5xx por ruta y código.")
+registro.describir("http_rejected_total", "Peticiones rechazadas por el control de admisión (429/503).")
+
+
+def observar_consulta(nombre, segundos, error=False):
+    etiquetas = (("query", nombre),)
+    registro.observar("db_query_duration_seconds", segundos, etiquetas)
+    if error:
+        registro.incrementar("db_query_errors_total", etiquetas)
+    if SLOW_QUERY_MS is not None and segundos * 1000.0 >= SLOW_QUERY_MS:
+        registro.incrementar("db_slow_queries_total", etiquetas)
+        print(f"CONSULTA LENTA [{nombre}]: {segundos * 1000.0:.1f} ms")
+
+
+def observar_espera_pool(segundos):
+    registro.observar("db_pool_wait_seconds", segundos)
+
+
+def observar_peticion(ruta, metodo, codigo, segundos):
+    registro.observar("http_request_duration_seconds", segundos, (("route", ruta), ("method", metodo)))
+    etiquetas = (("route", ruta), ("method", metodo), ("status", str(codigo)))
+    registro.incrementar("http_requests_total", etiquetas)
+    if codigo >= 400:
+        registro.incrementar("http_request_errors_total", etiquetas)
+
+
+def observar_rechazo(ruta, motivo):
+    registro.incrementar("http_rejected_total", (("route", ruta), ("reason", motivo)))
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import json
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+# --- Configuración de la Cola de Notificaciones ---
+OUTBOX_WORKERS = 1          # Hilos que drenan la cola en segundo plano
+OUTBOX_BATCH_SIZE = 20      # Correos por lote
+OUTBOX_MAX_INTENTOS = 5     # Reintentos antes de descartar un correo
+OUTBOX_BACKOFF_BASE = 0.5   # Segundos; se duplica en cada reintento
+OUTBOX_BACKOFF_MAX = 30.0
+
+# =======================================================
+# BACKENDS DE ENVÍO
+# =======================================================
+
+class BackendConsola:
+    """Simula el envío imprimiendo el correo (comportamiento histórico)."""
+
+    def enviar_lote(self, mensajes):
+        for m in mensajes:
+            print(f"\n--- SIMULACIÓN DE EMAIL ENVIADO ---")
+            print(f"Para: {m['to_email']}")
+            print(f"Asunto: {m['subject']}")
+            print(f"Cuerpo: {m['body']}")
+            print(f"-----------------------------------\n")
+        return [True] * len(mensajes)
+
+
+class BackendArchivo:
+    """Escribe cada correo como una línea JSON en un archivo local (para pruebas)."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+
+    def enviar_lote(self, mensajes):
+        with self._lock, open(self.ruta, "a", encoding="utf-8") as f:
+            for m in mensajes:
+                f.write(json.dumps(m, ensure_ascii=False) + "\n")
+        return [True] * len(mensajes)
+
+
+class BackendSMTP:
+    """Envía los correos por SMTP reutilizando una sola sesión por lote."""
+
+    def __init__(self, host, port=587, usuario=None, contrasena=None, remitente="no-reply@agendapro.local", tls=True):
+        self.host = host
+        self.port = port
+        self.usuario = usuario
+        self.contrasena = contrasena
+        self.remitente = remitente
+        self.tls = tls
+
+    def enviar_lote(self, mensajes):
+        resultados = []
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            if self.tls:
+                smtp.starttls()
+            if self.usuario:
+                smtp.login(self.usuario, self.contrasena)
+            for m in mensajes:
+                msg = EmailMessage()
+                msg["From"] = self.remitente
+                msg["To"] = m["to_email"]
+                msg["Subject"] = m["subject"]
+                msg.set_content(m["body"])
+                try:
+                    smtp.send_message(msg)
+                    resultados.append(True)
+                except smtplib.SMTPException as e:
+                    print(f"ERROR SMTP enviando a {m['to_email']}: {e}")
+                    resultados.append(False)
+        return resultados
+
+# =======================================================
+# OUTBOX
+# =======================================================
+
+class ColaNotificaciones:
+    """
+    Outbox local de correos: la petición solo encola (O(1)) y los workers en
+    segundo plano envían por lotes, con reintentos y backoff exponencial.
+    """
+
+    def __init__(self, backend=None, workers=OUTBOX_WORKERS, batch_size=OUTBOX_BATCH_SIZE,
+                 max_intentos=OUTBOX_MAX_INTENTOS, backoff_base=OUTBOX_BACKOFF_BASE):
+        self.backend = backend or BackendConsola()
+        self.num_workers = workers
+        self.batch_size = batch_size
+        self.max_intentos = max_intentos
+        self.backoff_base = backoff_base
+        self._cola = queue.Queue()
+        self._reintentos = []          # (listo_en, mensaje)
+        self._pendientes = 0           # Encolados aún sin enviar ni descartar (en cola, en lote o en espera)
+        self._lock = threading.Lock()
+        self._hilos = []
+        self._detener = threading.Event()
+        self.contadores = {"encolados": 0, "enviados": 0, "fallidos": 0, "reintentos": 0, "descartados": 0}
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+
+    def iniciar(self):
+        """Arranca los workers (idempotente)."""
+        with self._lock:
+            if self._hilos:
+                return
+            self._detener.clear()
+            for i in range(self.num_workers):
+                hilo = threading.Thread(target=self._bucle, name=f"outbox-{i}", daemon=True)
+                hilo.start()
+                self._hilos.append(hilo)
+
+    def detener(self, timeout=5.0):
+        """Detiene los workers tras vaciar lo pendiente (o agotar `timeout`)."""
+        self.drenar(timeout)
+        self._detener.set()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        self._hilos = []
+
+    def encolar(self, to_email, subject, body):
+        mensaje = {
+            "to_email": to_email,
+            "subject": subject,
+            "body": body,
+            "intentos": 0,
+            "encolado_en": time.monotonic(),
+        }
+        with self._lock:
+            self._pendientes += 1
+            self.contadores["encolados"] += 1
+        self._cola.put(mensaje)
+        if not self._hilos:
+            self.iniciar()
+        return True
+
+    def profundidad(self):
+        with self._lock:
+            return self._cola.qsize() + len(self._reintentos)
+
+    def drenar(self, timeout=5.0):
+        """Espera a que todo lo encolado se envíe o descarte; retorna True si lo logró."""
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            with self._lock:
+                vacia = self._pendientes == 0
+            if vacia:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def _tomar_lote(self):
+        lote = []
+        try:
+            lote.append(self._cola.get(timeout=0.1))
+        except queue.Empty:
+            return lote
+        while len(lote) < self.batch_size:
+            try:
+                lote.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _reencolar_vencidos(self):
+        ahora = time.monotonic()
+        # Bajo el mismo lock que drenar y profundidad: un mensaje nunca queda fuera de ambos
+        with self._lock:
+            listos = [m for t, m in self._reintentos if t <= ahora]
+            self._reintentos = [(t, m) for t, m in self._reintentos if t > ahora]
+            for m in listos:
+                self._cola.put(m)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._reencolar_vencidos()
+            lote = self._tomar_lote()
+            if not lote:
+                continue
+            try:
+                resultados = self.backend.enviar_lote(lote)
+            except Exception as e:
+                print(f"ERROR DEL BACKEND DE CORREO: {e}")
+                resultados = [False] * len(lote)
+            # Un backend que responde de menos: los mensajes sin resultado cuentan como fallidos
+            resultados = list(resultados)[:len(lote)]
+            resultados += [False] * (len(lote) - len(resultados))
+
+            ahora = time.monotonic()
+            with self._lock:
+                for mensaje, ok in zip(lote, resultados):
+                    if ok:
+                        latencia = ahora - mensaje["encolado_en"]
+                        self.contadores["enviados"] += 1
+                        self._latencia_total += latencia
+                        self._latencia_max = max(self._latencia_max, latencia)
+                        self._pendientes -= 1
+                        continue
+                    mensaje["intentos"] += 1
+                    self.contadores["fallidos"] += 1
+                    if mensaje["intentos"] >= self.max_intentos:
+                        self.contadores["descartados"] += 1
+                        print(f"ERROR: correo a {mensaje['to_email']} descartado tras {mensaje['intentos']} intentos.")
+                        self._pendientes -= 1
+                        continue
+                    espera = min(self.backoff_base * (2 ** (mensaje["intentos"] - 1)), OUTBOX_BACKOFF_MAX)
+                    self._reintentos.append((ahora + espera, mensaje))
+                    self.contadores["reintentos"] += 1
+
+    def estadisticas(self):
+        with self._lock:
+            stats = dict(self.contadores)
+            enviados = stats["enviados"]
+            stats["profundidad"] = self._cola.qsize() + len(self._reintentos)
+            stats["latencia_media_s"] = self._latencia_total / enviados if enviados else 0.0
+            stats["latencia_max_s"] = self._latencia_max
+            return stats
+
+
+# Instancia global del proceso
+cola_notificaciones = ColaNotificaciones()
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+# Reportes de ingresos y ocupación por servicio y día.
+#
+# reporte_diario guarda agregados por (servicio, día) que se mantienen al día
+# de forma incremental: la misma sentencia que inserta una reserva o un pago
+# suma su delta (WITH ... INSERT ... ON CONFLICT DO UPDATE), así que el
+# agregado y el dato base se confirman juntos. Un trabajo de recálculo
+# periódico reconstruye una ventana de días desde las tablas base para
+# corregir lo que entró por otras vías (cargas masivas, cambios manuales).
+#
+#   python reportes.py --desde 2024-01-01 --hasta 2024-12-31   (recálculo completo)
+import argparse
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from disponibilidad import ESTADOS_LIBERADOS, HORA_APERTURA, HORA_CIERRE
+from sentencias import declarar_sentencia
+
+# --- Configuración de Reportes ---
+REPORTE_MAX_DIAS = 366               # Rango máximo por consulta a /api/reports
+REPORTE_RECALCULO_INTERVALO = 300.0  # Segundos entre recálculos de la ventana
+REPORTE_VENTANA_ATRAS = 7            # Días hacia atrás que recalcula el trabajo periódico
+REPORTE_VENTANA_ADELANTE = 90        # Días hacia adelante (reservas futuras)
+
+ESQUEMA_REPORTES = """
+    CREATE TABLE IF NOT EXISTS reporte_diario (
+        service_id VARCHAR(50) NOT NULL REFERENCES servicios(id),
+        dia DATE NOT NULL,
+        reservas INTEGER NOT NULL DEFAULT 0,
+        canceladas INTEGER NOT NULL DEFAULT 0,
+        monto_aprobado NUMERIC(12, 2) NOT NULL DEFAULT 0,
+        monto_pendiente NUMERIC(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (service_id, dia)
+    );
+    CREATE INDEX IF NOT EXISTS reporte_diario_dia ON reporte_diario (dia);
+"""
+
+_LIBERADOS_SQL = ", ".join(f"'{estado}'" for estado in ESTADOS_LIBERADOS)
+
+_COLUMNAS = "service_id, dia, reservas, canceladas, monto_aprobado, monto_pendiente"
+
+_SUMAR_DELTA = """
+    ON CONFLICT (service_id, dia) DO UPDATE SET
+        reservas = reporte_diario.reservas + EXCLUDED.reservas,
+        canceladas = reporte_diario.canceladas + EXCLUDED.canceladas,
+        monto_aprobado = reporte_diario.monto_aprobado + EXCLUDED.monto_aprobado,
+        monto_pendiente = reporte_diario.monto_pendiente + EXCLUDED.monto_pendiente
+"""
+
+
+def con_delta_reserva(insert_sql):
+    """
+    Envuelve un INSERT INTO reservas para que sume la reserva a reporte_diario
+    en la misma sentencia. Las filas afectadas siguen siendo las insertadas
+    (0 si el INSERT no insertó nada, p. ej. por falta de cupo).
+    """
+    return f"""
+        WITH insertada AS (
+            {insert_sql}
+            RETURNING service_id, slot_time, status
+        )
+        INSERT INTO reporte_diario ({_COLUMNAS})
+        SELECT service_id, slot_time::date, 1,
+               CASE WHEN LOWER(status) IN ({_LIBERADOS_SQL}) THEN 1 ELSE 0 END, 0, 0
+        FROM insertada
+        {_SUMAR_DELTA}
+    """
+
+
+def con_delta_pago(insert_sql):
+    """Igual que con_delta_reserva, para un INSERT INTO pagos (monto aprobado o pendiente)."""
+    return f"""
+        WITH insertado AS (
+            {insert_sql}
+            RETURNING reservation_id, amount, status
+        )
+        INSERT INTO reporte_diario ({_COLUMNAS})
+        SELECT r.service_id, r.slot_time::date, 0, 0,
+               CASE WHEN p.status = 'APROBADO' THEN p.amount ELSE 0 END,
+               CASE WHEN p.status = 'PENDIENTE' THEN p.amount ELSE 0 END
+        FROM insertado p
+        JOIN reservas r ON r.id = p.reservation_id
+        {_SUMAR_DELTA}
+    """
+
+
+def con_delta_liquidacion(update_sql):
+    """
+    Envuelve un UPDATE pagos p (de PENDIENTE a APROBADO o RECHAZADO) para que
+    mueva los montos de pendiente a aprobado (o los descuente si se
+    rechazaron), agrupados por servicio y día, en la misma sentencia.
+    """
+    return f"""
+        WITH liquidados AS (
+            {update_sql}
+            RETURNING p.reservation_id, p.amount, p.status
+        )
+        INSERT INTO reporte_diario ({_COLUMNAS})
+        SELECT r.service_id, r.slot_time::date, 0, 0,
+               SUM(CASE WHEN l.status = 'APROBADO' THEN l.amount ELSE 0 END),
+               -SUM(l.amount)
+        FROM liquidados l
+        JOIN reservas r ON r.id = l.reservation_id
+        GROUP BY r.service_id, r.slot_time::date
+        {_SUMAR_DELTA}
+    """
+
+# =======================================================
+# RECÁLCULO DESDE LAS TABLAS BASE
+# =======================================================
+
+# Se recalcula un servicio por transacción: solo bloquea las reservas de ese
+# servicio y un candado por transacción (no agota max_locks_per_transaction).
+LISTAR_SERVICIOS = "SELECT id FROM servicios ORDER BY id"
+# Serializa los recálculos de un mismo servicio entre sí (y entre workers)
+LOCK_RECALCULO = "SELECT pg_advisory_xact_lock(hashtext('reporte_diario'), hashtext(%s))"
+TRY_LOCK_RECALCULO = "SELECT pg_try_advisory_xact_lock(hashtext('reporte_diario'), hashtext(%s))"
+# Mismo candado por servicio que Reserva: mientras dura el recálculo no se
+# insertan reservas cuyo delta se perdería al reescribir la fila
+LOCK_SERVICIO = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+BORRAR_RANGO = "DELETE FROM reporte_diario WHERE service_id = %s AND dia BETWEEN %s AND %s"
+RECALCULAR_RANGO = f"""
+    INSERT INTO reporte_diario ({_COLUMNAS})
+    SELECT r.service_id, r.slot_time::date,
+           COUNT(DISTINCT r.id),
+           COUNT(DISTINCT r.id) FILTER (WHERE LOWER(r.status) IN ({_LIBERADOS_SQL})),
+           COALESCE(SUM(p.amount) FILTER (WHERE p.status = 'APROBADO'), 0),
+           COALESCE(SUM(p.amount) FILTER (WHERE p.status = 'PENDIENTE'), 0)
+    FROM reservas r
+    LEFT JOIN pagos p ON p.reservation_id = r.id
+    WHERE r.service_id = %s AND r.slot_time >= %s AND r.slot_time < %s
+    GROUP BY r.service_id, r.slot_time::date
+    ON CONFLICT (service_id, dia) DO UPDATE SET
+        reservas = EXCLUDED.reservas,
+        canceladas = EXCLUDED.canceladas,
+        monto_aprobado = EXCLUDED.monto_aprobado,
+        monto_pendiente = EXCLUDED.monto_pendiente
+"""
+
+
+def recalcular_servicio(uow, service_id, desde, hasta, esperar=True):
+    """
+    Reconstruye reporte_diario de un servicio para los días [desde, hasta]
+    dentro de la transacción `uow`. Con esperar=False no bloquea si otro
+    proceso ya lo está recalculando (retorna None). Retorna las filas de
+    agregados escritas.
+    """
+    if esperar:
+        uow(LOCK_RECALCULO, (service_id,), fetch_data=True)
+    else:
+        fila = uow(TRY_LOCK_RECALCULO, (service_id,), fetch_data=True)
+        if not fila or not fila[0]:
+            return None
+    uow(LOCK_SERVICIO, (service_id,), fetch_data=True)
+    uow(BORRAR_RANGO, (service_id, desde, hasta))
+    inicio = datetime(desde.year, desde.month, desde.day)
+    fin = datetime(hasta.year, hasta.month, hasta.day) + timedelta(days=1)
+    return uow(RECALCULAR_RANGO, (service_id, inicio, fin))
+
+
+def recalcular(uow, desde, hasta, servicios):
+    """
+    Recalcula `servicios` (ids) en la transacción `uow`, p. ej. al sembrar
+    datos sintéticos; retorna las filas escritas. Fuera de una transacción
+    propia use ActualizadorReportes.recalcular, que abre una por servicio.
+    """
+    filas = 0
+    for service_id in sorted(servicios):
+        escritas = recalcular_servicio(uow, service_id, desde, hasta)
+        if uow.fallida:
+            return None
+        filas += escritas or 0
+    return filas
+
+
+class ActualizadorReportes:
+    """
+    Trabajo de recálculo: cada `intervalo` segundos reconstruye la ventana
+    [hoy - atras, hoy + adelante] en un hilo en segundo plano, un servicio
+    por transacción.
+    """
+
+    def __init__(self, db_transaction, intervalo=REPORTE_RECALCULO_INTERVALO,
+                 atras=REPORTE_VENTANA_ATRAS, adelante=REPORTE_VENTANA_ADELANTE):
+        self.transaccion = db_transaction
+        self.intervalo = intervalo
+        self.atras = atras
+        self.adelante = adelante
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._detener = threading.Event()
+        self.contadores = {"recalculos": 0, "omitidos": 0, "errores": 0, "ultimo_ms": 0.0}
+
+    def recalcular_ventana(self):
+        hoy = date.today()
+        return self.recalcular(hoy - timedelta(days=self.atras), hoy + timedelta(days=self.adelante), esperar=False)
+
+    def recalcular(self, desde, hasta, esperar=True, servicios=None):
+        """
+        Recalcula `servicios` (ids; por defecto todo el catálogo); retorna las
+        filas escritas, o None si no se pudo listar los servicios. Un servicio
+        que falla o que otro proceso ya está recalculando se cuenta y no
+        detiene a los demás.
+        """
+        inicio = time.perf_counter()
+        if servicios is None:
+            with self.transaccion() as uow:
+                filas = uow(LISTAR_SERVICIOS, fetch_all=True)
+            if not uow.exitosa or filas is None:
+                self.contadores["errores"] += 1
+                return None
+            servicios = [service_id for (service_id,) in filas]
+
+        total = 0
+        for service_id in sorted(servicios):
+            with self.transaccion() as uow:
+                filas = recalcular_servicio(uow, service_id, desde, hasta, esperar=esperar)
+                # Sin error de BD, None significa que otro proceso ya lo está recalculando
+                omitido = filas is None and not uow.fallida
+                if filas is None:
+                    uow.abortar()
+            if not uow.exitosa:
+                self.contadores["omitidos" if omitido else "errores"] += 1
+                continue
+            total += filas
+        self.contadores["recalculos"] += 1
+        self.contadores["ultimo_ms"] = round((time.perf_counter() - inicio) * 1000.0, 1)
+        return total
+
+    def iniciar(self):
+        """Arranca el hilo de recálculo (idempotente)."""
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="reportes-recalculo", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(self.intervalo)
+            self._hilo = None
+
+    def _bucle(self):
+        while True:
+            self.recalcular_ventana()
+            if self._detener.wait(self.intervalo):
+                break
+
+    def estadisticas(self):
+        return dict(self.contadores)
+
+# =======================================================
+# CONSULTA DE REPORTES
+# =======================================================
+
+def turnos_por_dia(servicio):
+    duracion = int(servicio.get("duration") or 0)
+    if duracion <= 0:
+        return 0
+    return (HORA_CIERRE - HORA_APERTURA) * 60 // duracion
+
+
+class Reportes:
+    """Ingresos y ocupación por servicio y día, leídos de reporte_diario."""
+
+    QUERY_RANGO = declarar_sentencia("report_range", f"""
+            SELECT {_COLUMNAS}
+            FROM reporte_diario
+            WHERE dia BETWEEN %s AND %s
+            ORDER BY dia, service_id
+        """, ["date", "date"])
+    QUERY_RANGO_SERVICIOS = declarar_sentencia("report_range_services", f"""
+            SELECT {_COLUMNAS}
+            FROM reporte_diario
+            WHERE dia BETWEEN %s AND %s AND service_id = ANY(%s)
+            ORDER BY dia, service_id
+        """, ["date", "date", "text[]"])
+
+    def __init__(self, data, db_executor, catalogo):
+        self.data = data or {}
+        self.execute_query = db_executor
+        self.catalogo = catalogo          # lista de servicios (dicts del catálogo)
+
+    def consultar(self):
+        error, consulta = self._preparar()
+        if error is not None:
+            return error
+        return self._resultado(self.execute_query(*consulta, fetch_all=True))
+
+    def _preparar(self):
+        """Valida el rango y retorna (error, (query, params))."""
+        try:
+            desde = datetime.strptime(self.data.get("from") or "", "%Y-%m-%d").date()
+            hasta = datetime.strptime(self.data.get("to") or "", "%Y-%m-%d").date()
+        except ValueError:
+            return {"success": False, "message": "Parámetros from y to obligatorios (AAAA-MM-DD)."}, None
+        if hasta < desde:
+            return {"success": False, "message": "La fecha final es anterior a la inicial."}, None
+        if (hasta - desde).days + 1 > REPORTE_MAX_DIAS:
+            return {"success": False, "message": f"El rango máximo es de {REPORTE_MAX_DIAS} días."}, None
+
+        self.num_dias = (hasta - desde).days + 1
+        self.servicios = self._servicios()
+        if self.data.get("service_ids") or self.data.get("provider_id"):
+            return None, (self.QUERY_RANGO_SERVICIOS, (desde, hasta, list(self.servicios)))
+        return None, (self.QUERY_RANGO, (desde, hasta))
+
+    def _resultado(self, filas):
+        if filas is None:
+            return {"success": False, "message": "Error CRÍTICO al consultar los reportes."}
+        return {"success": True, "data": self._armar(filas, self.servicios, self.num_dias)}
+
+    def _servicios(self):
+        """Servicios del reporte: los pedidos, y solo los del proveedor si lo es."""
+        ids = set(self.data.get("service_ids") or [])
+        proveedor = self.data.get("provider_id")
+        return {
+            s["id"]: s for s in self.catalogo
+            if (not ids or s["id"] in ids) and (proveedor is None or s["providerId"] == proveedor)
+        }
+
+    def _armar(self, filas, servicios, num_dias):
+        dias = []
+        totales = {"reservas": 0, "canceladas": 0, "monto_aprobado": 0.0, "monto_pendiente": 0.0}
+        for service_id, dia, reservas, canceladas, aprobado, pendiente in filas:
+            servicio = servicios.get(service_id)
+            if servicio is None:
+                continue
+            capacidad = int(servicio.get("capacity") or 0) * turnos_por_dia(servicio)
+            activas = reservas - canceladas
+            dias.append({
+                "fecha": dia.strftime("%Y-%m-%d"),
+                "service_id": service_id,
+                "reservas": reservas,
+                "canceladas": canceladas,
+                "monto_aprobado": float(aprobado),
+                "monto_pendiente": float(pendiente),
+                "ocupacion": round(activas / capacidad, 4) if capacidad else None,
+            })
+            totales["reservas"] += reservas
+            totales["canceladas"] += canceladas
+            totales["monto_aprobado"] += float(aprobado)
+            totales["monto_pendiente"] += float(pendiente)
+
+        # Los días sin reservas cuentan para la ocupación aunque no tengan fila
+        capacidad_total = num_dias * sum(
+            int(s.get("capacity") or 0) * turnos_por_dia(s) for s in servicios.values())
+        activas_total = totales["reservas"] - totales["canceladas"]
+        totales["monto_aprobado"] = round(totales["monto_aprobado"], 2)
+        totales["monto_pendiente"] = round(totales["monto_pendiente"], 2)
+        totales["ocupacion"] = round(activas_total / capacidad_total, 4) if capacidad_total else None
+        return {"dias": dias, "totales": totales}
+
+
+def main(argv=None):
+    from configuracion_db import transaccion
+
+    ap = argparse.ArgumentParser(description="Recalcula reporte_diario desde las tablas base.")
+    ap.add_argument("--desde", required=True, help="AAAA-MM-DD")
+    ap.add_argument("--hasta", required=True, help="AAAA-MM-DD")
+    args = ap.parse_args(argv)
+
+    desde = datetime.strptime(args.desde, "%Y-%m-%d").date()
+    hasta = datetime.strptime(args.hasta, "%Y-%m-%d").date()
+    with transaccion() as uow:
+        uow(ESQUEMA_REPORTES)
+    actualizador = ActualizadorReportes(transaccion)
+    filas = actualizador.recalcular(desde, hasta) if uow.exitosa else None
+    if filas is None or actualizador.contadores["errores"]:
+        print("ERROR: no se pudo recalcular reporte_diario.")
+        return 1
+    print(f"reporte_diario recalculado: {filas} filas entre {desde} y {hasta}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import re
+
+# Registro de sentencias con nombre: cada consulta fija de logica.py se declara
+# una vez y configuracion_db la prepara (PREPARE) de forma perezosa en cada
+# conexión, ejecutándola después con EXECUTE para evitar re-parsear y re-planificar.
+
+_NOMBRE_VALIDO = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+class Sentencia:
+    __slots__ = ("nombre", "sql", "sql_prepare", "sql_execute", "sql_posicional", "num_params")
+
+    def __init__(self, nombre, sql, tipos=None):
+        self.nombre = nombre
+        self.sql = sql
+        sql_pg, self.num_params = _a_parametros_posicionales(sql)
+        # Para drivers con parámetros $n (asyncpg): los tipos declarados se aplican como casts
+        self.sql_posicional = _a_parametros_posicionales(sql, tipos)[0] if tipos else sql_pg
+        if tipos is not None and len(tipos) != self.num_params:
+            raise ValueError(f"La sentencia '{nombre}' tiene {self.num_params} parámetros y {len(tipos)} tipos.")
+        firma = f" ({', '.join(tipos)})" if tipos else ""
+        self.sql_prepare = f"PREPARE {nombre}{firma} AS {sql_pg}"
+        if self.num_params:
+            self.sql_execute = f"EXECUTE {nombre} ({', '.join(['%s'] * self.num_params)})"
+        else:
+            self.sql_execute = f"EXECUTE {nombre}"
+
+
+_por_nombre = {}
+_por_sql = {}
+
+
+def declarar_sentencia(nombre, sql, tipos=None):
+    """
+    Registra `sql` bajo `nombre` y retorna el mismo texto SQL, de modo que la
+    lógica sigue pasando SQL normal (válido para cualquier db_executor) y el
+    ejecutor real lo reconoce y usa la versión preparada.
+    """
+    if not _NOMBRE_VALIDO.match(nombre):
+        raise ValueError(f"Nombre de sentencia inválido: {nombre}")
+    existente = _por_nombre.get(nombre)
+    if existente is not None:
+        if existente.sql != sql:
+            raise ValueError(f"La sentencia '{nombre}' ya está declarada con otro SQL.")
+        return sql
+    sentencia = Sentencia(nombre, sql, tipos)
+    _por_nombre[nombre] = sentencia
+    _por_sql[sql] = sentencia
+    return sql
+
+
+def buscar_sentencia(query):
+    """Retorna la Sentencia registrada para un nombre o un texto SQL, o None."""
+    return _por_nombre.get(query) or _por_sql.get(query)
+
+
+def sql_de(query):
+    """Texto SQL de la consulta (resuelve los identificadores registrados)."""
+    sentencia = _por_nombre.get(query)
+    return sentencia.sql if sentencia is not None else query
+
+
+def sentencias_registradas():
+    return dict(_por_nombre)
+
+
+_posicionales_cache = {}
+
+
+def sql_posicional(query):
+    """SQL con parámetros $1, $2... para `query` (nombre o texto), memorizado."""
+    sentencia = buscar_sentencia(query)
+    if sentencia is not None:
+        return sentencia.sql_posicional
+    sql = _posicionales_cache.get(query)
+    if sql is None:
+        sql = _a_parametros_posicionales(query)[0]
+        if len(_posicionales_cache) < 10000:
+            _posicionales_cache[query] = sql
+    return sql
+
+
+def _a_parametros_posicionales(sql, tipos=None):
+    """
+    Convierte los %s de psycopg2 en $1, $2... (respetando los %% literales).
+    Con `tipos`, cada parámetro se escribe como $n::tipo.
+    """
+    contador = [0]
+
+    def reemplazar(m):
+        if m.group(0) == "%%":
+            return "%"
+        contador[0] += 1
+        if tipos:
+            return f"${contador[0]}::{tipos[contador[0] - 1]}"
+        return f"${contador[0]}"
+
+    return re.sub(r"%%|%s", reemplazar, sql), contador[0]
@@ -1,34 +1,195 @@
 # -*- coding: utf-8 -*- 
-from flask import Flask, request, jsonify, render_template 
+from flask import Flask, Blueprint, request, jsonify, render_template, Response, stream_with_context, g
 from flask_cors import CORS
 
 # Importamos la configuración y funciones auxiliares de BD
-from configuracion_db import execute_query 
+from configuracion_db import execute_query, execute_atomic, stream_query, transaccion, iniciar_contexto_lecturas, conectar_db
+from configuracion_db import marca_de_escritura, LECTURA_PROPIA_CABECERA, LECTURA_PROPIA_COOKIE, LECTURA_PROPIA_COOKIE_TTL
+from configuracion_db import obtener_pool, obtener_enrutador, cerrar_conexiones, PoolAgotadoError, StreamFallido
 # Importamos las clases de lógica de negocio (de logica.py)
-from logica import Login, Usuario, HistorialReservas, Pago, Servicio, Reserva 
+from logica import Login, Usuario, HistorialReservas, Pago, Servicio, Reserva, ReservaConPago 
+from cache_catalogo import etag_coincide, cache_catalogo
+from disponibilidad import Disponibilidad
+from reportes import Reportes, ActualizadorReportes
+from cambios import DifusorCambios, formatear_evento, CAMBIOS_LIMITE_MAX
+from importacion import ImportadorServicios, ImportadorReservas
+from notificaciones import cola_notificaciones
+from metricas import registro, observar_peticion, observar_rechazo
+from idempotencia import registro_idempotencia, validar_clave, huella_solicitud
+from admision import limitador_tasa, control_admision, reintentar_en, RUTAS_SIN_ADMISION, ADMISION_REINTENTO
+from sesiones import almacen_sesiones, token_de_cabecera
+from liquidacion import liquidador_pagos
 
 import psycopg2 
+import csv
+import io
+import json
 import re
+import time
 import uuid
+from functools import wraps
 
 # --- CONFIGURACIÓN DE FLASK ---
-app = Flask(__name__)
-CORS(app) 
+# Las rutas y los hooks van en un blueprint; create_app() (al final) arma la aplicación
+api = Blueprint('api', __name__)
+
+# Recálculo periódico de reporte_diario (se arranca con la primera consulta de reportes)
+actualizador_reportes = ActualizadorReportes(transaccion)
+# Cambios del historial en vivo: una escucha (LISTEN) y una consulta por ráfaga para todos los clientes SSE
+difusor_cambios = DifusorCambios(
+    lambda cursor: HistorialReservas({'is_manager': True}, execute_query).obtener_cambios(cursor, CAMBIOS_LIMITE_MAX),
+    conectar_db)
+
+# =======================================================
+# INSTRUMENTACIÓN (LATENCIA Y ERRORES POR RUTA)
+# =======================================================
+
+@api.before_app_request
+def iniciar_cronometro():
+    g.inicio_peticion = time.perf_counter()
+    # "Leer lo propio": la marca de la última escritura del cliente elige réplicas al día
+    iniciar_contexto_lecturas(request.headers.get(LECTURA_PROPIA_CABECERA), request.cookies.get(LECTURA_PROPIA_COOKIE))
+
+
+@api.after_app_request
+def registrar_metricas(response):
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is not None:
+        # Se etiqueta con la regla (/api/history/<user_id>/<role>) para acotar la cardinalidad
+        ruta = request.url_rule.rule if request.url_rule is not None else "sin_ruta"
+        observar_peticion(ruta, request.method, response.status_code, time.perf_counter() - inicio)
+    lsn = marca_de_escritura()
+    if lsn is not None:
+        response.headers[LECTURA_PROPIA_CABECERA] = lsn
+        response.set_cookie(LECTURA_PROPIA_COOKIE, lsn, max_age=LECTURA_PROPIA_COOKIE_TTL, httponly=True, samesite='Lax')
+    return response
+
+# =======================================================
+# CONTROL DE ADMISIÓN (429 / 503)
+# =======================================================
+
+@api.before_app_request
+def admitir_peticion():
+    """
+    Primero el límite por usuario (o IP) de la ruta y luego el cupo global de
+    peticiones en curso; si no hay cupo se responde al instante con
+    Retry-After en lugar de esperar una conexión del pool.
+    """
+    ruta = request.url_rule.rule if request.url_rule is not None else None
+    if ruta is None or ruta in RUTAS_SIN_ADMISION:
+        return None
+
+    sesion = almacen_sesiones.obtener(token_de_cabecera(request.headers.get('Authorization')))
+    clave = sesion['userId'] if sesion is not None else request.remote_addr
+    espera = limitador_tasa.consumir(ruta, clave)
+    if espera:
+        observar_rechazo(ruta, "rate_limit")
+        respuesta = jsonify({"message": "Demasiadas solicitudes. Intente nuevamente en unos segundos."})
+        return respuesta, 429, {"Retry-After": reintentar_en(espera)}
+
+    if not control_admision.entrar():
+        observar_rechazo(ruta, "overload")
+        respuesta = jsonify({"message": "Servicio saturado. Intente nuevamente en unos segundos."})
+        return respuesta, 503, {"Retry-After": str(ADMISION_REINTENTO)}
+    g.admitida = True
+    return None
+
+
+@api.teardown_app_request
+def liberar_admision(error=None):
+    # teardown corre aunque la vista lance una excepción: el cupo siempre se devuelve
+    if g.pop('admitida', False):
+        control_admision.salir()
+
+
+def metricas_aplicacion():
+    muestras = [(f"catalog_cache_{clave}", (), valor) for clave, valor in sorted(cache_catalogo.estadisticas().items())]
+    muestras += [(f"email_outbox_{clave}", (), valor) for clave, valor in sorted(cola_notificaciones.estadisticas().items())]
+    muestras += [(f"session_store_{clave}", (), valor) for clave, valor in sorted(almacen_sesiones.estadisticas().items())]
+    muestras += [(f"reports_refresh_{clave}", (), valor) for clave, valor in sorted(actualizador_reportes.estadisticas().items())]
+    muestras += [(f"history_sse_{clave}", (), valor) for clave, valor in sorted(difusor_cambios.estadisticas().items())]
+    muestras += [(f"admission_{clave}", (), valor) for clave, valor in sorted(control_admision.estadisticas().items())]
+    muestras += [(f"rate_limiter_{clave}", (), valor) for clave, valor in sorted(limitador_tasa.estadisticas().items())]
+    muestras += [(f"idempotency_{clave}", (), valor) for clave, valor in sorted(registro_idempotencia.estadisticas().items())]
+    muestras += [(f"payment_settlement_{clave}", (), valor) for clave, valor in sorted(liquidador_pagos.estadisticas().items())]
+    return muestras
+
+registro.registrar_colector(metricas_aplicacion)
+
+
+@api.route('/metrics', methods=['GET'])
+def export_metrics():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    return Response(registro.exportar(), mimetype="text/plain; version=0.0.4")
 
 # =======================================================
 # ENDPOINT PRINCIPAL (SIRVE EL HTML)
 # =======================================================
-@app.route("/")
+@api.route("/")
 def serve_frontend():
     """Sirve el archivo index.html cuando se accede a la raíz del servidor."""
     # NOTA: index.html debe estar en la carpeta 'templates'
     return render_template("index.html")
 
+# =======================================================
+# SESIONES
+# =======================================================
+
+def requiere_sesion(funcion):
+    """
+    Resuelve el token 'Authorization: Bearer' a la sesión en memoria (sin
+    consultar la BD) y la deja en g.sesion; responde 401 si no es válida.
+    """
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        token = token_de_cabecera(request.headers.get('Authorization'))
+        sesion = almacen_sesiones.obtener(token)
+        if sesion is None:
+            return jsonify({"message": "Sesión inválida o expirada."}), 401
+        g.token = token
+        g.sesion = sesion
+        return funcion(*args, **kwargs)
+    return envoltura
+
+# =======================================================
+# IDEMPOTENCIA (cabecera Idempotency-Key)
+# =======================================================
+
+def responder_idempotente(clave, data, operacion, codigo_exito, mensaje_error):
+    """
+    Ejecuta `operacion(uow) -> (result, efectos)` una sola vez por clave. Un
+    reintento con la misma clave recibe la respuesta original (cabecera
+    Idempotent-Replayed) y un duplicado concurrente espera al primero.
+    """
+    error = validar_clave(clave)
+    if error is not None:
+        return jsonify({"message": error}), 400
+
+    # La clave es del cliente: se acota a la ruta y al usuario de la sesión (si hay)
+    sesion = almacen_sesiones.obtener(token_de_cabecera(request.headers.get('Authorization')))
+    ambito = f"{request.url_rule.rule}|{sesion['userId'] if sesion is not None else ''}"
+
+    def ejecutar(uow):
+        result, efectos = operacion(uow)
+        if result.get("success", False):
+            return codigo_exito, result, efectos
+        return 400, {"message": result.get("message", mensaje_error)}, None
+
+    codigo, cuerpo, repetida = registro_idempotencia.ejecutar(
+        transaccion, ambito, clave, huella_solicitud(data), ejecutar)
+    headers = {}
+    if repetida:
+        headers["Idempotent-Replayed"] = "true"
+    if codigo == 409:
+        headers["Retry-After"] = "1"
+    return jsonify(cuerpo), codigo, headers
+
+
 # =======================================================
 # ENDPOINTS DE AUTENTICACIÓN
 # =======================================================
 
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def handle_register():
     """Endpoint para registrar un nuevo usuario (Cliente)."""
     data = request.json
@@ -42,7 +203,7 @@ def handle_register():
         return jsonify({"message": result.get("message", "Error de registro desconocido.")}), 400
 
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def handle_login():
     """Endpoint para el inicio de sesión."""
     data = request.json
@@ -54,26 +215,69 @@ def handle_login():
         is_admin = result.get('isAdmin', False)
         is_provider = result.get('isProvider', False)
         result['destinationView'] = 'admin' if is_admin else ('provider_panel' if is_provider else 'services')
+        result['token'] = almacen_sesiones.crear(result['userId'], result['role'], email=result['email'], username=result['username'])
         return jsonify(result), 200
     else:
         return jsonify(result), 401
 
+
+@api.route('/api/logout', methods=['POST'])
+@requiere_sesion
+def handle_logout():
+    """Revoca el token de la sesión actual."""
+    almacen_sesiones.revocar([g.token])
+    return jsonify({"success": True, "message": "Sesión cerrada."}), 200
+
+
+@api.route('/api/sessions/revoke', methods=['POST'])
+@requiere_sesion
+def revoke_sessions():
+    """Revocación masiva (solo Administrador): {"userIds": [...]} o {"all": true}."""
+    if g.sesion['role'] != 'Administrador':
+        return jsonify({"message": "No autorizado."}), 403
+
+    data = request.json or {}
+    if data.get('all'):
+        almacen_sesiones.revocar_todas()
+    else:
+        almacen_sesiones.revocar_usuarios(data.get('userIds') or [])
+    return jsonify({"success": True, "message": "Sesiones revocadas."}), 200
+
 # =======================================================
 # ENDPOINTS DE SERVICIOS (CRUD)
 # =======================================================
 
-@app.route('/api/services', methods=['GET'])
+@api.route('/api/services', methods=['GET'])
 def get_all_services():
-    """Endpoint para obtener todo el catálogo de servicios."""
+    """Endpoint para obtener todo el catálogo de servicios (con ETag/304)."""
     service_logic = Servicio(None, execute_query) 
-    result = service_logic.obtener_todos()
-    
+    cuerpo, etag = service_logic.obtener_catalogo_serializado()
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    if etag_coincide(request.headers.get("If-None-Match"), etag):
+        return Response(status=304, headers=headers)
+    return Response(cuerpo, status=200, mimetype="application/json", headers=headers)
+
+@api.route('/api/services/search', methods=['GET'])
+def search_services():
+    """
+    Búsqueda y filtrado del catálogo desde el índice en memoria.
+    Parámetros: q, category, modality, min_price, max_price, min_duration,
+    max_duration, sort (name|price|duration, '-' para descendente), page y limit.
+    """
+    result = Servicio(None, execute_query).buscar(request.args)
+
     if result.get("success", False):
-        return jsonify(result["data"]), 200
+        return jsonify({
+            "data": result["data"],
+            "total": result["total"],
+            "page": result["page"],
+            "limit": result["limit"],
+        }), 200
     else:
-        return jsonify({"message": result.get("message", "Error interno al cargar servicios.")}), 400
+        return jsonify({"message": result.get("message", "Error al buscar servicios.")}), 400
 
-@app.route('/api/service', methods=['POST'])
+@api.route('/api/service', methods=['POST'])
 def create_service():
     """Endpoint para que el Admin/Proveedor cree un nuevo servicio."""
     data = request.json
@@ -86,16 +290,69 @@ def create_service():
         return jsonify({"message": result.get("message", "Error al crear servicio.")}), 400
 
 
+# =======================================================
+# ENDPOINTS DE CARGA MASIVA
+# =======================================================
+
+def leer_filas_importacion():
+    """Filas del cuerpo: arreglo JSON, o CSV con cabecera leído en streaming."""
+    if request.mimetype == 'text/csv':
+        return csv.DictReader(io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline=''))
+    data = request.get_json(silent=True)
+    return data if isinstance(data, list) else None
+
+
+def responder_importacion(importador_cls):
+    filas = leer_filas_importacion()
+    if filas is None:
+        return jsonify({"message": "Se esperaba un arreglo JSON o un CSV (text/csv)."}), 400
+
+    result = importador_cls(filas, transaccion).importar()
+    if result.get("success", False):
+        return jsonify(result), 201 if result["insertados"] else 200
+    else:
+        return jsonify(result), 400
+
+
+@api.route('/api/services/import', methods=['POST'])
+def import_services():
+    """Carga masiva de servicios (JSON o CSV)."""
+    return responder_importacion(ImportadorServicios)
+
+
+@api.route('/api/reservations/import', methods=['POST'])
+def import_reservations():
+    """Carga masiva de reservas para migrar agendas (JSON o CSV)."""
+    return responder_importacion(ImportadorReservas)
+
+
 # =======================================================
 # ENDPOINTS DE RESERVAS Y PAGOS
 # =======================================================
 
-@app.route('/api/reservation', methods=['POST'])
+@api.route('/api/reservation', methods=['POST'])
 def create_reservation():
-    """Endpoint para que el Cliente cree una nueva reserva."""
+    """
+    Endpoint para que el Cliente cree una nueva reserva.
+    Si el cuerpo incluye "pago": {"metodo", "monto"}, la reserva y el pago
+    se guardan juntos en una sola transacción.
+    """
     data = request.json
-    reserva_logic = Reserva(data, execute_query)
-    result = reserva_logic.crear_reserva()
+    clave = request.headers.get('Idempotency-Key')
+    if clave is not None:
+        def operacion(uow):
+            if data.get('pago'):
+                logica_reserva = ReservaConPago(data, transaccion)
+                return logica_reserva.insertar(uow), logica_reserva.confirmar_efectos
+            logica_reserva = Reserva(data, uow, uow.execute_atomic)
+            return logica_reserva.insertar(), logica_reserva.confirmar_efectos
+        return responder_idempotente(clave, data, operacion, 201, "Error al crear reserva.")
+
+    if data.get('pago'):
+        result = ReservaConPago(data, transaccion).procesar()
+    else:
+        reserva_logic = Reserva(data, execute_query, execute_atomic)
+        result = reserva_logic.crear_reserva()
 
     if result.get("success", False):
         return jsonify(result), 201
@@ -103,19 +360,82 @@ def create_reservation():
         return jsonify({"message": result.get("message", "Error al crear reserva.")}), 400
 
 
+@api.route('/api/availability', methods=['GET'])
+def get_availability():
+    """
+    Turnos libres de uno o varios servicios en un rango de fechas.
+    Parámetros: service_ids=a,b,c (opcional, todos por defecto), from y to (AAAA-MM-DD).
+    """
+    ids = [i for i in request.args.get('service_ids', '').split(',') if i]
+    data = {
+        'service_ids': ids,
+        'from': request.args.get('from'),
+        'to': request.args.get('to'),
+    }
+    catalogo = Servicio(None, execute_query).obtener_todos()["data"]
+    availability_logic = Disponibilidad(data, execute_query, catalogo)
+    result = availability_logic.consultar()
+
+    if result.get("success", False):
+        return jsonify(result["data"]), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al consultar disponibilidad.")}), 400
+
+
 # ENDPOINT DE HISTORIAL (AJUSTADO PARA RECIBIR STATUS DEL MANAGER)
-@app.route('/api/history/<string:user_id>/<string:role>', methods=['GET'])
+@api.route('/api/history/<string:user_id>/<string:role>', methods=['GET'])
+@requiere_sesion
 def get_user_history(user_id, role):
-    """Endpoint para obtener el historial, filtrado por usuario o todos si es manager."""
+    """
+    Endpoint para obtener el historial, filtrado por usuario o todos si es manager.
+    El usuario y el rol se toman de la sesión, no de la URL.
+    Acepta ?limit=&cursor= para paginar y ?stream=ndjson para descarga en streaming.
+    """
     
-    is_manager = role in ['Administrador', 'Proveedor']
+    is_manager = g.sesion['role'] in ['Administrador', 'Proveedor']
+    if not is_manager and user_id != g.sesion['userId']:
+        return jsonify({"message": "No autorizado para ver el historial de otro usuario."}), 403
     
     data_payload = {
-        'usuario_id': user_id,
+        'usuario_id': g.sesion['userId'],
         'is_manager': is_manager
     }
     
-    history_logic = HistorialReservas(data_payload, execute_query)
+    history_logic = HistorialReservas(data_payload, execute_query, stream_query)
+
+    # Modo streaming: NDJSON fila a fila con cursor del lado del servidor
+    if request.args.get('stream') == 'ndjson':
+        # La conexión y el DECLARE se abren antes de responder: sus errores son 503/500
+        try:
+            reservas = history_logic.iterar_historial()
+        except PoolAgotadoError:
+            respuesta = jsonify({"message": "Servicio saturado. Intente nuevamente en unos segundos."})
+            return respuesta, 503, {"Retry-After": str(ADMISION_REINTENTO)}
+        except StreamFallido:
+            return jsonify({"message": "Error CRÍTICO al cargar historial."}), 500
+
+        def generar():
+            try:
+                for reserva in reservas:
+                    yield json.dumps(reserva, ensure_ascii=False) + "\n"
+            except StreamFallido:
+                # Última línea explícita y respuesta cortada (sin el chunk final):
+                # el cliente no confunde una descarga fallida con una completa
+                yield json.dumps({"error": "Descarga interrumpida por un error de la base de datos."}) + "\n"
+                raise
+        return Response(stream_with_context(generar()), mimetype="application/x-ndjson")
+
+    # Modo paginado (keyset): se activa al enviar ?limit= o ?cursor=
+    if 'limit' in request.args or 'cursor' in request.args:
+        result = history_logic.obtener_pagina(request.args.get('limit'), request.args.get('cursor'))
+        if result.get("success", False):
+            return jsonify({
+                "data": result["data"],
+                "page_size": result["page_size"],
+                "next_cursor": result["next_cursor"],
+            }), 200
+        return jsonify({"message": result.get("message", "Error al cargar historial.")}), 400
+
     result = history_logic.obtener_historial()
 
     if result.get("success", False):
@@ -124,10 +444,76 @@ def get_user_history(user_id, role):
         return jsonify({"message": result.get("message", "Error al cargar historial.")}), 400
 
 
-@app.route('/api/process_payment', methods=['POST'])
+@api.route('/api/history/changes', methods=['GET'])
+@requiere_sesion
+def get_history_changes():
+    """
+    Reservas nuevas o modificadas (incluido su pago) desde ?since=<cursor>.
+    Sin since solo retorna el cursor actual. Las filas pueden repetirse entre
+    llamadas: el cliente las aplica por id_reserva.
+    """
+    data_payload = {
+        'usuario_id': g.sesion['userId'],
+        'is_manager': g.sesion['role'] in ['Administrador', 'Proveedor']
+    }
+    history_logic = HistorialReservas(data_payload, execute_query)
+    result = history_logic.obtener_cambios(request.args.get('since'), request.args.get('limit'))
+
+    if result.get("success", False):
+        return jsonify({
+            "data": result["data"],
+            "cursor": result["cursor"],
+            "has_more": result["hay_mas"],
+        }), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al consultar cambios.")}), 400
+
+
+@api.route('/api/history/stream', methods=['GET'])
+@requiere_sesion
+def stream_history_changes():
+    """
+    Server-Sent Events con las reservas nuevas o modificadas. Al reconectar
+    (Last-Event-ID o ?since=) primero se envía lo pendiente desde ese cursor.
+    """
+    is_manager = g.sesion['role'] in ['Administrador', 'Proveedor']
+    data_payload = {'usuario_id': g.sesion['userId'], 'is_manager': is_manager}
+    desde = request.headers.get('Last-Event-ID') or request.args.get('since')
+    history_logic = HistorialReservas(data_payload, execute_query)
+    suscripcion = difusor_cambios.suscribir(None if is_manager else g.sesion['userId'])
+
+    def generar():
+        try:
+            cursor = desde
+            while cursor:
+                result = history_logic.obtener_cambios(cursor, CAMBIOS_LIMITE_MAX)
+                if not result.get("success", False):
+                    break
+                if result["data"]:
+                    yield formatear_evento(result["cursor"], result["data"])
+                cursor = result["cursor"] if result["hay_mas"] else None
+
+            # Si el cliente no consume a tiempo se corta; al reconectar se pone al día
+            while not suscripcion.desbordada:
+                evento = suscripcion.esperar()
+                yield ": ping\n\n" if evento is None else formatear_evento(*evento)
+        finally:
+            difusor_cambios.cancelar(suscripcion)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generar()), mimetype="text/event-stream", headers=headers)
+
+
+@api.route('/api/process_payment', methods=['POST'])
 def process_reservation_payment():
-    """Simulación de procesamiento de pago para una reserva."""
+    """Simulación de procesamiento de pago para una reserva (admite Idempotency-Key)."""
     data = request.json
+    clave = request.headers.get('Idempotency-Key')
+    if clave is not None:
+        def operacion(uow):
+            logica_pago = Pago(data, uow)
+            return logica_pago.insertar(), logica_pago.confirmar_efectos
+        return responder_idempotente(clave, data, operacion, 200, "Error al procesar el pago.")
     
     payment_logic = Pago(data, execute_query)
     result = payment_logic.procesar_pago()
@@ -138,6 +524,104 @@ def process_reservation_payment():
         return jsonify({"message": result.get("message", "Error al procesar el pago.")}), 400
 
 
+@api.route('/api/payment/<string:pago_id>', methods=['GET'])
+@requiere_sesion
+def get_payment(pago_id):
+    """
+    Estado de un pago: PENDIENTE hasta que la liquidación lo marca APROBADO o
+    RECHAZADO. Solo el dueño de la reserva, o un Administrador o Proveedor.
+    """
+    is_manager = g.sesion['role'] in ['Administrador', 'Proveedor']
+    result = Pago({}, execute_query).consultar(pago_id, g.sesion['userId'], is_manager)
+
+    if result.get("success", False):
+        return jsonify(result), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al consultar el pago.")}), 404
+
+
+# =======================================================
+# ENDPOINTS DE REPORTES
+# =======================================================
+
+@api.route('/api/reports', methods=['GET'])
+@requiere_sesion
+def get_reports():
+    """
+    Ingresos y ocupación por servicio y día desde los agregados de reporte_diario.
+    Parámetros: from y to (AAAA-MM-DD), service_ids=a,b,c (opcional).
+    Solo Administrador y Proveedor; el proveedor solo ve sus servicios.
+    """
+    rol = g.sesion['role']
+    if rol not in ['Administrador', 'Proveedor']:
+        return jsonify({"message": "No autorizado."}), 403
+
+    actualizador_reportes.iniciar()
+    data = {
+        'from': request.args.get('from'),
+        'to': request.args.get('to'),
+        'service_ids': [i for i in request.args.get('service_ids', '').split(',') if i],
+        'provider_id': g.sesion['userId'] if rol == 'Proveedor' else None,
+    }
+    catalogo = Servicio(None, execute_query).obtener_todos()["data"]
+    result = Reportes(data, execute_query, catalogo).consultar()
+
+    if result.get("success", False):
+        return jsonify(result["data"]), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al consultar reportes.")}), 400
+
+
+# =======================================================
+# FÁBRICA DE LA APLICACIÓN Y CICLO DE VIDA DEL WORKER
+# =======================================================
+
+def create_app(config=None):
+    """
+    Crea la aplicación Flask con todas las rutas. No abre conexiones ni
+    arranca hilos (el pool, las réplicas, las cachés y los hilos en segundo
+    plano se crean en el primer uso o en calentar()), así que el maestro de
+    lanzador.py puede llamarla antes del fork. `config` se aplica sobre app.config.
+    """
+    app = Flask(__name__)
+    app.config.update(config or {})
+    CORS(app, expose_headers=[LECTURA_PROPIA_CABECERA])
+    app.register_blueprint(api)
+    return app
+
+
+def calentar(conexiones=True):
+    """
+    Prepara el worker antes de aceptar tráfico: abre el mínimo del pool,
+    arranca el enrutador de réplicas y carga el catálogo en la caché.
+    Retorna los segundos empleados.
+    """
+    inicio = time.perf_counter()
+    if conexiones:
+        obtener_pool().llenar()
+        obtener_enrutador()
+    Servicio(None, execute_query).obtener_catalogo_serializado()
+    return time.perf_counter() - inicio
+
+
+def apagar(timeout=5.0):
+    """
+    Al terminar el worker, ya drenadas las peticiones: liquida los pagos
+    encolados, envía los correos pendientes, detiene los hilos en segundo
+    plano y cierra las conexiones.
+    """
+    liquidador_pagos.detener()
+    cola_notificaciones.detener(timeout)
+    actualizador_reportes.detener()
+    difusor_cambios.detener()
+    cerrar_conexiones()
+
+
+# Aplicación por defecto: python server.py, flask run y el test_client del benchmark
+app = create_app()
+
+
 if __name__ == '__main__':
     print("Servidor Flask corriendo en http://0.0.0.0:5000/ (Accesible en la red local)")
+    print("En producción: python lanzador.py --workers 4")
     app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
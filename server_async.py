@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*- 
+# Modo de servicio asíncrono (ASGI) con las mismas rutas que server.py.
+# Cada petición en espera de PostgreSQL no ocupa un hilo: un solo proceso
+# atiende miles de peticiones concurrentes de catálogo/historial.
+#
+#   hypercorn server_async:app --bind 0.0.0.0:5000
+from quart import Quart, request, jsonify, render_template, Response, g
+from quart.utils import run_sync
+from quart_cors import cors
+
+# Configuración y ejecución de consultas asíncronas (asyncpg)
+from configuracion_db_async import (
+    execute_query_async, execute_atomic_async, stream_query_async, transaccion_async, cerrar_pool_async,
+    obtener_pool_async, marca_de_escritura_async, ASYNC_POOL_MAX_SIZE,
+)
+# La carga masiva se ejecuta en un hilo sobre el pool síncrono
+from configuracion_db import transaccion, PoolAgotadoError, StreamFallido, iniciar_contexto_lecturas
+from configuracion_db import LECTURA_PROPIA_CABECERA, LECTURA_PROPIA_COOKIE, LECTURA_PROPIA_COOKIE_TTL
+from logica_async import (
+    LoginAsync, UsuarioAsync, ServicioAsync, HistorialReservasAsync, ReservaAsync, PagoAsync,
+    ReservaConPagoAsync, DisponibilidadAsync, ReportesAsync,
+)
+from reportes import ActualizadorReportes
+from cache_catalogo import etag_coincide
+from importacion import ImportadorServicios, ImportadorReservas
+from metricas import registro, observar_peticion, observar_rechazo
+from admision import ControlAdmision, limitador_tasa, reintentar_en, RUTAS_SIN_ADMISION, ADMISION_REINTENTO
+from idempotencia import registro_idempotencia, validar_clave, huella_solicitud
+from sesiones import almacen_sesiones, token_de_cabecera
+
+import csv
+import io
+import json
+import time
+from functools import wraps
+
+# --- CONFIGURACIÓN DE QUART ---
+app = cors(Quart(__name__), allow_origin="*", expose_headers=[LECTURA_PROPIA_CABECERA])
+
+# El recálculo de reportes corre en su propio hilo sobre el pool síncrono
+actualizador_reportes = ActualizadorReportes(transaccion)
+# Mismo control que server.py, con el cupo ligado a las conexiones de asyncpg
+control_admision = ControlAdmision(max_en_curso=ASYNC_POOL_MAX_SIZE, cola=ASYNC_POOL_MAX_SIZE)
+
+
+@app.before_serving
+async def iniciar_pool():
+    await obtener_pool_async()
+
+
+@app.after_serving
+async def cerrar_pool():
+    await cerrar_pool_async()
+
+# =======================================================
+# INSTRUMENTACIÓN (LATENCIA Y ERRORES POR RUTA)
+# =======================================================
+
+@app.before_request
+async def iniciar_cronometro():
+    g.inicio_peticion = time.perf_counter()
+    # "Leer lo propio": aquí todo se lee de la primaria, pero las escrituras
+    # se marcan para las lecturas del cliente en los workers con réplicas
+    iniciar_contexto_lecturas(request.headers.get(LECTURA_PROPIA_CABECERA), request.cookies.get(LECTURA_PROPIA_COOKIE))
+
+
+@app.after_request
+async def registrar_metricas(response):
+    inicio = getattr(g, 'inicio_peticion', None)
+    if inicio is not None:
+        ruta = request.url_rule.rule if request.url_rule is not None else "sin_ruta"
+        observar_peticion(ruta, request.method, response.status_code, time.perf_counter() - inicio)
+    lsn = await marca_de_escritura_async()
+    if lsn is not None:
+        response.headers[LECTURA_PROPIA_CABECERA] = lsn
+        response.set_cookie(LECTURA_PROPIA_COOKIE, lsn, max_age=LECTURA_PROPIA_COOKIE_TTL, httponly=True, samesite='Lax')
+    return response
+
+# =======================================================
+# CONTROL DE ADMISIÓN (429 / 503)
+# =======================================================
+
+@app.before_request
+async def admitir_peticion():
+    """
+    Igual que en server.py: límite por usuario (o IP) y luego el cupo global
+    de peticiones en curso. Solo la espera en la cola sale a un hilo, para no
+    bloquear el event loop.
+    """
+    ruta = request.url_rule.rule if request.url_rule is not None else None
+    if ruta is None or ruta in RUTAS_SIN_ADMISION:
+        return None
+
+    sesion = almacen_sesiones.obtener(token_de_cabecera(request.headers.get('Authorization')))
+    clave = sesion['userId'] if sesion is not None else request.remote_addr
+    espera = limitador_tasa.consumir(ruta, clave)
+    if espera:
+        observar_rechazo(ruta, "rate_limit")
+        respuesta = jsonify({"message": "Demasiadas solicitudes. Intente nuevamente en unos segundos."})
+        return respuesta, 429, {"Retry-After": reintentar_en(espera)}
+
+    if not control_admision.intentar() and not await run_sync(control_admision.entrar)():
+        observar_rechazo(ruta, "overload")
+        respuesta = jsonify({"message": "Servicio saturado. Intente nuevamente en unos segundos."})
+        return respuesta, 503, {"Retry-After": str(ADMISION_REINTENTO)}
+    g.admitida = True
+    return None
+
+
+@app.teardown_request
+async def liberar_admision(error=None):
+    # teardown corre aunque la vista lance una excepción: el cupo siempre se devuelve
+    if g.pop('admitida', False):
+        control_admision.salir()
+
+
+@app.route('/metrics', methods=['GET'])
+async def export_metrics():
+    """Métricas del proceso en formato de texto de Prometheus."""
+    return Response(registro.exportar(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/")
+async def serve_frontend():
+    """Sirve el archivo index.html cuando se accede a la raíz del servidor."""
+    return await render_template("index.html")
+
+# =======================================================
+# SESIONES
+# =======================================================
+
+def requiere_sesion(funcion):
+    """Igual que en server.py: resuelve el token Bearer a g.sesion o responde 401."""
+    @wraps(funcion)
+    async def envoltura(*args, **kwargs):
+        token = token_de_cabecera(request.headers.get('Authorization'))
+        sesion = almacen_sesiones.obtener(token)
+        if sesion is None:
+            return jsonify({"message": "Sesión inválida o expirada."}), 401
+        g.token = token
+        g.sesion = sesion
+        return await funcion(*args, **kwargs)
+    return envoltura
+
+# =======================================================
+# IDEMPOTENCIA (cabecera Idempotency-Key)
+# =======================================================
+
+async def responder_idempotente(clave, data, operacion, codigo_exito, mensaje_error):
+    """Igual que en server.py, con `operacion` asíncrona y transaccion_async."""
+    error = validar_clave(clave)
+    if error is not None:
+        return jsonify({"message": error}), 400
+
+    sesion = almacen_sesiones.obtener(token_de_cabecera(request.headers.get('Authorization')))
+    ambito = f"{request.url_rule.rule}|{sesion['userId'] if sesion is not None else ''}"
+
+    async def ejecutar(uow):
+        result, efectos = await operacion(uow)
+        if result.get("success", False):
+            return codigo_exito, result, efectos
+        return 400, {"message": result.get("message", mensaje_error)}, None
+
+    codigo, cuerpo, repetida = await registro_idempotencia.ejecutar_async(
+        transaccion_async, ambito, clave, huella_solicitud(data), ejecutar)
+    headers = {}
+    if repetida:
+        headers["Idempotent-Replayed"] = "true"
+    if codigo == 409:
+        headers["Retry-After"] = "1"
+    return jsonify(cuerpo), codigo, headers
+
+# =======================================================
+# ENDPOINTS DE AUTENTICACIÓN
+# =======================================================
+
+@app.route('/api/register', methods=['POST'])
+async def handle_register():
+    data = await request.get_json()
+    result = await UsuarioAsync(data, execute_query_async).registrar()
+
+    if result.get("success", False):
+        return jsonify(result), 201
+    else:
+        return jsonify({"message": result.get("message", "Error de registro desconocido.")}), 400
+
+
+@app.route('/api/login', methods=['POST'])
+async def handle_login():
+    data = await request.get_json()
+    result = await LoginAsync(data.get('email'), data.get('password'), execute_query_async).autenticar()
+
+    if result.get("success", False):
+        is_admin = result.get('isAdmin', False)
+        is_provider = result.get('isProvider', False)
+        result['destinationView'] = 'admin' if is_admin else ('provider_panel' if is_provider else 'services')
+        result['token'] = almacen_sesiones.crear(result['userId'], result['role'], email=result['email'], username=result['username'])
+        return jsonify(result), 200
+    else:
+        return jsonify(result), 401
+
+
+@app.route('/api/logout', methods=['POST'])
+@requiere_sesion
+async def handle_logout():
+    almacen_sesiones.revocar([g.token])
+    return jsonify({"success": True, "message": "Sesión cerrada."}), 200
+
+
+@app.route('/api/sessions/revoke', methods=['POST'])
+@requiere_sesion
+async def revoke_sessions():
+    if g.sesion['role'] != 'Administrador':
+        return jsonify({"message": "No autorizado."}), 403
+
+    data = await request.get_json() or {}
+    if data.get('all'):
+        almacen_sesiones.revocar_todas()
+    else:
+        almacen_sesiones.revocar_usuarios(data.get('userIds') or [])
+    return jsonify({"success": True, "message": "Sesiones revocadas."}), 200
+
+# =======================================================
+# ENDPOINTS DE SERVICIOS (CRUD)
+# =======================================================
+
+@app.route('/api/services', methods=['GET'])
+async def get_all_services():
+    cuerpo, etag = await ServicioAsync(None, execute_query_async).obtener_catalogo_serializado()
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    if etag_coincide(request.headers.get("If-None-Match"), etag):
+        return Response("", status=304, headers=headers)
+    return Response(cuerpo, status=200, mimetype="application/json", headers=headers)
+
+
+@app.route('/api/services/search', methods=['GET'])
+async def search_services():
+    result = await ServicioAsync(None, execute_query_async).buscar(request.args)
+
+    if result.get("success", False):
+        return jsonify({
+            "data": result["data"],
+            "total": result["total"],
+            "page": result["page"],
+            "limit": result["limit"],
+        }), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al buscar servicios.")}), 400
+
+
+@app.route('/api/service', methods=['POST'])
+async def create_service():
+    data = await request.get_json()
+    result = await ServicioAsync(data, execute_query_async).crear()
+
+    if result.get("success", False):
+        return jsonify(result), 201
+    else:
+        return jsonify({"message": result.get("message", "Error al crear servicio.")}), 400
+
+# =======================================================
+# ENDPOINTS DE CARGA MASIVA
+# =======================================================
+
+async def responder_importacion(importador_cls):
+    if request.mimetype == 'text/csv':
+        cuerpo = await request.get_data(as_text=True)
+        filas = csv.DictReader(io.StringIO(cuerpo.lstrip("\ufeff"), newline=''))
+    else:
+        data = await request.get_json(silent=True)
+        filas = data if isinstance(data, list) else None
+    if filas is None:
+        return jsonify({"message": "Se esperaba un arreglo JSON o un CSV (text/csv)."}), 400
+
+    result = await run_sync(importador_cls(filas, transaccion).importar)()
+    if result.get("success", False):
+        return jsonify(result), 201 if result["insertados"] else 200
+    else:
+        return jsonify(result), 400
+
+
+@app.route('/api/services/import', methods=['POST'])
+async def import_services():
+    return await responder_importacion(ImportadorServicios)
+
+
+@app.route('/api/reservations/import', methods=['POST'])
+async def import_reservations():
+    return await responder_importacion(ImportadorReservas)
+
+# =======================================================
+# ENDPOINTS DE RESERVAS Y PAGOS
+# =======================================================
+
+@app.route('/api/reservation', methods=['POST'])
+async def create_reservation():
+    data = await request.get_json()
+    clave = request.headers.get('Idempotency-Key')
+    if clave is not None:
+        async def operacion(uow):
+            if data.get('pago'):
+                logica_reserva = ReservaConPagoAsync(data, transaccion_async)
+                return await logica_reserva.insertar(uow), logica_reserva.confirmar_efectos
+            logica_reserva = ReservaAsync(data, uow, uow.execute_atomic)
+            return await logica_reserva.insertar(), logica_reserva.confirmar_efectos
+        return await responder_idempotente(clave, data, operacion, 201, "Error al crear reserva.")
+
+    if data.get('pago'):
+        result = await ReservaConPagoAsync(data, transaccion_async).procesar()
+    else:
+        result = await ReservaAsync(data, execute_query_async, execute_atomic_async).crear_reserva()
+
+    if result.get("success", False):
+        return jsonify(result), 201
+    else:
+        return jsonify({"message": result.get("message", "Error al crear reserva.")}), 400
+
+
+@app.route('/api/availability', methods=['GET'])
+async def get_availability():
+    ids = [i for i in request.args.get('service_ids', '').split(',') if i]
+    data = {
+        'service_ids': ids,
+        'from': request.args.get('from'),
+        'to': request.args.get('to'),
+    }
+    catalogo = (await ServicioAsync(None, execute_query_async).obtener_todos())["data"]
+    result = await DisponibilidadAsync(data, execute_query_async, catalogo).consultar()
+
+    if result.get("success", False):
+        return jsonify(result["data"]), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al consultar disponibilidad.")}), 400
+
+
+@app.route('/api/history/<string:user_id>/<string:role>', methods=['GET'])
+@requiere_sesion
+async def get_user_history(user_id, role):
+    is_manager = g.sesion['role'] in ['Administrador', 'Proveedor']
+    if not is_manager and user_id != g.sesion['userId']:
+        return jsonify({"message": "No autorizado para ver el historial de otro usuario."}), 403
+
+    data_payload = {
+        'usuario_id': g.sesion['userId'],
+        'is_manager': is_manager
+    }
+    history_logic = HistorialReservasAsync(data_payload, execute_query_async, stream_query_async)
+
+    if request.args.get('stream') == 'ndjson':
+        # Igual que en server.py: los errores al abrir la consulta son 503/500
+        try:
+            reservas = await history_logic.iterar_historial()
+        except PoolAgotadoError:
+            respuesta = jsonify({"message": "Servicio saturado. Intente nuevamente en unos segundos."})
+            return respuesta, 503, {"Retry-After": str(ADMISION_REINTENTO)}
+        except StreamFallido:
+            return jsonify({"message": "Error CRÍTICO al cargar historial."}), 500
+
+        async def generar():
+            try:
+                async for reserva in reservas:
+                    yield (json.dumps(reserva, ensure_ascii=False) + "\n").encode("utf-8")
+            except StreamFallido:
+                yield (json.dumps({"error": "Descarga interrumpida por un error de la base de datos."}) + "\n").encode("utf-8")
+                raise
+        return generar(), 200, {"Content-Type": "application/x-ndjson"}
+
+    if 'limit' in request.args or 'cursor' in request.args:
+        result = await history_logic.obtener_pagina(request.args.get('limit'), request.args.get('cursor'))
+        if result.get("success", False):
+            return jsonify({
+                "data": result["data"],
+                "page_size": result["page_size"],
+                "next_cursor": result["next_cursor"],
+            }), 200
+        return jsonify({"message": result.get("message", "Error al cargar historial.")}), 400
+
+    result = await history_logic.obtener_historial()
+
+    if result.get("success", False):
+        return jsonify(result["data"]), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al cargar historial.")}), 400
+
+
+@app.route('/api/history/changes', methods=['GET'])
+@requiere_sesion
+async def get_history_changes():
+    data_payload = {
+        'usuario_id': g.sesion['userId'],
+        'is_manager': g.sesion['role'] in ['Administrador', 'Proveedor']
+    }
+    history_logic = HistorialReservasAsync(data_payload, execute_query_async)
+    result = await history_logic.obtener_cambios(request.args.get('since'), request.args.get('limit'))
+
+    if result.get("success", False):
+        return jsonify({
+            "data": result["data"],
+            "cursor": result["cursor"],
+            "has_more": result["hay_mas"],
+        }), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al consultar cambios.")}), 400
+
+
+@app.route('/api/process_payment', methods=['POST'])
+async def process_reservation_payment():
+    data = await request.get_json()
+    clave = request.headers.get('Idempotency-Key')
+    if clave is not None:
+        async def operacion(uow):
+            logica_pago = PagoAsync(data, uow)
+            return await logica_pago.insertar(), logica_pago.confirmar_efectos
+        return await responder_idempotente(clave, data, operacion, 200, "Error al procesar el pago.")
+
+    result = await PagoAsync(data, execute_query_async).procesar_pago()
+
+    if result.get("success", False):
+        return jsonify(result), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al procesar el pago.")}), 400
+
+
+@app.route('/api/payment/<string:pago_id>', methods=['GET'])
+@requiere_sesion
+async def get_payment(pago_id):
+    is_manager = g.sesion['role'] in ['Administrador', 'Proveedor']
+    result = await PagoAsync({}, execute_query_async).consultar(pago_id, g.sesion['userId'], is_manager)
+
+    if result.get("success", False):
+        return jsonify(result), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al consultar el pago.")}), 404
+
+
+# =======================================================
+# ENDPOINTS DE REPORTES
+# =======================================================
+
+@app.route('/api/reports', methods=['GET'])
+@requiere_sesion
+async def get_reports():
+    rol = g.sesion['role']
+    if rol not in ['Administrador', 'Proveedor']:
+        return jsonify({"message": "No autorizado."}), 403
+
+    actualizador_reportes.iniciar()
+    data = {
+        'from': request.args.get('from'),
+        'to': request.args.get('to'),
+        'service_ids': [i for i in request.args.get('service_ids', '').split(',') if i],
+        'provider_id': g.sesion['userId'] if rol == 'Proveedor' else None,
+    }
+    catalogo = (await ServicioAsync(None, execute_query_async).obtener_todos())["data"]
+    result = await ReportesAsync(data, execute_query_async, catalogo).consultar()
+
+    if result.get("success", False):
+        return jsonify(result["data"]), 200
+    else:
+        return jsonify({"message": result.get("message", "Error al consultar reportes.")}), 400
+
+
+if __name__ == '__main__':
+    print("Servidor ASGI (Quart) corriendo en http://0.0.0.0:5000/")
+    app.run(port=5000, host='0.0.0.0')
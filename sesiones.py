@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- Configuración de Sesiones ---
+SESION_TTL = 8 * 3600            # Vida de un token (segundos)
+SESION_MAX_ENTRADAS = 100000     # Capacidad del LRU en memoria
+SESION_LOCAL_TTL = 30            # Con almacén compartido: vigencia de la copia local
+SESIONES_DB_PATH = None          # Ruta SQLite compartida entre workers; None = solo memoria
+
+
+class AlmacenCompartido:
+    """
+    Almacén local (SQLite en disco) compartido por los workers de una misma
+    máquina, para que un token emitido por un worker sea válido en los demás.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            # Una conexión SQLite no se puede usar en el hijo de un fork: cada worker abre la suya
+            os.register_at_fork(after_in_child=self._olvidar_conexiones)
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sesiones (
+                    token TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    datos TEXT NOT NULL,
+                    expira REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sesiones_user ON sesiones (user_id)")
+
+    def _olvidar_conexiones(self):
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def guardar(self, token, sesion):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sesiones (token, user_id, datos, expira) VALUES (?, ?, ?, ?)",
+            (token, sesion["userId"], json.dumps(sesion), sesion["expira"]),
+        )
+
+    def obtener(self, token):
+        fila = self._conn().execute(
+            "SELECT datos FROM sesiones WHERE token = ? AND expira > ?", (token, time.time())
+        ).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def revocar_tokens(self, tokens):
+        self._conn().executemany("DELETE FROM sesiones WHERE token = ?", [(t,) for t in tokens])
+
+    def revocar_usuarios(self, user_ids):
+        conn = self._conn()
+        revocados = conn.execute(
+            f"SELECT token FROM sesiones WHERE user_id IN ({','.join('?' * len(user_ids))})", list(user_ids)
+        ).fetchall()
+        conn.executemany("DELETE FROM sesiones WHERE user_id = ?", [(u,) for u in user_ids])
+        return [f[0] for f in revocados]
+
+    def revocar_todo(self):
+        self._conn().execute("DELETE FROM sesiones")
+
+
+class AlmacenSesiones:
+    """
+    Sesiones por token en un LRU con TTL: resolver un token a (usuario, rol)
+    es O(1) y no consulta PostgreSQL. Opcionalmente se respalda en un
+    AlmacenCompartido para varios workers.
+    """
+
+    def __init__(self, ttl=SESION_TTL, max_entradas=SESION_MAX_ENTRADAS, compartido=None, reloj=time.time):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.compartido = compartido
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._sesiones = OrderedDict()      # token -> (sesion, vigente_hasta)
+        self._por_usuario = {}              # user_id -> set(tokens)
+        self.contadores = {"aciertos": 0, "fallos": 0, "creadas": 0, "revocadas": 0, "expulsadas": 0}
+
+    def _guardar_local(self, token, sesion, vigente_hasta):
+        self._sesiones[token] = (sesion, vigente_hasta)
+        self._sesiones.move_to_end(token)
+        self._por_usuario.setdefault(sesion["userId"], set()).add(token)
+        while len(self._sesiones) > self.max_entradas:
+            viejo, (sesion_vieja, _) = self._sesiones.popitem(last=False)
+            self._quitar_indice(viejo, sesion_vieja["userId"])
+            self.contadores["expulsadas"] += 1
+
+    def _quitar_indice(self, token, user_id):
+        tokens = self._por_usuario.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._por_usuario[user_id]
+
+    def crear(self, user_id, role, **extra):
+        """Emite un token nuevo para el usuario autenticado."""
+        token = secrets.token_urlsafe(32)
+        ahora = self.reloj()
+        sesion = dict(extra, userId=user_id, role=role, creada=ahora, expira=ahora + self.ttl)
+        vigente_hasta = sesion["expira"]
+        if self.compartido is not None:
+            # Igual que en obtener(): un logout en otro worker debe notarse también aquí
+            vigente_hasta = min(vigente_hasta, ahora + SESION_LOCAL_TTL)
+        with self._lock:
+            self._guardar_local(token, sesion, vigente_hasta)
+            self.contadores["creadas"] += 1
+        if self.compartido is not None:
+            self.compartido.guardar(token, sesion)
+        return token
+
+    def obtener(self, token):
+        """Retorna el dict de la sesión o None si el token no existe o expiró."""
+        if not token:
+            return None
+        ahora = self.reloj()
+        with self._lock:
+            entrada = self._sesiones.get(token)
+            if entrada is not None:
+                sesion, vigente_hasta = entrada
+                if vigente_hasta > ahora:
+                    self._sesiones.move_to_end(token)
+                    self.contadores["aciertos"] += 1
+                    return sesion
+                del self._sesiones[token]
+                self._quitar_indice(token, sesion["userId"])
+
+        sesion = self.compartido.obtener(token) if self.compartido is not None else None
+        with self._lock:
+            if sesion is None:
+                self.contadores["fallos"] += 1
+                return None
+            # La copia local dura poco para que las revocaciones de otros workers se noten
+            self._guardar_local(token, sesion, min(sesion["expira"], ahora + SESION_LOCAL_TTL))
+            self.contadores["aciertos"] += 1
+            return sesion
+
+    def revocar(self, tokens):
+        """Revoca uno o varios tokens."""
+        tokens = list(tokens)
+        with self._lock:
+            for token in tokens:
+                entrada = self._sesiones.pop(token, None)
+                if entrada is not None:
+                    self._quitar_indice(token, entrada[0]["userId"])
+                    self.contadores["revocadas"] += 1
+        if self.compartido is not None:
+            self.compartido.revocar_tokens(tokens)
+
+    def revocar_usuarios(self, user_ids):
+        """Revocación masiva: cierra todas las sesiones de los usuarios dados."""
+        user_ids = list(user_ids)
+        with self._lock:
+            for user_id in user_ids:
+                for token in self._por_usuario.pop(user_id, set()):
+                    self._sesiones.pop(token, None)
+                    self.contadores["revocadas"] += 1
+        if self.compartido is not None and user_ids:
+            revocados = self.compartido.revocar_usuarios(user_ids)
+            # Un obtener() concurrente pudo volver a copiar alguno desde el
+            # almacén compartido antes del DELETE: se quitan también del LRU
+            with self._lock:
+                for token in revocados:
+                    entrada = self._sesiones.pop(token, None)
+                    if entrada is not None:
+                        self._quitar_indice(token, entrada[0]["userId"])
+
+    def revocar_todas(self):
+        with self._lock:
+            self.contadores["revocadas"] += len(self._sesiones)
+            self._sesiones.clear()
+            self._por_usuario.clear()
+        if self.compartido is not None:
+            # Incluye las sesiones emitidas por los demás workers
+            self.compartido.revocar_todo()
+
+    def estadisticas(self):
+        with self._lock:
+            stats = dict(self.contadores)
+            consultas = stats["aciertos"] + stats["fallos"]
+            stats["activas"] = len(self._sesiones)
+            stats["hit_rate"] = stats["aciertos"] / consultas if consultas else 0.0
+            return stats
+
+
+def token_de_cabecera(valor):
+    """Extrae el token de una cabecera 'Authorization: Bearer <token>'."""
+    if not valor:
+        return None
+    partes = valor.split(None, 1)
+    if len(partes) == 2 and partes[0].lower() == "bearer":
+        return partes[1].strip()
+    return None
+
+
+# Instancia global del proceso
+almacen_sesiones = AlmacenSesiones(compartido=AlmacenCompartido(SESIONES_DB_PATH) if SESIONES_DB_PATH else None)
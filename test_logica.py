@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# Pruebas unitarias (caja blanca) de logica.py y de las piezas en memoria que
+# usa: sin BD, con ejecutores simulados (benchmark.EjecutorEnMemoria).
+from datetime import date, datetime
+
+import pytest
+
+import cambios
+import datos_sinteticos
+from admision import LimitadorTasa
+from benchmark import EjecutorEnMemoria
+from busqueda_catalogo import IndiceCatalogo
+from cache_catalogo import CacheCatalogo
+from configuracion_db import PoolConexiones, PoolAgotadoError
+from idempotencia import RegistroIdempotencia, huella_solicitud
+from importacion import ImportadorReservas
+from liquidacion import LiquidadorPagos
+from logica import HistorialReservas, Reserva
+
+# =======================================================
+# SINCRONIZACIÓN INCREMENTAL (obtener_cambios / _armar_cambios)
+# =======================================================
+
+def _fila(cambio_tx, reserva_id):
+    """Fila de _consulta_cambios sin el xmin: las 9 columnas del historial y cambio_tx."""
+    return (reserva_id, "Servicio", datetime(2025, 1, 1, 10, 0), "Confirmada",
+            None, None, None, "Cliente", "u1", cambio_tx)
+
+
+class TablaCambios:
+    """Ejecutor simulado: aplica a una lista de filas el filtro, orden y límite de _consulta_cambios."""
+
+    def __init__(self, xmin):
+        self.xmin = xmin
+        self.filas = []
+
+    def __call__(self, query, params, fetch_all=False):
+        ultimo_tx, ultimo_id, limite = params[0], params[3], params[-1]
+        visibles = sorted((f for f in self.filas if (f[9], f[0]) > (ultimo_tx, ultimo_id)), key=lambda f: (f[9], f[0]))
+        return [(self.xmin,) + f for f in visibles[:limite]] or [(self.xmin,) + (None,) * 10]
+
+
+def _ids(resultado):
+    return [r["id_reserva"] for r in resultado["data"]]
+
+
+def test_armar_cambios_no_avanza_el_cursor_mas_alla_del_xmin():
+    historial = HistorialReservas({'is_manager': True}, None)
+    resultados = [(100,) + _fila(101, "a"), (100,) + _fila(102, "b")]
+
+    primera = historial._armar_cambios(resultados, (100, 100, ""), 2)
+    assert primera["hay_mas"]
+    assert cambios.decodificar_cursor(primera["cursor"]) == (100, 102, "b")
+
+    # Fin de la pasada: se reanuda desde el xmin retenido, no desde la última fila
+    ultima = historial._armar_cambios([(100,) + _fila(103, "c")], (100, 102, "b"), 2)
+    assert not ultima["hay_mas"]
+    assert cambios.decodificar_cursor(ultima["cursor"]) == (100, 100, "")
+
+
+def test_armar_cambios_conserva_el_menor_xmin_de_la_pasada():
+    historial = HistorialReservas({'is_manager': True}, None)
+    # Una página posterior ve un xmin mayor: el seguro sigue siendo el de la primera
+    pagina = historial._armar_cambios([(150,) + _fila(120, "x"), (150,) + _fila(130, "y")], (100, 110, "w"), 2)
+    assert cambios.decodificar_cursor(pagina["cursor"]) == (100, 130, "y")
+    fin = historial._armar_cambios([(150,) + (None,) * 10], (100, 130, "y"), 2)
+    assert cambios.decodificar_cursor(fin["cursor"]) == (100, 100, "")
+
+
+def test_obtener_cambios_con_xmin_retenido_en_varias_paginas_no_salta_cambios():
+    tabla = TablaCambios(xmin=100)        # La transacción 100 sigue abierta
+    historial = HistorialReservas({'is_manager': True}, tabla)
+    cursor = historial.obtener_cambios(None)["cursor"]
+    tabla.filas = [_fila(tx, chr(ord("a") + tx - 101)) for tx in range(101, 106)]
+
+    vistos = []
+    while True:
+        resultado = historial.obtener_cambios(cursor, 2)
+        vistos += _ids(resultado)
+        cursor = resultado["cursor"]
+        if not resultado["hay_mas"]:
+            break
+    assert vistos == ["a", "b", "c", "d", "e"]
+
+    # La transacción 100 confirma después de paginar por encima de ella
+    tabla.filas.append(_fila(100, "z"))
+    tabla.xmin = 106
+    resultado = historial.obtener_cambios(cursor, 10)
+    assert "z" in _ids(resultado)
+    assert cambios.decodificar_cursor(resultado["cursor"]) == (106, 106, "")
+
+
+def test_obtener_cambios_sin_cursor_solo_retorna_el_xmin():
+    tabla = TablaCambios(xmin=42)
+    tabla.filas = [_fila(41, "a")]
+    resultado = HistorialReservas({'is_manager': True}, tabla).obtener_cambios(None)
+    assert resultado["data"] == []
+    assert cambios.decodificar_cursor(resultado["cursor"]) == (42, 42, "")
+
+
+def test_decodificar_cursor_rechaza_el_formato_anterior():
+    anterior = cambios.base64.urlsafe_b64encode(b"77|r1").decode("ascii")
+    with pytest.raises(ValueError):
+        cambios.decodificar_cursor(anterior)
+    assert cambios.decodificar_cursor(cambios.codificar_cursor(5, 9, "r2")) == (5, 9, "r2")
+
+# =======================================================
+# ADMISIÓN (LimitadorTasa)
+# =======================================================
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self):
+        return self.ahora
+
+
+def test_limitador_agota_la_rafaga_y_recarga_con_el_tiempo():
+    reloj = Reloj()
+    limitador = LimitadorTasa({"/api/login": (0.5, 2)}, reloj=reloj)
+    assert limitador.consumir("/api/login", "u1") == 0
+    assert limitador.consumir("/api/login", "u1") == 0
+    assert limitador.consumir("/api/login", "u1") == pytest.approx(2.0)
+    # Otro usuario tiene su propio cubo
+    assert limitador.consumir("/api/login", "u2") == 0
+
+    reloj.ahora = 2.0
+    assert limitador.consumir("/api/login", "u1") == 0
+    assert limitador.consumir("/api/login", "u1") > 0
+
+
+def test_limitador_sin_limite_para_la_ruta_y_lru_de_claves():
+    limitador = LimitadorTasa({"/api/login": (1.0, 1)}, max_claves=2, reloj=Reloj())
+    assert limitador.consumir("/api/services", "u1") == 0
+    for clave in ("a", "b", "c"):
+        limitador.consumir("/api/login", clave)
+    assert limitador.estadisticas() == {"claves": 2}
+    # "a" fue expulsada: vuelve con la ráfaga completa
+    assert limitador.consumir("/api/login", "a") == 0
+
+# =======================================================
+# POOL DE CONEXIONES
+# =======================================================
+
+class ConexionFalsa:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+def _pool(max_size=2):
+    creadas = []
+
+    def conectar():
+        creadas.append(ConexionFalsa())
+        return creadas[-1]
+    return PoolConexiones(conectar, min_size=0, max_size=max_size, timeout=0), creadas
+
+
+def test_pool_reutiliza_la_conexion_devuelta():
+    pool, creadas = _pool()
+    conn = pool.obtener()
+    pool.devolver(conn)
+    assert pool.obtener() is conn
+    assert len(creadas) == 1
+    assert pool.estadisticas()["en_uso"] == 1
+
+
+def test_pool_agotado_lanza_error():
+    pool, _ = _pool(max_size=1)
+    pool.obtener()
+    with pytest.raises(PoolAgotadoError):
+        pool.obtener()
+    assert pool.estadisticas()["timeouts"] == 1
+
+
+def test_pool_descarta_y_libera_el_hueco():
+    pool, creadas = _pool(max_size=1)
+    conn = pool.obtener()
+    pool.devolver(conn, descartar=True)
+    assert conn.closed
+    otra = pool.obtener()
+    assert otra is not conn and len(creadas) == 2
+
+    # Una conexión que llega cerrada también se descarta
+    otra.close()
+    pool.devolver(otra)
+    stats = pool.estadisticas()
+    assert stats["descartadas"] == 2 and stats["abiertas"] == 0
+
+
+def test_pool_sin_conexion_devuelve_none_y_no_pierde_el_hueco():
+    pool = PoolConexiones(lambda: None, min_size=0, max_size=1, timeout=0)
+    assert pool.obtener() is None
+    assert pool.estadisticas()["abiertas"] == 0
+
+# =======================================================
+# CARGA MASIVA (ImportadorReservas.validar)
+# =======================================================
+
+def _fila_reserva(**cambios_fila):
+    fila = {"usuarioId": "u1", "serviceId": "s1", "slotTime": "2025-03-10T10:00:00", "status": "Confirmada"}
+    fila.update(cambios_fila)
+    return fila
+
+
+def test_importador_reservas_valida_y_acumula_rango_y_servicios():
+    importador = ImportadorReservas([], None)
+    valores = importador.validar(_fila_reserva())
+    assert valores[1:] == ("u1", "s1", datetime(2025, 3, 10, 10, 0), "Confirmada")
+    importador.validar(_fila_reserva(serviceId="s2", slotTime="2025-01-05 09:00"))
+    assert (importador.dia_min, importador.dia_max) == (date(2025, 1, 5), date(2025, 3, 10))
+    assert importador.servicios == {"s1", "s2"}
+
+
+@pytest.mark.parametrize("fila", [
+    _fila_reserva(status=""),
+    _fila_reserva(slotTime="no es una fecha"),
+    _fila_reserva(usuarioId="u" * 51),
+])
+def test_importador_reservas_rechaza_filas_invalidas(fila):
+    with pytest.raises(ValueError):
+        ImportadorReservas([], None).validar(fila)
+
+# =======================================================
+# CATÁLOGO (IndiceCatalogo y CacheCatalogo)
+# =======================================================
+
+def _servicio(id_, nombre, precio, duracion, categoria="Salud", modalidad="Virtual"):
+    return {"id": id_, "providerId": "p", "expertName": "Experta", "name": nombre, "price": precio,
+            "duration": duracion, "capacity": 1, "modality": modalidad, "desc": "", "image": None,
+            "category": categoria}
+
+
+def test_indice_busca_por_prefijo_filtros_y_orden():
+    indice = IndiceCatalogo()
+    assert indice.reemplazar([
+        _servicio("a", "Yoga suave", 20.0, 60),
+        _servicio("b", "Yoga intenso", 35.0, 90, modalidad="Presencial"),
+        _servicio("c", "Masaje", 50.0, 30, categoria="Belleza"),
+    ], version=0)
+    assert indice.vigente()
+
+    total, pagina = indice.buscar(texto="yog", orden="price", descendente=True)
+    assert total == 2 and [s["id"] for s in pagina] == ["b", "a"]
+    total, pagina = indice.buscar(categoria="belleza")
+    assert [s["id"] for s in pagina] == ["c"]
+    total, pagina = indice.buscar(precio_min=30, precio_max=50, modalidad="virtual")
+    assert [s["id"] for s in pagina] == ["c"]
+    total, pagina = indice.buscar(orden="duration", pagina=2, limite=2)
+    assert total == 3 and [s["id"] for s in pagina] == ["b"]
+
+
+def test_indice_no_reemplaza_con_un_catalogo_anterior_a_un_agregar():
+    indice = IndiceCatalogo()
+    indice.reemplazar([_servicio("a", "Yoga", 20.0, 60)], version=1)
+    # Un Servicio.crear invalida el cache (versión 2) y agrega al índice...
+    indice.agregar(_servicio("n", "Pilates", 25.0, 45), version=2)
+    # ...mientras una recarga concurrente leyó el catálogo con la versión 1
+    indice.invalidar()
+    assert not indice.reemplazar([_servicio("a", "Yoga", 20.0, 60)], version=1)
+    assert not indice.vigente()
+    assert indice.buscar(texto="pilates")[0] == 1
+
+
+def test_cache_catalogo_almacena_solo_si_no_hubo_invalidacion():
+    cache = CacheCatalogo()
+    version = cache.version
+    datos, cuerpo, etag = cache.almacenar([{"id": "a"}], version)
+    assert etag is not None and cache.leer() == (datos, cuerpo, etag)
+
+    version = cache.version
+    cache.invalidar()
+    # Lo leído antes del invalidar() se responde pero no se guarda
+    assert cache.almacenar([{"id": "viejo"}], version)[0] == [{"id": "viejo"}]
+    assert cache.leer() is None
+
+# =======================================================
+# IDEMPOTENCIA, RESERVAS Y LIQUIDACIÓN (EjecutorEnMemoria)
+# =======================================================
+
+@pytest.fixture
+def bd():
+    return EjecutorEnMemoria(datos_sinteticos.generar(usuarios=5, servicios=2, reservas=10, semilla=1))
+
+
+def _operacion(llamadas):
+    def operacion(uow):
+        llamadas.append(uow)
+        return 201, {"success": True, "n": len(llamadas)}, None
+    return operacion
+
+
+def test_idempotencia_repite_la_respuesta_sin_volver_a_ejecutar(bd):
+    llamadas = []
+    huella = huella_solicitud({"serviceId": "s1"})
+    registro = RegistroIdempotencia()
+    assert registro.ejecutar(bd.transaccion, "r|u1", "k1", huella, _operacion(llamadas)) == \
+        (201, {"success": True, "n": 1}, False)
+    assert registro.ejecutar(bd.transaccion, "r|u1", "k1", huella, _operacion(llamadas)) == \
+        (201, {"success": True, "n": 1}, True)
+
+    # Otro worker (sin la respuesta en su LRU) la lee de claves_idempotencia
+    otro = RegistroIdempotencia()
+    assert otro.ejecutar(bd.transaccion, "r|u1", "k1", huella, _operacion(llamadas))[2]
+    assert len(llamadas) == 1
+
+
+def test_idempotencia_rechaza_la_misma_clave_con_otro_cuerpo(bd):
+    registro = RegistroIdempotencia()
+    registro.ejecutar(bd.transaccion, "r|u1", "k1", huella_solicitud({"a": 1}), _operacion([]))
+    codigo, _, repetida = registro.ejecutar(bd.transaccion, "r|u1", "k1", huella_solicitud({"a": 2}), _operacion([]))
+    assert (codigo, repetida) == (422, False)
+    # El orden de las claves del cuerpo no cambia la huella
+    assert huella_solicitud({"a": 1, "b": 2}) == huella_solicitud({"b": 2, "a": 1})
+
+
+def test_idempotencia_no_guarda_los_fallos(bd):
+    llamadas = []
+
+    def fallida(uow):
+        llamadas.append(uow)
+        return 400, {"message": "Sin cupo."}, None
+    registro = RegistroIdempotencia()
+    registro.ejecutar(bd.transaccion, "r|u1", "k1", "h", fallida)
+    assert registro.ejecutar(bd.transaccion, "r|u1", "k1", "h", _operacion(llamadas)) == \
+        (201, {"success": True, "n": 2}, False)
+
+
+def _datos_reserva(bd):
+    return {"usuarioId": "u1", "serviceId": next(iter(bd.servicios)), "slotTime": "2030-01-01T10:00:00",
+            "status": "Confirmada", "userEmail": "u1@bench.local", "serviceName": "Servicio"}
+
+
+def test_reserva_sin_execute_atomic_lanza_runtime_error(bd):
+    def solo_consultas(query, params=None, **kwargs):
+        return 1
+    with pytest.raises(RuntimeError):
+        Reserva(_datos_reserva(bd), solo_consultas).insertar()
+    # Con una unidad de trabajo se usa su execute_atomic
+    assert Reserva(_datos_reserva(bd), bd).insertar()["success"]
+
+
+class PasarelaFija:
+    def __init__(self, estado):
+        self.estado = estado
+
+    def cobrar_lote(self, pagos):
+        return [self.estado] * len(pagos)
+
+
+def test_liquidar_dos_veces_no_cambia_un_pago_ya_liquidado(bd):
+    pago_id, pago = next((i, p) for i, p in bd.pagos.items() if p[4] == "PENDIENTE")
+    lote = [{"id": pago_id, "reserva_id": pago[1], "monto": pago[2], "metodo": pago[3]}]
+
+    LiquidadorPagos(PasarelaFija("APROBADO"), bd.transaccion).liquidar(lote)
+    assert bd.pagos[pago_id][4] == "APROBADO"
+    # Una respuesta tardía o repetida de la pasarela no lo vuelve a tocar
+    LiquidadorPagos(PasarelaFija("RECHAZADO"), bd.transaccion).liquidar(lote)
+    assert bd.pagos[pago_id][4] == "APROBADO"
+
+
+def test_liquidar_sin_respuesta_no_escribe(bd):
+    pago_id, pago = next((i, p) for i, p in bd.pagos.items() if p[4] == "PENDIENTE")
+    liquidador = LiquidadorPagos(PasarelaFija(None), bd.transaccion)
+    assert liquidador.liquidar([{"id": pago_id, "reserva_id": pago[1], "monto": pago[2], "metodo": pago[3]}]) == 0
+    assert bd.pagos[pago_id][4] == "PENDIENTE"
+    assert liquidador.estadisticas()["sin_respuesta"] == 1